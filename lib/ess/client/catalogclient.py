@@ -76,6 +76,30 @@ class CatalogClient(BaseRestClient):
         r = self.get_request_response(url, type='GET')
         return r
 
+    def get_contents_best_match(self, ranges, status=None, edge_name=None):
+        """
+        Get the contents of many files or partial files from the Head service in one call.
+
+        :param ranges: List of (scope, name, min_id, max_id).
+        :param status: The status of the contents.
+        :param edge_name: The edge name.
+
+        :raise exceptions if it's not got successfully.
+        :returns: list of contents in the order of the ranges, None for the ranges without a content.
+        """
+        path = self.CATALOG_BASEURL
+
+        url = self.build_url(self.host, path=os.path.join(path, 'contents_match'))
+
+        data = {'ranges': [list(rng) for rng in ranges]}
+        if status:
+            data['status'] = status
+        if edge_name:
+            data['edge_name'] = edge_name
+
+        r = self.get_request_response(url, type='POST', data=data)
+        return r
+
     def add_contents(self, collection_scope, collection_name, edge_name, files):
         """
         Synchronize the contents to the Head service.
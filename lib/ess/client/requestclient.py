@@ -50,6 +50,27 @@ class RequestClient(BaseRestClient):
         r = self.get_request_response(url, type='POST', data=data)
         return r['request_id']
 
+    def add_requests(self, requests, coalesce=True, chunk_size=10000):
+        """
+        Add requests in bulk to the Head service, sent in chunks.
+
+        :param requests: list of dictionaries of the attributes of the requests.
+        :param coalesce: subscribe the requests to the requests in flight for the same data.
+        :param chunk_size: number of requests sent at once.
+
+        :raise exceptions if a chunk is not registerred successfully.
+
+        :returns: list of the results of the requests, in their order: dictionaries with the result
+                  (created, duplicate or invalid) and the request_id.
+        """
+        path = self.REQUEST_BASEURL
+        url = self.build_url(self.host, path=os.path.join(path, 'bulk'), params={'coalesce': str(coalesce).lower()})
+
+        results = []
+        for i in range(0, len(requests), chunk_size):
+            results += self.get_request_response(url, type='POST', data=requests[i:i + chunk_size])
+        return results
+
     def update_request(self, request_id, **kwargs):
         """
         Update Request to the Head service.
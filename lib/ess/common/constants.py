@@ -15,12 +15,15 @@ Constants.
 
 class Sections:
     Main = 'main'
+    Archiver = 'archiver'
     Assigner = 'assigner'
     BaseDaemon = 'basedaemon'
     Broker = 'broker'
+    Common = 'common'
     Finisher = 'finisher'
     PreCacher = 'precacher'
     ResourceManager = 'resourcemanager'
+    Rest = 'rest'
     Splitter = 'splitter'
     Stager = 'stager'
 
@@ -10,8 +10,10 @@
 
 
 import datetime
+import json
 import logging
 import os
+import re
 import requests
 import subprocess
 import sys
@@ -22,6 +24,9 @@ from ess.common.config import config_has_section, config_has_option, config_get
 # RFC 1123
 DATE_FORMAT = '%a, %d %b %Y %H:%M:%S UTC'
 
+# the whitespaces between the json items
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
 
 def setup_logging(name):
     """
@@ -174,3 +179,57 @@ def urlretrieve(url, dest, timeout=300):
             return 0
         else:
             return -1
+
+
+def iter_json_array(stream, size=None, read_size=65536):
+    """
+    Iterate over the items of a json array read from a stream, without reading the whole array first.
+
+    :param stream: A file-like object with a read method.
+    :param size: Number of bytes to read from the stream at most, for example the content length.
+    :param read_size: Number of bytes to read at once.
+
+    :raises ValueError: If the stream is not a json array.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+    # '[' before the array, 'item]' after '[', 'item' after ',', ',]' after an item
+    expected = '['
+    while True:
+        pos = JSON_WHITESPACE.match(buf, pos).end()
+
+        read_more = pos == len(buf)
+        if not read_more and expected in ('item]', 'item') and not (expected == 'item]' and buf[pos] == ']'):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # an item is complete when a separator or a whitespace follows, a number may go on in the next read
+                read_more = not eof and not (end < len(buf) and buf[end] in ',] \t\n\r')
+            except ValueError:
+                if eof:
+                    raise
+                read_more = True
+            if not read_more:
+                pos, expected = end, ',]'
+                yield item
+                continue
+
+        if read_more:
+            if eof:
+                raise ValueError("Unexpected end of the json array")
+            length = read_size if size is None else min(read_size, size)
+            chunk = stream.read(length) if length > 0 else ''
+            if size is not None:
+                size -= len(chunk)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            continue
+
+        char = buf[pos]
+        pos += 1
+        if expected == '[' and char == '[':
+            expected = 'item]'
+        elif expected in ('item]', ',]') and char == ']':
+            return
+        elif expected == ',]' and char == ',':
+            expected = 'item'
+        else:
+            raise ValueError("Unexpected character %r in the json array" % char)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+operations related to the archival of the contents and the requests in a terminal status.
+They are moved in bounded batches to the archive tables, so that the hot tables only hold the active work.
+"""
+
+import datetime
+
+from sqlalchemy import DateTime, and_, literal, select
+from sqlalchemy.exc import DatabaseError
+
+from ess.common import exceptions
+from ess.core.counters import add_counter_delta, get_counter_snapshot, update_content_counters
+from ess.orm.constants import ContentStatus, RequestStatus
+from ess.orm.models import (CollectionContent, CollectionContentArchive, Request, RequestArchive, RequestDataKey,
+                            RequestSubscription)
+from ess.orm.session import transactional_session
+from ess.orm.utils import DEFAULT_CHUNK_SIZE, chunks
+
+
+# the statuses of the contents and of the requests which are not processed anymore
+ARCHIVE_CONTENT_STATUSES = [ContentStatus.REMOVED]
+ARCHIVE_REQUEST_STATUSES = [RequestStatus.AVAILABLE, RequestStatus.ERROR]
+
+# seconds since the last update of a content or a request before it is archived
+DEFAULT_ARCHIVE_AGE = 7 * 24 * 3600
+DEFAULT_ARCHIVE_BATCH_SIZE = 1000
+
+
+def _move_rows(table, archive_table, criteria, archived_at, session=None):
+    """
+    Copy the rows of a table to its archive table, then delete them.
+    """
+    columns = [column.name for column in table.c]
+    query = select([table.c[column] for column in columns] + [literal(archived_at, DateTime)]).where(criteria)
+    session.execute(archive_table.insert().from_select(columns + ['archived_at'], query))
+    session.execute(table.delete().where(criteria))
+
+
+@transactional_session
+def archive_contents(statuses=None, older_than=DEFAULT_ARCHIVE_AGE, limit=DEFAULT_ARCHIVE_BATCH_SIZE, edge_id=None, session=None):
+    """
+    Move a batch of contents in a terminal status, not updated for a while, to the archive table.
+    The content counters of the archived contents are decreased.
+
+    :param statuses: The statuses of the contents to archive. ARCHIVE_CONTENT_STATUSES by default.
+    :param older_than: Seconds since the last update of the contents.
+    :param limit: Maximum number of contents to archive.
+    :param edge_id: The id of the Edge, to only archive the contents of an edge.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: number of archived contents.
+    """
+    statuses = [ContentStatus.normalize(status) for status in (statuses or ARCHIVE_CONTENT_STATUSES)]
+    updated_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than)
+
+    table = CollectionContent.__table__
+    query = select([table.c.content_id]).where(and_(table.c.status.in_(statuses), table.c.updated_at < updated_before))
+    if edge_id:
+        query = query.where(table.c.edge_id == edge_id)
+    query = query.order_by(table.c.content_id).limit(limit)
+    try:
+        content_ids = [row[0] for row in session.execute(query)]
+        if not content_ids:
+            return 0
+
+        # lock the contents and keep the ones which are still in a terminal status
+        snapshot = get_counter_snapshot(content_ids, session=session)
+        content_ids = sorted([content_id for content_id, row in snapshot.items() if row[3] in statuses])
+
+        archived_at = datetime.datetime.utcnow()
+        for chunk in chunks(content_ids, DEFAULT_CHUNK_SIZE):
+            _move_rows(table, CollectionContentArchive.__table__, table.c.content_id.in_(chunk), archived_at, session=session)
+
+        deltas = {}
+        for content_id in content_ids:
+            edge_id, coll_id, content_type, status, pfn_size = snapshot[content_id]
+            add_counter_delta(deltas, edge_id, coll_id, content_type, status, -1, -(pfn_size or 0))
+        update_content_counters(deltas, session=session)
+        return len(content_ids)
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+
+def _delete_request_links(request_ids, session=None):
+    """
+    Delete the data keys and the subscriptions of archived requests, which are only needed to coalesce the requests in flight.
+    """
+    data_keys, subscriptions = RequestDataKey.__table__, RequestSubscription.__table__
+    session.execute(data_keys.delete().where(data_keys.c.request_id.in_(request_ids)))
+    session.execute(subscriptions.delete().where(subscriptions.c.request_id.in_(request_ids)))
+    session.execute(subscriptions.delete().where(subscriptions.c.primary_request_id.in_(request_ids)))
+
+
+@transactional_session
+def archive_requests(statuses=None, older_than=DEFAULT_ARCHIVE_AGE, limit=DEFAULT_ARCHIVE_BATCH_SIZE, edge_id=None, session=None):
+    """
+    Move a batch of requests in a terminal status, not updated for a while, to the archive table.
+    Their data keys and subscriptions are deleted.
+
+    :param statuses: The statuses of the requests to archive. ARCHIVE_REQUEST_STATUSES by default.
+    :param older_than: Seconds since the last update of the requests.
+    :param limit: Maximum number of requests to archive.
+    :param edge_id: The id of the Edge, to only archive the requests of an edge.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: number of archived requests.
+    """
+    statuses = [RequestStatus.normalize(status) for status in (statuses or ARCHIVE_REQUEST_STATUSES)]
+    updated_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than)
+
+    table = Request.__table__
+    query = select([table.c.request_id]).where(and_(table.c.status.in_(statuses), table.c.updated_at < updated_before))
+    if edge_id:
+        query = query.where(table.c.edge_id == edge_id)
+    query = query.order_by(table.c.request_id).limit(limit)
+    try:
+        request_ids = [row[0] for row in session.execute(query)]
+
+        archived_at = datetime.datetime.utcnow()
+        archived = 0
+        for chunk in chunks(request_ids, DEFAULT_CHUNK_SIZE):
+            # lock the requests and keep the ones which are still in a terminal status
+            criteria = and_(table.c.request_id.in_(chunk), table.c.status.in_(statuses))
+            locked_ids = [row[0] for row in session.execute(select([table.c.request_id]).where(criteria).with_for_update())]
+            if locked_ids:
+                _move_rows(table, RequestArchive.__table__, table.c.request_id.in_(locked_ids), archived_at, session=session)
+                _delete_request_links(locked_ids, session=session)
+                archived += len(locked_ids)
+        return archived
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+
+@transactional_session
+def purge_archives(older_than, limit=DEFAULT_ARCHIVE_BATCH_SIZE, session=None):
+    """
+    Delete a batch of the archived contents and requests archived for a while.
+    When the archive tables are partitioned by archived_at, dropping the old partitions is cheaper.
+
+    :param older_than: Seconds since the archival.
+    :param limit: Maximum number of contents and of requests to delete.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: number of deleted archived contents and requests.
+    """
+    archived_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than)
+
+    purged = 0
+    try:
+        for table, key in ((CollectionContentArchive.__table__, 'content_id'), (RequestArchive.__table__, 'request_id')):
+            query = select([table.c[key]]).where(table.c.archived_at < archived_before).order_by(table.c[key]).limit(limit)
+            ids = [row[0] for row in session.execute(query)]
+            for chunk in chunks(ids, DEFAULT_CHUNK_SIZE):
+                session.execute(table.delete().where(and_(table.c[key].in_(chunk), table.c.archived_at < archived_before)))
+            purged += len(ids)
+        return purged
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
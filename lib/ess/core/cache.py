@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+In-process caches for the identity lookups (edge name to edge id, collection scope:name to collection id)
+and for the available content ranges of files.
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+from ess.common.config import config_get_int, config_has_option
+from ess.common.constants import Sections
+
+
+DEFAULT_CACHE_TTL = 600
+DEFAULT_CACHE_MAX_SIZE = 10000
+
+
+class TTLCache(object):
+    """
+    Thread-safe LRU cache whose entries expire after a time to live.
+    """
+
+    def __init__(self, ttl=DEFAULT_CACHE_TTL, max_size=DEFAULT_CACHE_MAX_SIZE):
+        """
+        :param ttl: Time to live of an entry in seconds.
+        :param max_size: Maximum number of entries. The least recently used entry is evicted first.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Get the value of a key, or the default value if the key is not cached or expired.
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[1] < time.time():
+                self.misses += 1
+                return default
+            # reinsert to mark it as the most recently used
+            self._items[key] = item
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        """
+        Cache the value of a key.
+        """
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time() + self.ttl)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Remove a key from the cache.
+        """
+        with self._lock:
+            self._items.pop(key, None)
+
+    def invalidate_value(self, value):
+        """
+        Remove all keys with the value from the cache.
+        """
+        with self._lock:
+            for key in [key for key, item in self._items.items() if item[0] == value]:
+                del self._items[key]
+
+    def clear(self):
+        """
+        Remove all entries and reset the statistics.
+        """
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+        Get the statistics of the cache.
+
+        :returns: dictionary of size, hits, misses and evictions.
+        """
+        with self._lock:
+            return {'size': len(self._items),
+                    'max_size': self.max_size,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+class IntervalTree(object):
+    """
+    Static centered interval tree to find the narrowest interval containing a range.
+    """
+
+    def __init__(self, intervals):
+        """
+        :param intervals: List of (start, end, item). On equal widths, the earlier interval is preferred.
+        """
+        self.size = len(intervals)
+        self._root = self._build([(start, end, seq, item) for seq, (start, end, item) in enumerate(intervals)])
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+
+        points = sorted([interval[0] for interval in intervals] + [interval[1] for interval in intervals])
+        center = points[len(points) // 2]
+        left, right, overlap = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                overlap.append(interval)
+        return (center,
+                sorted(overlap, key=lambda interval: interval[0]),
+                sorted(overlap, key=lambda interval: interval[1], reverse=True),
+                self._build(left),
+                self._build(right))
+
+    def _stab(self, point):
+        """
+        Get the intervals containing a point.
+        """
+        node = self._root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if point < center:
+                for interval in by_start:
+                    if interval[0] > point:
+                        break
+                    yield interval
+                node = left
+            else:
+                for interval in by_end:
+                    if interval[1] < point:
+                        break
+                    yield interval
+                node = right
+
+    def best_match(self, start, end):
+        """
+        Get the item of the narrowest interval containing [start, end].
+
+        :returns: the item or None.
+        """
+        best = None
+        for interval in self._stab(start):
+            if interval[1] >= end and (best is None or
+                                       (interval[1] - interval[0], interval[2]) < (best[1] - best[0], best[2])):
+                best = interval
+        return best[3] if best else None
+
+
+def _get_cache_config(option, default, section=Sections.Common):
+    if config_has_option(section, option):
+        return config_get_int(section, option)
+    return default
+
+
+EDGE_ID_CACHE = TTLCache(ttl=_get_cache_config('cache_ttl', DEFAULT_CACHE_TTL),
+                         max_size=_get_cache_config('cache_max_size', DEFAULT_CACHE_MAX_SIZE))
+COLLECTION_ID_CACHE = TTLCache(ttl=_get_cache_config('cache_ttl', DEFAULT_CACHE_TTL),
+                               max_size=_get_cache_config('cache_max_size', DEFAULT_CACHE_MAX_SIZE))
+
+# interval trees of the available contents of a file, disabled unless content_range_cache_ttl is set
+CONTENT_RANGE_CACHE = TTLCache(ttl=_get_cache_config('content_range_cache_ttl', 0, section=Sections.Rest),
+                               max_size=_get_cache_config('content_range_cache_max_size', 1000, section=Sections.Rest))
+
+
+def get_cache_stats():
+    """
+    Get the statistics of the identity caches.
+
+    :returns: dictionary of cache name to statistics.
+    """
+    return {'edge_id': EDGE_ID_CACHE.stats(),
+            'collection_id': COLLECTION_ID_CACHE.stats(),
+            'content_range': CONTENT_RANGE_CACHE.stats()}
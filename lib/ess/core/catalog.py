@@ -13,18 +13,35 @@
 operations related to collections and collection content.
 """
 
+import datetime
+import logging
+import os
+import socket
+
 import sqlalchemy
 import sqlalchemy.orm
 
-from sqlalchemy import and_, func
+from sqlalchemy import and_, bindparam, case, func, literal, or_, select
 from sqlalchemy.exc import DatabaseError, IntegrityError
 
 from ess.common import exceptions
+from ess.core.cache import COLLECTION_ID_CACHE, CONTENT_RANGE_CACHE, IntervalTree
+from ess.core.counters import (add_counter_delta, delete_content_counters, get_content_counters, get_counter_snapshot,
+                               get_replicas_files, update_content_counters)
 from ess.core.edges import get_edge_id
 from ess.orm import models
 from ess.orm.constants import CollectionType, CollectionStatus, ContentType, ContentStatus, CollectionReplicasStatus
 from ess.orm.models import CollectionContent
-from ess.orm.session import read_session, transactional_session
+from ess.orm.session import read_session, stream_session, transactional_session
+from ess.orm.utils import (BAKERY, DEFAULT_CHUNK_SIZE, bulk_insert_ignore, chunks, get_record_class, project_columns,
+                           run_baked_query, select_records)
+
+
+# the columns of the contents which change the content counters
+COUNTED_COLUMNS = set(['edge_id', 'coll_id', 'content_type', 'status', 'pfn_size'])
+
+# the columns of the claimed contents needed to update the counters and to order them
+CLAIM_COLUMNS = ['content_id', 'edge_id', 'coll_id', 'content_type', 'pfn_size', 'priority']
 
 
 @transactional_session
@@ -48,11 +65,9 @@ def add_collection(scope, name, collection_type=CollectionType.DATASET, coll_siz
 
     :returns: collection id.
     """
-    if isinstance(collection_type, str) or isinstance(collection_type, unicode):
-        collection_type = CollectionType.from_sym(str(collection_type))
+    collection_type = CollectionType.normalize(collection_type)
 
-    if isinstance(global_status, str) or isinstance(global_status, unicode):
-        global_status = CollectionStatus.from_sym(str(global_status))
+    global_status = CollectionStatus.normalize(global_status)
 
     new_collection = models.Collection(scope=scope, name=name, collection_type=collection_type, coll_size=coll_size, global_status=global_status,
                                        total_files=total_files, num_replicas=num_replicas, coll_metadata=coll_metadata)
@@ -100,6 +115,9 @@ def update_collection(scope, name, parameters=None, coll_id=None, session=None):
            (isinstance(parameters['global_status'], str) or isinstance(parameters['global_status'], unicode)):
             parameters['global_status'] = CollectionStatus.from_sym(str(parameters['global_status']))
 
+        if 'scope' in parameters or 'name' in parameters:
+            COLLECTION_ID_CACHE.invalidate_value(collection.coll_id)
+
         collection.update(parameters)
     except DatabaseError as error:
         raise exceptions.DatabaseException(error.args)
@@ -108,28 +126,43 @@ def update_collection(scope, name, parameters=None, coll_id=None, session=None):
 
 
 @read_session
-def get_collection(scope, name, coll_id=None, session=None):
+def get_collection(scope, name, coll_id=None, columns=None, session=None):
     """
     Get a collection or raise a NoObject exception.
 
     :param scope: The scope of the collection data.
     :param name: The name of the collection data.
     :param coll_id: Collection id.
+    :param columns: List of the column names to return as a record instead of the model.
+                    coll_id is always returned.
     :param session: The database session in use.
 
     :raises NoObject: If no edge is founded.
+    :raises CoreException: If a column does not exist.
 
-    :returns: Collection model.
+    :returns: Collection model, or record of the columns.
     """
 
     try:
+        if columns:
+            table = models.Collection.__table__
+            if coll_id:
+                criteria = [table.c.coll_id == coll_id]
+            else:
+                criteria = [table.c.scope == scope, table.c.name == name]
+            records = select_records(session, table, project_columns(table, columns, required=['coll_id']), criteria)
+            if not records:
+                raise sqlalchemy.orm.exc.NoResultFound()
+            return records[0]
+
+        query = BAKERY(lambda session: session.query(models.Collection))
         if coll_id:
-            collection = session.query(models.Collection).filter_by(coll_id=coll_id).one()
+            query += lambda q: q.filter(models.Collection.coll_id == bindparam('coll_id'))
         else:
-            collection = session.query(models.Collection).filter_by(scope=scope, name=name).one()
+            query += lambda q: q.filter(and_(models.Collection.scope == bindparam('scope'),
+                                             models.Collection.name == bindparam('name')))
+        collection = run_baked_query(query, session, coll_id=coll_id, scope=scope, name=name).one()
 
-        collection['collection_type'] = collection.collection_type
-        collection['global_status'] = collection.global_status
         return collection
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Collection %s:%s cannot be found' % (scope, name))
@@ -138,7 +171,7 @@ def get_collection(scope, name, coll_id=None, session=None):
 @read_session
 def get_collection_id(scope, name, session=None):
     """
-    Get a collection or raise a NoObject exception.
+    Get a collection id or raise a NoObject exception. The ids are cached in the process.
 
     :param scope: The scope of the collection data.
     :param name: The name of the collection data.
@@ -146,16 +179,24 @@ def get_collection_id(scope, name, session=None):
 
     :raises NoObject: If no edge is founded.
 
-    :returns: Collection model.
+    :returns: Collection id.
     """
 
-    try:
-        collection_id = session.query(models.Collection.coll_id).filter_by(scope=scope, name=name).one()[0]
-
+    collection_id = COLLECTION_ID_CACHE.get((scope, name))
+    if collection_id is not None:
         return collection_id
+
+    try:
+        query = BAKERY(lambda session: session.query(models.Collection.coll_id))
+        query += lambda q: q.filter(and_(models.Collection.scope == bindparam('scope'),
+                                         models.Collection.name == bindparam('name')))
+        collection_id = run_baked_query(query, session, scope=scope, name=name).one()[0]
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Collection %s:%s cannot be found' % (scope, name))
 
+    COLLECTION_ID_CACHE.set((scope, name), collection_id)
+    return collection_id
+
 
 @transactional_session
 def delete_collection(scope, name, coll_id=None, session=None):
@@ -170,18 +211,23 @@ def delete_collection(scope, name, coll_id=None, session=None):
     :raises NoObject: If no edge is founded.
     """
 
+    if coll_id:
+        COLLECTION_ID_CACHE.invalidate_value(coll_id)
+    else:
+        COLLECTION_ID_CACHE.invalidate((scope, name))
+
     try:
-        if coll_id:
-            session.query(models.Collection).filter_by(coll_id=coll_id).delete()
-        else:
-            session.query(models.Collection).filter_by(scope=scope, name=name).delete()
+        if not coll_id:
+            coll_id = session.query(models.Collection.coll_id).filter_by(scope=scope, name=name).scalar()
+        delete_content_counters(coll_id=coll_id, session=session)
+        session.query(models.Collection).filter_by(coll_id=coll_id).delete()
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Collection %s:%s cannot be found' % (scope, name))
 
 
 @transactional_session
 def add_collection_replicas(scope, name, edge_name, coll_id=None, edge_id=None, status=CollectionReplicasStatus.NEW,
-                            transferring_files=0, replicated_files=0, num_active_requests=1, retries=0, session=None):
+                            transferring_files=None, replicated_files=None, num_active_requests=1, retries=0, session=None):
     """
     Add a collection replicas.
 
@@ -191,8 +237,8 @@ def add_collection_replicas(scope, name, edge_name, coll_id=None, edge_id=None,
     :param edge_id: The id of the replicating edge.
     :param coll_id: Collection id.
     :param status: The status of the collection replicas.
-    :param transferring_files: Number of transferring files.
-    :param replicated_files: Number of replicated files.
+    :param transferring_files: Number of transferring files. By default from the content counters.
+    :param replicated_files: Number of replicated files. By default from the content counters.
     :param num_active_requests: Number of active requests.
     :param retries: Number of retries.
     :param session: The database session in use.
@@ -205,9 +251,13 @@ def add_collection_replicas(scope, name, edge_name, coll_id=None, edge_id=None,
     if not edge_id:
         edge_id = get_edge_id(edge_name=edge_name, session=session)
 
+    if transferring_files is None or replicated_files is None:
+        files = get_replicas_files(coll_id, edge_id, session=session)
+        transferring_files = files[0] if transferring_files is None else transferring_files
+        replicated_files = files[1] if replicated_files is None else replicated_files
+
     try:
-        if isinstance(status, str) or isinstance(status, unicode):
-            status = CollectionReplicasStatus.from_sym(str(status))
+        status = CollectionReplicasStatus.normalize(status)
 
         new_collection_replicas = models.CollectionReplicas(coll_id=coll_id, edge_id=edge_id, status=status,
                                                             transferring_files=transferring_files,
@@ -249,7 +299,6 @@ def get_collection_replicas(scope, name, edge_name, coll_id=None, edge_id=None,
 
         collection_replicas = session.query(models.CollectionReplicas).filter_by(coll_id=coll_id, edge_id=edge_id).one()
 
-        collection_replicas['status'] = collection_replicas.status
         return collection_replicas
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Collection replicas %s:%s(at %s) cannot be found' % (scope, name, edge_name))
@@ -287,6 +336,52 @@ def update_collection_replicas(scope, name, edge_name, coll_id=None, edge_id=Non
         raise exceptions.DatabaseException(error.args)
 
 
+@transactional_session
+def update_collection_replicas_requests(coll_id, edge_id, num_requests=1, session=None):
+    """
+    Change the number of active requests of a collection replicas, adding the collection replicas if it doesn't exist.
+
+    :param coll_id: Collection id.
+    :param edge_id: The id of the replicating edge.
+    :param num_requests: The change of the number of active requests.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+    """
+    table = models.CollectionReplicas.__table__
+    transferring_files, replicated_files = get_replicas_files(coll_id, edge_id, session=session)
+    try:
+        bulk_insert_ignore(table, [{'coll_id': coll_id, 'edge_id': edge_id, 'status': CollectionReplicasStatus.NEW,
+                                    'transferring_files': transferring_files, 'replicated_files': replicated_files,
+                                    'num_active_requests': 0, 'retries': 0}],
+                           unique_columns=['coll_id', 'edge_id'], session=session)
+        session.execute(table.update().where(and_(table.c.coll_id == coll_id, table.c.edge_id == edge_id))
+                                      .values(num_active_requests=func.coalesce(table.c.num_active_requests, 0) + num_requests))
+    except IntegrityError as error:
+        raise exceptions.DatabaseException("Failed to add collection replicas %s(at edge %s): %s" % (coll_id, edge_id, error))
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+
+@read_session
+def is_collection_complete(coll_id, edge_id, content_type=None, session=None):
+    """
+    Check whether all the files of a collection are available at an edge: at least one file is
+    available and no file has another status, for example transferring, BAD or UNAVAILABLE.
+    The content counters are used, so that the cost does not depend on the size of the collection.
+
+    :param coll_id: Collection id.
+    :param edge_id: The id of the replicating edge.
+    :param content_type: The type of the files to check, FILE for the requests of whole files and
+                         PARTIAL for the requests of partial files. All the files by default.
+    :param session: The database session in use.
+
+    :returns: True or False.
+    """
+    counters = get_content_counters(edge_id=edge_id, coll_id=coll_id, content_type=content_type, session=session)
+    return len(counters) > 0 and all([counter.status == ContentStatus.AVAILABLE for counter in counters])
+
+
 @transactional_session
 def delete_collection_replicas(scope, name, edge_name, coll_id=None, edge_id=None, session=None):
     """
@@ -313,6 +408,17 @@ def delete_collection_replicas(scope, name, edge_name, coll_id=None, edge_id=Non
         raise exceptions.NoObject('Collection %s:%s(at %s) cannot be found' % (scope, name, edge_name))
 
 
+def invalidate_content_ranges(files):
+    """
+    Remove the cached available contents of files, when their available contents change.
+
+    :param files: List of (scope, name, edge_id) of the files.
+    """
+    for scope, name, edge_id in set(files):
+        CONTENT_RANGE_CACHE.invalidate((scope, name, edge_id))
+        CONTENT_RANGE_CACHE.invalidate((scope, name, None))
+
+
 @transactional_session
 def add_content(scope, name, min_id=None, max_id=None, coll_id=None, content_type=ContentType.FILE,
                 status=ContentStatus.NEW, priority=0, edge_name=None, edge_id=None, num_success=0,
@@ -341,11 +447,9 @@ def add_content(scope, name, min_id=None, max_id=None, coll_id=None, content_typ
 
     :returns: collection content id.
     """
-    if isinstance(content_type, str) or isinstance(content_type, unicode):
-        content_type = ContentType.from_sym(str(content_type))
+    content_type = ContentType.normalize(content_type)
 
-    if isinstance(status, str) or isinstance(status, unicode):
-        status = ContentStatus.from_sym(str(status))
+    status = ContentStatus.normalize(status)
 
     if not edge_id:
         edge_id = get_edge_id(edge_name=edge_name, session=session)
@@ -363,33 +467,113 @@ def add_content(scope, name, min_id=None, max_id=None, coll_id=None, content_typ
     except DatabaseError as error:
         raise exceptions.DatabaseException(error.args)
 
+    deltas = {}
+    add_counter_delta(deltas, edge_id, coll_id, content_type, status, 1, pfn_size)
+    update_content_counters(deltas, session=session)
+
+    if status == ContentStatus.AVAILABLE:
+        invalidate_content_ranges([(scope, name, edge_id)])
     return new_content.content_id
 
 
 @transactional_session
-def add_contents(collection_scope, collection_name, edge_name, files, session=None):
+def add_contents(collection_scope, collection_name, edge_name, files, chunk_size=DEFAULT_CHUNK_SIZE, session=None):
     """
-    Add a collection contents.
+    Add a collection contents in bulk. Contents which already exist or are duplicated in the files are skipped.
 
     :param collection_scope: The scope of the collection.
     :param collection_name: The name of the collection.
     :param edge_name: The edge name.
     :param files: list of files.
+    :param chunk_size: Number of contents to insert with one statement.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: dictionary with numbers of inserted and skipped contents.
     """
     coll_id = get_collection_id(scope=collection_scope, name=collection_name, session=session)
     edge_id = get_edge_id(edge_name=edge_name, session=session)
 
+    table = CollectionContent.__table__
+    unique_columns = ['scope', 'name', 'content_type', 'min_id', 'max_id']
+    # the contents inserted by this call are found back by their creation time
+    created_at = datetime.datetime.utcnow()
+
+    rows, keys = [], set()
     for file in files:
-        try:
-            add_content(scope=file['scope'], name=file['name'], min_id=file['min_id'],
-                        max_id=file['max_id'], coll_id=coll_id, content_type=file['content_type'],
-                        status=file['status'], priority=file['priority'], edge_id=edge_id,
-                        pfn_size=file['pfn_size'] if 'pfn_size' in file else 0,
-                        pfn=file['pfn'] if 'pfn' in file else None,
-                        object_metadata=file['object_metadata'] if 'object_metadata' in file else None,
-                        session=session)
-        except exceptions.DuplicatedObject:
-            pass
+        content_type = file['content_type']
+        content_type = ContentType.normalize(content_type)
+
+        status = file['status']
+        status = ContentStatus.normalize(status)
+
+        # the duplicated contents in the files are skipped as the existing ones
+        key = (file['scope'], file['name'], content_type, file['min_id'], file['max_id'])
+        if key in keys:
+            continue
+        keys.add(key)
+
+        rows.append({'scope': file['scope'],
+                     'name': file['name'],
+                     'min_id': file['min_id'],
+                     'max_id': file['max_id'],
+                     'coll_id': coll_id,
+                     'content_type': content_type,
+                     'status': status,
+                     'priority': file.get('priority', 0),
+                     'edge_id': edge_id,
+                     'num_success': 0,
+                     'num_failure': 0,
+                     'last_failed_at': None,
+                     'pfn_size': file.get('pfn_size', 0),
+                     'pfn': file.get('pfn', None),
+                     'object_metadata': file.get('object_metadata', None),
+                     'created_at': created_at})
+
+    inserted = 0
+    deltas = {}
+    try:
+        # the whole files without a min_id or max_id never conflict with the unique constraint on postgresql
+        # and mysql, the additions to the collection are serialized and the existing contents locked instead
+        lock = any([row['min_id'] is None or row['max_id'] is None for row in rows])
+        if lock:
+            session.execute(select([models.Collection.coll_id]).where(models.Collection.coll_id == coll_id).with_for_update())
+
+        for chunk in chunks(rows, chunk_size):
+            # the existing contents are skipped, so that only the inserted contents are counted
+            query = select([table.c[column] for column in unique_columns])\
+                .where(and_(table.c.coll_id == coll_id, table.c.edge_id == edge_id,
+                            table.c.scope.in_(set([row['scope'] for row in chunk])),
+                            table.c.name.in_(set([row['name'] for row in chunk]))))
+            if lock:
+                query = query.with_for_update()
+            existing = set([tuple(item) for item in session.execute(query)])
+            new_rows = [row for row in chunk if tuple([row[column] for column in unique_columns]) not in existing]
+
+            num_inserted = bulk_insert_ignore(table, new_rows, unique_columns=unique_columns + ['coll_id', 'edge_id'],
+                                              chunk_size=chunk_size, session=session)
+            if num_inserted != len(new_rows):
+                # some contents were inserted by another session in the meantime, the rows of this call are selected back
+                query = select([table.c[column] for column in unique_columns] + [table.c.status, table.c.pfn_size])\
+                    .where(and_(table.c.coll_id == coll_id, table.c.edge_id == edge_id,
+                                table.c.created_at == created_at,
+                                table.c.scope.in_(set([row['scope'] for row in new_rows])),
+                                table.c.name.in_(set([row['name'] for row in new_rows]))))
+                new_keys = set([tuple([row[column] for column in unique_columns]) for row in new_rows])
+                num_new = len(new_rows)
+                new_rows = [row for row in session.execute(query) if tuple([row[column] for column in unique_columns]) in new_keys]
+                num_inserted = len(new_rows)
+                logging.info("%s contents of collection %s were inserted by another session" % (num_new - num_inserted, coll_id))
+            inserted += num_inserted
+            for row in new_rows:
+                add_counter_delta(deltas, edge_id, coll_id, row['content_type'], row['status'], 1, row['pfn_size'])
+        update_content_counters(deltas, session=session)
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+    invalidate_content_ranges([(row['scope'], row['name'], edge_id) for row in rows if row['status'] == ContentStatus.AVAILABLE])
+    return {'inserted': inserted, 'skipped': len(files) - inserted}
 
 
 @transactional_session
@@ -425,7 +609,15 @@ def update_content(scope, name, min_id=None, max_id=None, edge_name=None, edge_i
            (isinstance(parameters['status'], str) or isinstance(parameters['status'], unicode)):
             parameters['status'] = ContentStatus.from_sym(str(parameters['status']))
 
+        deltas = {}
+        add_counter_delta(deltas, content.edge_id, content.coll_id, content.content_type, content.status, -1, -(content.pfn_size or 0))
+        was_available = content.status == ContentStatus.AVAILABLE
         content.update(parameters)
+        add_counter_delta(deltas, content.edge_id, content.coll_id, content.content_type, content.status, 1, content.pfn_size)
+        update_content_counters(deltas, session=session)
+
+        if was_available or content.status == ContentStatus.AVAILABLE:
+            invalidate_content_ranges([(content.scope, content.name, content.edge_id)])
     except DatabaseError as error:
         raise exceptions.DatabaseException(error.args)
 
@@ -457,33 +649,98 @@ def update_contents(files, session=None):
 
 
 @transactional_session
-def update_contents_by_id(files, session=None):
+def update_contents_by_id(files, chunk_size=DEFAULT_CHUNK_SIZE, lease_owner=None, with_ids=False, session=None):
     """
-    update a collection content.
+    update collection contents by content id in bulk.
 
-    :param files: The list of content files.
+    Contents with identical parameters are updated together with 'content_id IN (...)' statements.
+    The other contents are updated with executemany, grouped by the names of the updated columns.
+
+    :param files: Dictionary of content id to a dictionary of parameters.
+    :param chunk_size: Number of contents to update with one statement.
+    :param lease_owner: Only update the contents still leased to this owner, the other contents are skipped.
+    :param with_ids: Return the ids of the contents to update, without the skipped ones, instead of the number of updated contents.
     :param session: The database session in use.
 
-    :raises NoObject: If no content is founded.
     :raises DatabaseException: If there is a database error.
+
+    :returns: number of updated contents. With with_ids, list of the ids of the contents to update.
     """
+    table = CollectionContent.__table__
+    if lease_owner:
+        leased = get_leased_content_ids(lease_owner, files.keys(), chunk_size=chunk_size, session=session)
+        files = dict([(id, files[id]) for id in leased])
 
-    try:
-        for id in files:
-            parameters = files[id]
+    same_parameters = {}
+    row_parameters = {}
+    for id in files:
+        parameters = files[id]
 
-            if 'status' in parameters and \
-               (isinstance(parameters['status'], str) or isinstance(parameters['status'], unicode)):
-                parameters['status'] = ContentStatus.from_sym(str(parameters['status']))
+        if 'status' in parameters and \
+           (isinstance(parameters['status'], str) or isinstance(parameters['status'], unicode)):
+            parameters['status'] = ContentStatus.from_sym(str(parameters['status']))
 
-            session.query(models.CollectionContent).filter_by(content_id=id).update(parameters)
+        try:
+            key = tuple(sorted(parameters.items()))
+            same_parameters.setdefault(key, []).append(id)
+        except TypeError:
+            # not hashable values, for example object_metadata
+            row_parameters.setdefault(tuple(sorted(parameters.keys())), []).append(id)
+
+    for key in list(same_parameters.keys()):
+        ids = same_parameters[key]
+        if len(ids) == 1:
+            row_parameters.setdefault(tuple([k for k, v in key]), []).append(ids[0])
+            del same_parameters[key]
 
+    try:
+        snapshot = None
+        if [id for id in files if set(files[id].keys()) & COUNTED_COLUMNS]:
+            snapshot = get_counter_snapshot(files.keys(), chunk_size=chunk_size, session=session)
+
+        updated = 0
+        for key, ids in same_parameters.items():
+            stmt = table.update().values(dict(key))
+            for chunk in chunks(ids, chunk_size):
+                updated += session.execute(stmt.where(table.c.content_id.in_(chunk))).rowcount
+
+        for columns, ids in row_parameters.items():
+            stmt = table.update().where(table.c.content_id == bindparam('b_content_id'))\
+                                 .values(dict([(c, bindparam('b_%s' % c)) for c in columns]))
+            rows = []
+            for id in ids:
+                row = dict([('b_%s' % c, files[id][c]) for c in columns])
+                row['b_content_id'] = id
+                rows.append(row)
+            for chunk in chunks(rows, chunk_size):
+                result = session.execute(stmt, chunk)
+                updated += result.rowcount if result.rowcount >= 0 else len(chunk)
+
+        if snapshot:
+            deltas = {}
+            for id, (edge_id, coll_id, content_type, status, pfn_size) in snapshot.items():
+                parameters = files[id]
+                add_counter_delta(deltas, edge_id, coll_id, content_type, status, -1, -(pfn_size or 0))
+                add_counter_delta(deltas, parameters.get('edge_id', edge_id), parameters.get('coll_id', coll_id),
+                                  parameters.get('content_type', content_type), parameters.get('status', status),
+                                  1, parameters.get('pfn_size', pfn_size))
+            update_content_counters(deltas, session=session)
+
+        available_ids = [id for id in files if files[id].get('status') == ContentStatus.AVAILABLE]
+        if available_ids and CONTENT_RANGE_CACHE.ttl > 0:
+            for chunk in chunks(available_ids, chunk_size):
+                query = select([table.c.scope, table.c.name, table.c.edge_id]).where(table.c.content_id.in_(chunk))
+                invalidate_content_ranges([tuple(item) for item in session.execute(query)])
+        if with_ids:
+            return sorted(files.keys())
+        return updated
     except DatabaseError as error:
         raise exceptions.DatabaseException(error.args)
 
 
 @read_session
-def get_content(scope, name, min_id=None, max_id=None, edge_name=None, edge_id=None, content_id=None, session=None):
+def get_content(scope, name, min_id=None, max_id=None, edge_name=None, edge_id=None, content_id=None, columns=None,
+                session=None):
     """
     Get a collection content or raise a NoObject exception.
 
@@ -493,36 +750,58 @@ def get_content(scope, name, min_id=None, max_id=None, edge_name=None, edge_id=N
     :param max_id: The maximum id of the partial file, related to the whole file.
     :param edge_name: The name of the edge.
     :param edge_id: The id of the Edge
+    :param columns: List of the column names to return as a record instead of the model.
+                    content_id is always returned.
     :param session: The database session in use.
 
     :raises NoObject: If no edge is founded.
+    :raises CoreException: If a column does not exist.
 
-    :returns: Content model.
+    :returns: Content model, or record of the columns.
     """
 
     try:
+        if not content_id and not edge_id:
+            edge_id = get_edge_id(edge_name=edge_name, session=session)
+
+        if columns:
+            table = CollectionContent.__table__
+            if content_id:
+                criteria = [table.c.content_id == content_id]
+            else:
+                criteria = [table.c.scope == scope, table.c.name == name, table.c.edge_id == edge_id]
+                if min_id is not None and max_id is not None:
+                    criteria += [table.c.min_id == min_id, table.c.max_id == max_id]
+                else:
+                    criteria.append(table.c.content_type == ContentType.FILE)
+            records = select_records(session, table, project_columns(table, columns, required=['content_id']), criteria)
+            if not records:
+                raise sqlalchemy.orm.exc.NoResultFound()
+            return records[0]
+
+        query = BAKERY(lambda session: session.query(models.CollectionContent))
         if content_id:
-            content = session.query(models.CollectionContent).filter_by(content_id=content_id).one()
+            query += lambda q: q.filter(CollectionContent.content_id == bindparam('content_id'))
         else:
-            if not edge_id:
-                edge_id = get_edge_id(edge_name=edge_name, session=session)
-
+            query += lambda q: q.filter(and_(CollectionContent.scope == bindparam('scope'),
+                                             CollectionContent.name == bindparam('name'),
+                                             CollectionContent.edge_id == bindparam('edge_id')))
             if min_id is not None and max_id is not None:
-                content = session.query(models.CollectionContent).filter_by(scope=scope, name=name, edge_id=edge_id,
-                                                                            min_id=min_id, max_id=max_id).one()
+                query += lambda q: q.filter(and_(CollectionContent.min_id == bindparam('min_id'),
+                                                 CollectionContent.max_id == bindparam('max_id')))
             else:
-                content_type = ContentType.FILE
-                content = session.query(models.CollectionContent).filter_by(scope=scope, name=name, content_type=content_type, edge_id=edge_id).one()
+                query += lambda q: q.filter(CollectionContent.content_type == bindparam('content_type'))
+        content = run_baked_query(query, session, content_id=content_id, scope=scope, name=name, edge_id=edge_id,
+                                  min_id=min_id, max_id=max_id, content_type=ContentType.FILE).one()
 
-        content['content_type'] = content.content_type
-        content['status'] = content.status
         return content
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Content %s:%s[%s:%s](at edge %s) cannot be found' % (scope, name, min_id, max_id, edge_id))
 
 
 @read_session
-def get_content_best_match(scope, name, min_id=None, max_id=None, edge_name=None, edge_id=None, status=None, session=None):
+def get_content_best_match(scope, name, min_id=None, max_id=None, edge_name=None, edge_id=None, status=None, columns=None,
+                           session=None):
     """
     Get a collection content or raise a NoObject exception.
 
@@ -532,47 +811,172 @@ def get_content_best_match(scope, name, min_id=None, max_id=None, edge_name=None
     :param max_id: The maximum id of the partial file, related to the whole file.
     :param edge_name: The name of the edge.
     :param edge_id: The id of the Edge
+    :param columns: List of the column names to return as a record instead of the model.
+                    content_id is always returned.
     :param session: The database session in use.
 
     :raises NoObject: If no edge is founded.
+    :raises CoreException: If a column does not exist.
 
-    :returns: Content model.
+    :returns: Content model, or record of the columns.
     """
 
     try:
         if not edge_id and edge_name:
             edge_id = get_edge_id(edge_name=edge_name, session=session)
 
-        if status and (isinstance(status, str) or isinstance(status, unicode)):
-            status = ContentStatus.from_sym(str(status))
+        status = ContentStatus.normalize(status)
 
-        query = session.query(models.CollectionContent).filter_by(scope=scope, name=name)
+        if columns:
+            table = CollectionContent.__table__
+            criteria = [table.c.scope == scope, table.c.name == name]
+            if status:
+                criteria.append(table.c.status == status)
+            if edge_id:
+                criteria.append(table.c.edge_id == edge_id)
+            if min_id is not None and max_id is not None:
+                criteria += [table.c.min_id <= min_id, table.c.max_id >= max_id]
+                order_by = [table.c.max_id - table.c.min_id, table.c.content_id]
+            else:
+                criteria.append(table.c.content_type == ContentType.FILE)
+                order_by = None
+            # like one() of the models, more than one whole file is an error
+            records = select_records(session, table, project_columns(table, columns, required=['content_id']), criteria,
+                                     order_by=order_by, limit=1 if order_by else 2)
+            if not records:
+                raise sqlalchemy.orm.exc.NoResultFound()
+            if len(records) > 1:
+                raise sqlalchemy.orm.exc.MultipleResultsFound('Multiple rows were found for one()')
+            return records[0]
+
+        query = BAKERY(lambda session: session.query(models.CollectionContent))
+        query += lambda q: q.filter(and_(CollectionContent.scope == bindparam('scope'),
+                                         CollectionContent.name == bindparam('name')))
         if status:
-            query = query.filter_by(status=status)
+            query += lambda q: q.filter(CollectionContent.status == bindparam('status'))
         if edge_id:
-            query = query.filter_by(edge_id=edge_id)
+            query += lambda q: q.filter(CollectionContent.edge_id == bindparam('edge_id'))
+        params = {'scope': scope, 'name': name, 'status': status, 'edge_id': edge_id}
 
         if min_id is not None and max_id is not None:
-            contents = query.filter(and_(CollectionContent.min_id <= min_id, CollectionContent.max_id >= max_id)).all()
-            content = None
-            for row in contents:
-                if (not content) or (content['max_id'] - content['min_id'] > row['max_id'] - row['min_id']):
-                    content = row
+            # the narrowest content containing the range
+            query += lambda q: q.filter(and_(CollectionContent.min_id <= bindparam('min_id'),
+                                             CollectionContent.max_id >= bindparam('max_id')))\
+                                .order_by(CollectionContent.max_id - CollectionContent.min_id, CollectionContent.content_id)
+            content = run_baked_query(query, session, min_id=min_id, max_id=max_id, **params).first()
             if content is None:
                 raise sqlalchemy.orm.exc.NoResultFound()
         else:
-            content = query.filter_by(content_type=ContentType.FILE).one()
+            query += lambda q: q.filter(CollectionContent.content_type == bindparam('content_type'))
+            content = run_baked_query(query, session, content_type=ContentType.FILE, **params).one()
 
-        content['content_type'] = content.content_type
-        content['status'] = content.status
         return content
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Content %s:%s[%s:%s](at edge %s) cannot be found' % (scope, name, min_id, max_id, edge_id))
 
 
+@read_session
+def get_available_content_best_match(scope, name, min_id, max_id, edge_name=None, edge_id=None, session=None):
+    """
+    Get the narrowest available content containing a range or raise a NoObject exception.
+
+    When the content range cache is enabled, the available contents of a file are loaded
+    once per cache lifetime into an interval tree, and the lookups are served from it. The contents
+    are loaded again on a miss, since a content may have become available in another process.
+
+    :param scope: The scope of the collection data.
+    :param name: The name of the collection data.
+    :param min_id: The minimum id of the partial file, related to the whole file.
+    :param max_id: The maximum id of the partial file, related to the whole file.
+    :param edge_name: The name of the edge.
+    :param edge_id: The id of the Edge
+    :param session: The database session in use.
+
+    :raises NoObject: If no content is founded.
+
+    :returns: Content model.
+    """
+    if not CONTENT_RANGE_CACHE.ttl > 0:
+        return get_content_best_match(scope, name, min_id=min_id, max_id=max_id, edge_name=edge_name,
+                                      edge_id=edge_id, status=ContentStatus.AVAILABLE, session=session)
+
+    if not edge_id and edge_name:
+        edge_id = get_edge_id(edge_name=edge_name, session=session)
+
+    tree = CONTENT_RANGE_CACHE.get((scope, name, edge_id))
+    content = tree.best_match(min_id, max_id) if tree is not None else None
+    if content is None:
+        # not cached yet, or the content may have become available since the contents were cached
+        query = BAKERY(lambda session: session.query(models.CollectionContent))
+        query += lambda q: q.filter(and_(CollectionContent.scope == bindparam('scope'),
+                                         CollectionContent.name == bindparam('name'),
+                                         CollectionContent.status == bindparam('status')))
+        if edge_id:
+            query += lambda q: q.filter(CollectionContent.edge_id == bindparam('edge_id'))
+        query += lambda q: q.order_by(CollectionContent.content_id)
+        contents = run_baked_query(query, session, scope=scope, name=name, status=ContentStatus.AVAILABLE, edge_id=edge_id).all()
+        tree = IntervalTree([(item.min_id, item.max_id, item) for item in contents])
+        CONTENT_RANGE_CACHE.set((scope, name, edge_id), tree)
+        content = tree.best_match(min_id, max_id)
+
+    if content is None:
+        raise exceptions.NoObject('Content %s:%s[%s:%s](at edge %s) cannot be found' % (scope, name, min_id, max_id, edge_id))
+    return content
+
+
+@read_session
+def get_contents_best_match(ranges, edge_name=None, edge_id=None, status=None, session=None):
+    """
+    Get the narrowest content containing each of many ranges, with one query per file.
+
+    :param ranges: List of (scope, name, min_id, max_id) tuples or of dictionaries with these keys.
+    :param edge_name: The name of the edge.
+    :param edge_id: The id of the Edge
+    :param status: The status of the content.
+    :param session: The database session in use.
+
+    :returns: List of content models in the order of the ranges, None for the ranges without a content.
+    """
+    if not edge_id and edge_name:
+        edge_id = get_edge_id(edge_name=edge_name, session=session)
+
+    status = ContentStatus.normalize(status)
+
+    files = {}
+    for rng in ranges:
+        if isinstance(rng, dict):
+            rng = (rng['scope'], rng['name'], rng['min_id'], rng['max_id'])
+        scope, name, min_id, max_id = rng
+        if (scope, name) not in files:
+            files[(scope, name)] = [min_id, max_id]
+        else:
+            files[(scope, name)][0] = max(files[(scope, name)][0], min_id)
+            files[(scope, name)][1] = min(files[(scope, name)][1], max_id)
+
+    trees = {}
+    for (scope, name), (max_min_id, min_max_id) in files.items():
+        # a content containing any range of the file starts before the largest min_id and ends after the smallest max_id
+        query = session.query(models.CollectionContent).filter_by(scope=scope, name=name)
+        if status:
+            query = query.filter_by(status=status)
+        if edge_id:
+            query = query.filter_by(edge_id=edge_id)
+        contents = query.filter(and_(CollectionContent.min_id <= max_min_id, CollectionContent.max_id >= min_max_id))\
+                        .order_by(CollectionContent.content_id).all()
+        trees[(scope, name)] = IntervalTree([(content.min_id, content.max_id, content) for content in contents])
+
+    matches = []
+    for rng in ranges:
+        if isinstance(rng, dict):
+            rng = (rng['scope'], rng['name'], rng['min_id'], rng['max_id'])
+        scope, name, min_id, max_id = rng
+        matches.append(trees[(scope, name)].best_match(min_id, max_id))
+    return matches
+
+
 @read_session
 def get_contents_by_edge(edge_name, edge_id=None, status=None, coll_id=None, content_type=None,
-                         collection_scope=None, collection_name=None, limit=None, session=None):
+                         collection_scope=None, collection_name=None, limit=None, columns=None, session=None):
     """
     Get a collection content or raise a NoObject exception.
 
@@ -582,83 +986,346 @@ def get_contents_by_edge(edge_name, edge_id=None, status=None, coll_id=None, con
     :param coll_id: The collection id.
     :param content_type: The tyep of the content.
     :param limit: Number to return limited items.
+    :param columns: List of the column names to return as records instead of the models.
+                    content_id is always returned.
     :param session: The database session in use.
 
     :raises NoObject: If no edge is founded.
+    :raises CoreException: If a column does not exist.
 
-    :returns: Content model.
+    :returns: Content models, or records of the columns.
     """
 
     try:
         if not edge_id:
             edge_id = get_edge_id(edge_name=edge_name, session=session)
         if not coll_id and (collection_scope and collection_name):
-            coll_id = get_collection_id(collection_scope, collection_name)
-
-        query = session.query(models.CollectionContent).filter_by(edge_id=edge_id)
+            coll_id = get_collection_id(collection_scope, collection_name, session=session)
+        status = ContentStatus.normalize(status)
+        content_type = ContentType.normalize(content_type)
+
+        if columns:
+            table = CollectionContent.__table__
+            criteria = [table.c.edge_id == edge_id]
+            if status:
+                criteria.append(table.c.status == status)
+            if coll_id:
+                criteria.append(table.c.coll_id == coll_id)
+            if content_type:
+                criteria.append(table.c.content_type == content_type)
+            return select_records(session, table, project_columns(table, columns, required=['content_id']), criteria,
+                                  limit=limit)
+
+        query = BAKERY(lambda session: session.query(models.CollectionContent))
+        query += lambda q: q.filter(CollectionContent.edge_id == bindparam('edge_id'))
         if status:
-            if isinstance(status, str) or isinstance(status, unicode):
-                status = ContentStatus.from_sym(str(status))
-            query = query.filter_by(status=status)
+            query += lambda q: q.filter(CollectionContent.status == bindparam('status'))
         if coll_id:
-            query = query.filter_by(coll_id=coll_id)
+            query += lambda q: q.filter(CollectionContent.coll_id == bindparam('coll_id'))
         if content_type:
-            query = query.filter_by(content_type=content_type)
+            query += lambda q: q.filter(CollectionContent.content_type == bindparam('content_type'))
         if limit:
-            query = query.limit(limit)
+            query += lambda q: q.limit(bindparam('limit'))
 
-        contents = query.all()
+        contents = run_baked_query(query, session, edge_id=edge_id, status=status, coll_id=coll_id,
+                                   content_type=content_type, limit=limit).all()
 
-        for content in contents:
-            content['content_type'] = content.content_type
-            content['status'] = content.status
         return contents
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('No contents at edge %s with status %s' % (edge_name, status))
 
 
-@read_session
-def get_contents_statistics(edge_name, edge_id=None, coll_id=None, status=None, content_type=None, session=None):
+@stream_session
+def iter_contents_by_edge(edge_name, edge_id=None, status=None, coll_id=None, content_type=None,
+                          collection_scope=None, collection_name=None, columns=None,
+                          page_size=DEFAULT_CHUNK_SIZE, session=None):
     """
-    Get content statistics.
+    Iterate over the contents at an edge without loading all of them in memory.
+
+    The contents are read in pages ordered by content_id, each page starting after the
+    last content_id of the previous one, and are yielded as records of the columns
+    instead of ORM objects.
 
     :param edge_name: The name of the edge.
     :param edge_id: The id of the Edge
-    :param coll_id: The collection id.
     :param status: The status of the content.
+    :param coll_id: The collection id.
     :param content_type: The tyep of the content.
+    :param collection_scope: The scope of the collection.
+    :param collection_name: The name of the collection.
+    :param columns: List of the column names to return. All columns by default.
+                    content_id is always returned.
+    :param page_size: Number of contents to read per query.
     :param session: The database session in use.
 
-    :returns: dict.
+    :raises NoObject: If the edge or the collection is not founded.
+    :raises CoreException: If a column does not exist.
+
+    :returns: Generator of content records.
+    """
+    if not edge_id:
+        edge_id = get_edge_id(edge_name=edge_name, session=session)
+    if not coll_id and (collection_scope and collection_name):
+        coll_id = get_collection_id(collection_scope, collection_name, session=session)
+    status = ContentStatus.normalize(status)
+    content_type = ContentType.normalize(content_type)
+
+    table = CollectionContent.__table__
+    columns = project_columns(table, columns, required=['content_id'])
+    record_class = get_record_class(table, columns)
+    entities = [getattr(CollectionContent, column) for column in columns]
+
+    last_content_id = None
+    while True:
+        # the projected columns are part of the shape of the baked query
+        query = BAKERY(lambda session: session.query(*entities), tuple(columns))
+        query += lambda q: q.filter(CollectionContent.edge_id == bindparam('edge_id'))
+        if status:
+            query += lambda q: q.filter(CollectionContent.status == bindparam('status'))
+        if coll_id:
+            query += lambda q: q.filter(CollectionContent.coll_id == bindparam('coll_id'))
+        if content_type:
+            query += lambda q: q.filter(CollectionContent.content_type == bindparam('content_type'))
+        if last_content_id is not None:
+            query += lambda q: q.filter(CollectionContent.content_id > bindparam('last_content_id'))
+        query += lambda q: q.order_by(CollectionContent.content_id).limit(bindparam('page_size'))
+        rows = run_baked_query(query, session, edge_id=edge_id, status=status, coll_id=coll_id, content_type=content_type,
+                               last_content_id=last_content_id, page_size=page_size).all()
+
+        for row in rows:
+            yield record_class(row)
+        if len(rows) < page_size:
+            break
+        last_content_id = rows[-1].content_id
+
+
+@read_session
+def get_leased_content_ids(owner, content_ids, chunk_size=DEFAULT_CHUNK_SIZE, session=None):
     """
+    Get the contents still leased to an owner, locking them until the end of the transaction.
+
+    :param owner: The owner of the lease.
+    :param content_ids: List of content ids.
+    :param chunk_size: Number of contents to read with one query.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
 
+    :returns: list of the content ids leased to the owner.
+    """
+    table = CollectionContent.__table__
+    leased = []
     try:
-        if not edge_id and edge_name:
-            edge_id = get_edge_id(edge_name=edge_name, session=session)
+        for chunk in chunks(list(content_ids), chunk_size):
+            query = select([table.c.content_id]).where(and_(table.c.content_id.in_(chunk), table.c.lease_owner == owner))
+            leased += [row[0] for row in session.execute(query.with_for_update())]
+        return leased
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
 
-        query = session.query(models.CollectionContent.edge_id, models.CollectionContent.coll_id,
-                              models.CollectionContent.content_type, models.CollectionContent.status,
-                              func.count(1).label('counter'))
-        if edge_id:
-            query = query.filter_by(edge_id=edge_id)
-        if coll_id:
-            query = query.filter_by(coll_id=coll_id)
-        if status:
-            if isinstance(status, str) or isinstance(status, unicode):
-                status = ContentStatus.from_sym(str(status))
-            query = query.filter_by(status=status)
-        if content_type:
-            if isinstance(content_type, str) or isinstance(content_type, unicode):
-                content_type = ContentType.from_sym(str(content_type))
-            query = query.filter_by(content_type=content_type)
 
-        query = query.group_by(models.CollectionContent.edge_id, models.CollectionContent.coll_id,
-                               models.CollectionContent.content_type, models.CollectionContent.status)
-        statistics = query.all()
+@transactional_session
+def claim_contents(edge_name, from_status, to_status, limit=100, owner=None, lease_seconds=3600,
+                   edge_id=None, content_type=None, columns=None, session=None):
+    """
+    Atomically claim a batch of contents at an edge, switching them from one status to another
+    and leasing them to an owner. Contents are claimed by priority.
+
+    On MySQL, PostgreSQL and Oracle the contents are selected with 'FOR UPDATE SKIP LOCKED',
+    so that parallel daemons claim disjoint batches. Other databases (SQLite) update the contents
+    first and then select them back by the lease.
 
-        return statistics
-    except sqlalchemy.orm.exc.NoResultFound:
-        raise exceptions.NoObject('Failed to get statistics for edge %s and collection %s' % (edge_id, coll_id))
+    :param edge_name: The name of the edge.
+    :param from_status: The status of the contents to claim.
+    :param to_status: The status of the claimed contents.
+    :param limit: Maximum number of contents to claim.
+    :param owner: The owner of the lease.
+    :param lease_seconds: The lifetime of the lease in seconds.
+    :param edge_id: The id of the Edge
+    :param content_type: The tyep of the content.
+    :param columns: List of the column names to return as records instead of the models. The columns
+                    content_id, edge_id, coll_id, content_type, pfn_size and priority are always returned.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+    :raises CoreException: If a column does not exist.
+
+    :returns: list of claimed Content models, or records of the columns.
+    """
+    if not edge_id:
+        edge_id = get_edge_id(edge_name=edge_name, session=session)
+    from_status = ContentStatus.normalize(from_status)
+    to_status = ContentStatus.normalize(to_status)
+    content_type = ContentType.normalize(content_type)
+    if not owner:
+        owner = '%s:%s' % (socket.gethostname(), os.getpid())
+
+    lease_expired_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_seconds)
+    parameters = {'status': to_status, 'lease_owner': owner, 'lease_expired_at': lease_expired_at}
+
+    table = CollectionContent.__table__
+    if columns:
+        columns = project_columns(table, columns, required=CLAIM_COLUMNS)
+    query = select([table.c.content_id]).where(and_(table.c.edge_id == edge_id, table.c.status == from_status))
+    if content_type:
+        query = query.where(table.c.content_type == content_type)
+    query = query.order_by(table.c.priority.desc())
+
+    try:
+        dialect = session.bind.dialect.name
+        if dialect in ('mysql', 'postgresql', 'oracle'):
+            if dialect == 'mysql':
+                query = query.limit(limit).with_for_update().suffix_with('SKIP LOCKED')
+            elif dialect == 'postgresql':
+                query = query.limit(limit).with_for_update(skip_locked=True)
+            else:
+                # Oracle does not allow FOR UPDATE with ROWNUM, rows are locked when they are fetched.
+                query = query.with_for_update(skip_locked=True)
+            result = session.execute(query)
+            content_ids = [row[0] for row in result.fetchmany(limit)]
+            result.close()
+
+            for chunk in chunks(content_ids):
+                session.execute(table.update().where(table.c.content_id.in_(chunk)).values(parameters))
+        else:
+            query = query.limit(limit)
+            session.execute(table.update().where(table.c.content_id.in_(query)).values(parameters))
+            result = session.execute(select([table.c.content_id]).where(and_(table.c.lease_owner == owner,
+                                                                             table.c.lease_expired_at == lease_expired_at,
+                                                                             table.c.status == to_status)))
+            content_ids = [row[0] for row in result]
+
+        contents = []
+        for chunk in chunks(content_ids):
+            if columns:
+                contents += select_records(session, table, columns, [table.c.content_id.in_(chunk)])
+            else:
+                contents += session.query(models.CollectionContent).filter(CollectionContent.content_id.in_(chunk)).all()
+
+        deltas = {}
+        for content in contents:
+            add_counter_delta(deltas, content.edge_id, content.coll_id, content.content_type, from_status, -1, -(content.pfn_size or 0))
+            add_counter_delta(deltas, content.edge_id, content.coll_id, content.content_type, to_status, 1, content.pfn_size)
+        update_content_counters(deltas, session=session)
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+    contents.sort(key=lambda content: content.priority, reverse=True)
+    if not columns:
+        for content in contents:
+            # detach the contents, so that they are not expired when the claim is committed
+            session.expunge(content)
+    return contents
+
+
+@transactional_session
+def reclaim_expired_contents(statuses, edge_name=None, edge_id=None, limit=DEFAULT_CHUNK_SIZE, session=None):
+    """
+    Return the contents whose lease has expired to the status they were claimed from.
+    The contents in a leased status without a lease, left by the daemons before the leases, are
+    reclaimed too. The number of failures of the reclaimed contents is increased.
+
+    :param statuses: Dictionary of the leased status to the status to return to,
+                     for example {ContentStatus.SPLITTING: ContentStatus.TOSPLIT}.
+    :param edge_name: The name of the edge.
+    :param edge_id: The id of the Edge
+    :param limit: Maximum number of contents to lock and reclaim in the transaction.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: number of reclaimed contents.
+    """
+    if not edge_id and edge_name:
+        edge_id = get_edge_id(edge_name=edge_name, session=session)
+
+    reclaims = {}
+    for from_status, to_status in statuses.items():
+        from_status = ContentStatus.normalize(from_status)
+        to_status = ContentStatus.normalize(to_status)
+        reclaims[from_status] = to_status
+    if not reclaims:
+        return 0
+
+    table = CollectionContent.__table__
+    now = datetime.datetime.utcnow()
+    new_status = case([(table.c.status == leased, literal(reclaimed, table.c.status.type))
+                       for leased, reclaimed in reclaims.items()])
+
+    query = select([table.c.content_id, table.c.edge_id, table.c.coll_id, table.c.content_type,
+                    table.c.status, table.c.pfn_size])\
+        .where(and_(table.c.status.in_(reclaims.keys()),
+                    or_(table.c.lease_expired_at < now, table.c.lease_expired_at.is_(None))))
+    if edge_id:
+        query = query.where(table.c.edge_id == edge_id)
+
+    try:
+        rows = session.execute(query.limit(limit).with_for_update()).fetchall()
+
+        reclaimed = 0
+        stmt = table.update().values(status=new_status,
+                                     num_failure=func.coalesce(table.c.num_failure, 0) + 1,
+                                     last_failed_at=now,
+                                     lease_owner=None,
+                                     lease_expired_at=None)
+        for chunk in chunks([row[0] for row in rows]):
+            reclaimed += session.execute(stmt.where(table.c.content_id.in_(chunk))).rowcount
+
+        deltas = {}
+        for row in rows:
+            add_counter_delta(deltas, row.edge_id, row.coll_id, row.content_type, row.status, -1, -(row.pfn_size or 0))
+            add_counter_delta(deltas, row.edge_id, row.coll_id, row.content_type, reclaims[row.status], 1, row.pfn_size)
+        update_content_counters(deltas, session=session)
+        return reclaimed
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+
+@transactional_session
+def renew_leases(owner, content_ids, lease_seconds=3600, chunk_size=DEFAULT_CHUNK_SIZE, session=None):
+    """
+    Extend the leases of contents still leased to an owner, as a heartbeat of the owner while it processes them.
+
+    :param owner: The owner of the lease.
+    :param content_ids: List of content ids.
+    :param lease_seconds: The new lifetime of the leases in seconds, from now.
+    :param chunk_size: Number of contents to renew with one statement.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: list of the content ids whose lease was renewed, the leases of the others were lost.
+    """
+    table = CollectionContent.__table__
+    lease_expired_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_seconds)
+    try:
+        renewed = get_leased_content_ids(owner, content_ids, chunk_size=chunk_size, session=session)
+        for chunk in chunks(renewed, chunk_size):
+            session.execute(table.update().where(and_(table.c.content_id.in_(chunk), table.c.lease_owner == owner))
+                                          .values(lease_expired_at=lease_expired_at))
+        return renewed
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+
+@read_session
+def get_contents_statistics(edge_name, edge_id=None, coll_id=None, status=None, content_type=None, session=None):
+    """
+    Get content statistics, from the content counters.
+
+    :param edge_name: The name of the edge.
+    :param edge_id: The id of the Edge
+    :param coll_id: The collection id.
+    :param status: The status of the content.
+    :param content_type: The tyep of the content.
+    :param session: The database session in use.
+
+    :returns: list of rows with edge_id, coll_id, content_type, status, counter and bytes.
+    """
+    if not edge_id and edge_name:
+        edge_id = get_edge_id(edge_name=edge_name, session=session)
+
+    return get_content_counters(edge_id=edge_id, coll_id=coll_id, status=status, content_type=content_type, session=session)
 
 
 @transactional_session
@@ -677,11 +1344,22 @@ def delete_content(scope, name, edge_name=None, edge_id=None, content_id=None, s
 
     try:
         if content_id:
-            session.query(models.CollectionContent).filter_by(content_id=content_id).delete()
+            query = session.query(models.CollectionContent).filter_by(content_id=content_id)
         else:
             if not edge_id:
                 edge_id = get_edge_id(edge_name=edge_name, session=session)
 
-            session.query(models.CollectionContent).filter_by(scope=scope, name=name, edge_id=edge_id).delete()
+            query = session.query(models.CollectionContent).filter_by(scope=scope, name=name, edge_id=edge_id)
+
+        files = query.with_entities(CollectionContent.content_id, CollectionContent.scope, CollectionContent.name,
+                                    CollectionContent.edge_id).all()
+        snapshot = get_counter_snapshot([row[0] for row in files], session=session)
+        query.delete()
+        invalidate_content_ranges([tuple(row[1:]) for row in files])
+
+        deltas = {}
+        for content_edge_id, coll_id, content_type, status, pfn_size in snapshot.values():
+            add_counter_delta(deltas, content_edge_id, coll_id, content_type, status, -1, -(pfn_size or 0))
+        update_content_counters(deltas, session=session)
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Contents %s:%s(at edge %s) cannot be found' % (scope, name, edge_id))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+operations related to the content counters, the number and the bytes of the contents
+per edge, collection, content type and status, maintained by the catalog write paths.
+The transferring and replicated files of the collection replicas are maintained with them.
+"""
+
+from sqlalchemy import and_, bindparam, func, select
+from sqlalchemy.exc import DatabaseError
+
+from ess.common import exceptions
+from ess.orm.constants import ContentType, ContentStatus
+from ess.orm.models import CollectionContent, CollectionReplicas, ContentCounter
+from ess.orm.session import read_session, transactional_session
+from ess.orm.utils import DEFAULT_CHUNK_SIZE, bulk_insert_ignore, chunks
+
+
+COUNTER_KEYS = ('edge_id', 'coll_id', 'content_type', 'status')
+
+# the content statuses counted as replicated and as transferring files of the collection replicas
+REPLICATED_STATUSES = set([ContentStatus.AVAILABLE])
+TRANSFERRING_STATUSES = set([ContentStatus.NEW, ContentStatus.TOSPLIT, ContentStatus.SPLITTING,
+                             ContentStatus.TOSTAGEDOUT, ContentStatus.STAGINGOUT])
+
+
+def add_counter_delta(deltas, edge_id, coll_id, content_type, status, counter, bytes):
+    """
+    Accumulate a change of the counters.
+
+    :param deltas: Dictionary of (edge_id, coll_id, content_type, status) to [counter, bytes] to update.
+    :param counter: The change of the number of contents.
+    :param bytes: The change of the bytes of contents.
+    """
+    if edge_id is None or coll_id is None or content_type is None or status is None:
+        # the contents without an edge or a collection are not counted
+        return
+    delta = deltas.setdefault((edge_id, coll_id, content_type, status), [0, 0])
+    delta[0] += counter
+    delta[1] += bytes or 0
+
+
+def get_counter_snapshot(content_ids, chunk_size=DEFAULT_CHUNK_SIZE, session=None):
+    """
+    Get the counted columns of contents, locking the contents until the end of the transaction.
+
+    :param content_ids: List of content ids.
+    :param chunk_size: Number of contents to read with one query.
+    :param session: The database session in use.
+
+    :returns: Dictionary of content id to (edge_id, coll_id, content_type, status, pfn_size).
+    """
+    table = CollectionContent.__table__
+    snapshot = {}
+    for chunk in chunks(list(content_ids), chunk_size):
+        query = select([table.c.content_id, table.c.edge_id, table.c.coll_id, table.c.content_type,
+                        table.c.status, table.c.pfn_size]).where(table.c.content_id.in_(chunk)).with_for_update()
+        for row in session.execute(query):
+            snapshot[row[0]] = tuple(row[1:])
+    return snapshot
+
+
+@transactional_session
+def update_content_counters(deltas, session=None):
+    """
+    Apply changes to the counters.
+
+    :param deltas: Dictionary of (edge_id, coll_id, content_type, status) to [counter, bytes] to update.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+    """
+    deltas = dict([(key, delta) for key, delta in deltas.items() if delta[0] or delta[1]])
+    if not deltas:
+        return
+
+    table = ContentCounter.__table__
+    try:
+        rows = [dict(zip(COUNTER_KEYS, key) + [('counter', 0), ('bytes', 0)]) for key in deltas]
+        bulk_insert_ignore(table, rows, unique_columns=list(COUNTER_KEYS), session=session)
+
+        stmt = table.update().where(and_(*[table.c[k] == bindparam('b_%s' % k) for k in COUNTER_KEYS]))\
+                             .values(counter=table.c.counter + bindparam('b_counter'),
+                                     bytes=table.c.bytes + bindparam('b_bytes'))
+        rows = []
+        # in a stable order, so that concurrent transactions lock the counters in the same order
+        for key, (counter, bytes) in sorted(deltas.items(), key=lambda item: [str(k) for k in item[0]]):
+            row = dict([('b_%s' % k, v) for k, v in zip(COUNTER_KEYS, key)])
+            row['b_counter'] = counter
+            row['b_bytes'] = bytes
+            rows.append(row)
+        session.execute(stmt, rows)
+
+        replicas_deltas = {}
+        for (edge_id, coll_id, content_type, status), (counter, bytes) in deltas.items():
+            if status in TRANSFERRING_STATUSES:
+                replicas_deltas.setdefault((coll_id, edge_id), [0, 0])[0] += counter
+            elif status in REPLICATED_STATUSES:
+                replicas_deltas.setdefault((coll_id, edge_id), [0, 0])[1] += counter
+        _update_replicas_files(replicas_deltas, session=session)
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+
+def _update_replicas_files(replicas_deltas, set_values=False, session=None):
+    """
+    Update the transferring and replicated files of the existing collection replicas.
+
+    :param replicas_deltas: Dictionary of (coll_id, edge_id) to [transferring_files, replicated_files].
+    :param set_values: Set the numbers instead of adding them.
+    """
+    replicas_deltas = dict([(key, delta) for key, delta in replicas_deltas.items() if set_values or delta[0] or delta[1]])
+    if not replicas_deltas:
+        return
+
+    table = CollectionReplicas.__table__
+    stmt = table.update().where(and_(table.c.coll_id == bindparam('b_coll_id'), table.c.edge_id == bindparam('b_edge_id')))
+    if set_values:
+        stmt = stmt.values(transferring_files=bindparam('b_transferring'), replicated_files=bindparam('b_replicated'))
+    else:
+        stmt = stmt.values(transferring_files=func.coalesce(table.c.transferring_files, 0) + bindparam('b_transferring'),
+                           replicated_files=func.coalesce(table.c.replicated_files, 0) + bindparam('b_replicated'))
+    rows = [{'b_coll_id': coll_id, 'b_edge_id': edge_id, 'b_transferring': transferring, 'b_replicated': replicated}
+            for (coll_id, edge_id), (transferring, replicated) in sorted(replicas_deltas.items())]
+    session.execute(stmt, rows)
+
+
+@read_session
+def get_replicas_files(coll_id, edge_id, session=None):
+    """
+    Get the numbers of transferring and replicated files of a collection at an edge from the content counters.
+
+    :param coll_id: The collection id.
+    :param edge_id: The id of the Edge
+    :param session: The database session in use.
+
+    :returns: (transferring_files, replicated_files).
+    """
+    transferring, replicated = 0, 0
+    for counter in get_content_counters(edge_id=edge_id, coll_id=coll_id, session=session):
+        if counter.status in TRANSFERRING_STATUSES:
+            transferring += counter.counter
+        elif counter.status in REPLICATED_STATUSES:
+            replicated += counter.counter
+    return transferring, replicated
+
+
+@read_session
+def get_content_counters(edge_id=None, coll_id=None, status=None, content_type=None, session=None):
+    """
+    Get the counters of contents. The counters of zero contents are not returned.
+
+    :param edge_id: The id of the Edge
+    :param coll_id: The collection id.
+    :param status: The status of the content.
+    :param content_type: The tyep of the content.
+    :param session: The database session in use.
+
+    :returns: list of rows with edge_id, coll_id, content_type, status, counter and bytes.
+    """
+    query = session.query(ContentCounter.edge_id, ContentCounter.coll_id, ContentCounter.content_type,
+                          ContentCounter.status, ContentCounter.counter, ContentCounter.bytes)\
+                   .filter(ContentCounter.counter > 0)
+    if edge_id:
+        query = query.filter(ContentCounter.edge_id == edge_id)
+    if coll_id:
+        query = query.filter(ContentCounter.coll_id == coll_id)
+    if status:
+        status = ContentStatus.normalize(status)
+        query = query.filter(ContentCounter.status == status)
+    if content_type:
+        content_type = ContentType.normalize(content_type)
+        query = query.filter(ContentCounter.content_type == content_type)
+    return query.all()
+
+
+@transactional_session
+def reconcile_content_counters(edge_id=None, coll_id=None, session=None):
+    """
+    Recompute the counters from the contents and correct the ones which drifted,
+    then correct the transferring and replicated files of the collection replicas.
+    It aggregates all the contents of the edge or collection, so it is run by the periodic job
+    of the Finisher and not when the contents change.
+
+    :param edge_id: The id of the Edge, to reconcile only the counters of an edge.
+    :param coll_id: The collection id, to reconcile only the counters of a collection.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: number of corrected content counters and collection replicas.
+    """
+    contents = CollectionContent.__table__
+    counters = ContentCounter.__table__
+
+    query = select([contents.c.edge_id, contents.c.coll_id, contents.c.content_type, contents.c.status,
+                    func.count(1), func.coalesce(func.sum(contents.c.pfn_size), 0)])\
+        .where(and_(contents.c.edge_id.isnot(None), contents.c.coll_id.isnot(None)))
+    current_query = select([counters.c.edge_id, counters.c.coll_id, counters.c.content_type, counters.c.status,
+                            counters.c.counter, counters.c.bytes])
+    if edge_id:
+        query = query.where(contents.c.edge_id == edge_id)
+        current_query = current_query.where(counters.c.edge_id == edge_id)
+    if coll_id:
+        query = query.where(contents.c.coll_id == coll_id)
+        current_query = current_query.where(counters.c.coll_id == coll_id)
+    query = query.group_by(contents.c.edge_id, contents.c.coll_id, contents.c.content_type, contents.c.status)
+
+    try:
+        # the counters are locked before the contents are counted, so that the contents changed by the transactions
+        # committed meanwhile are not counted twice, once by the counting and once by the deltas of the transactions
+        current = dict([(tuple(row[:4]), (row[4], row[5])) for row in session.execute(current_query.with_for_update())])
+        actual = dict([(tuple(row[:4]), (int(row[4]), int(row[5]))) for row in session.execute(query)])
+
+        deltas = {}
+        for key in set(actual.keys()) | set(current.keys()):
+            counter, bytes = actual.get(key, (0, 0))
+            current_counter, current_bytes = current.get(key, (0, 0))
+            if counter != current_counter or bytes != current_bytes:
+                deltas[key] = [counter - current_counter, bytes - current_bytes]
+        update_content_counters(deltas, session=session)
+
+        replicas = CollectionReplicas.__table__
+        replicas_query = select([replicas.c.coll_id, replicas.c.edge_id, replicas.c.transferring_files, replicas.c.replicated_files])
+        if edge_id:
+            replicas_query = replicas_query.where(replicas.c.edge_id == edge_id)
+        if coll_id:
+            replicas_query = replicas_query.where(replicas.c.coll_id == coll_id)
+        replicas_files = {}
+        for replica_coll_id, replica_edge_id, transferring, replicated in session.execute(replicas_query).fetchall():
+            files = get_replicas_files(replica_coll_id, replica_edge_id, session=session)
+            if files != (transferring, replicated):
+                replicas_files[(replica_coll_id, replica_edge_id)] = list(files)
+        _update_replicas_files(replicas_files, set_values=True, session=session)
+        return len(deltas) + len(replicas_files)
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+
+@transactional_session
+def delete_content_counters(edge_id=None, coll_id=None, session=None):
+    """
+    Delete the counters of an edge or of a collection.
+
+    :param edge_id: The id of the Edge
+    :param coll_id: The collection id.
+    :param session: The database session in use.
+    """
+    if not edge_id and not coll_id:
+        return
+
+    query = session.query(ContentCounter)
+    if edge_id:
+        query = query.filter(ContentCounter.edge_id == edge_id)
+    if coll_id:
+        query = query.filter(ContentCounter.coll_id == coll_id)
+    query.delete(synchronize_session=False)
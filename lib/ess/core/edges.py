@@ -16,12 +16,16 @@ operations related to Edges.
 import sqlalchemy
 import sqlalchemy.orm
 
+from sqlalchemy import bindparam
 from sqlalchemy.exc import DatabaseError, IntegrityError
 
 from ess.common import exceptions
+from ess.core.cache import EDGE_ID_CACHE
+from ess.core.counters import delete_content_counters
 from ess.orm import models
 from ess.orm.constants import EdgeType, EdgeStatus
 from ess.orm.session import read_session, transactional_session
+from ess.orm.utils import BAKERY, run_baked_query
 
 
 @transactional_session
@@ -53,11 +57,9 @@ def register_edge(edge_name, edge_type=EdgeType.EDGE, status=EdgeStatus.ACTIVE,
 
     :returns: edge id.
     """
-    if isinstance(edge_type, str) or isinstance(edge_type, unicode):
-        edge_type = EdgeType.from_sym(str(edge_type))
+    edge_type = EdgeType.normalize(edge_type)
 
-    if isinstance(status, str) or isinstance(status, unicode):
-        status = EdgeStatus.from_sym(str(status))
+    status = EdgeStatus.normalize(status)
 
     new_edge = models.Edge(edge_name=edge_name, edge_type=edge_type, status=status,
                            is_independent=is_independent, continent=continent, country_name=country_name,
@@ -102,6 +104,9 @@ def update_edge(edge_name, parameters, session=None):
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Edge %s cannot be found' % edge_name)
 
+    if 'edge_name' in parameters:
+        EDGE_ID_CACHE.invalidate(edge_name)
+
     try:
         edge.update(parameters)
     except DatabaseError as error:
@@ -125,12 +130,13 @@ def get_edge(edge_name, edge_id=None, session=None):
     """
 
     try:
+        query = BAKERY(lambda session: session.query(models.Edge))
         if edge_id:
-            edge = session.query(models.Edge).filter_by(edge_id=edge_id).one()
+            query += lambda q: q.filter(models.Edge.edge_id == bindparam('edge_id'))
         else:
-            edge = session.query(models.Edge).filter_by(edge_name=edge_name).one()
+            query += lambda q: q.filter(models.Edge.edge_name == bindparam('edge_name'))
+        edge = run_baked_query(query, session, edge_id=edge_id, edge_name=edge_name).one()
 
-        edge['edge_type'] = edge.edge_type
         return edge
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Edge %s cannot be found' % edge_name)
@@ -139,7 +145,7 @@ def get_edge(edge_name, edge_id=None, session=None):
 @read_session
 def get_edge_id(edge_name, session=None):
     """
-    Get an Edge id or raise a NoObject exception.
+    Get an Edge id or raise a NoObject exception. The ids are cached in the process.
 
     :param edge_name: The name of the edge.
     :param session: The database session in use.
@@ -149,11 +155,20 @@ def get_edge_id(edge_name, session=None):
     :returns: Edge id.
     """
 
+    edge_id = EDGE_ID_CACHE.get(edge_name)
+    if edge_id is not None:
+        return edge_id
+
     try:
-        return session.query(models.Edge.edge_id).filter_by(edge_name=edge_name).one()[0]
+        query = BAKERY(lambda session: session.query(models.Edge.edge_id))
+        query += lambda q: q.filter(models.Edge.edge_name == bindparam('edge_name'))
+        edge_id = run_baked_query(query, session, edge_name=edge_name).one()[0]
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Edge %s cannot be found' % edge_name)
 
+    EDGE_ID_CACHE.set(edge_name, edge_id)
+    return edge_id
+
 
 @transactional_session
 def delete_edge(edge_name, session=None):
@@ -166,7 +181,10 @@ def delete_edge(edge_name, session=None):
     :raises NoObject: If no edge is founded.
     """
 
+    EDGE_ID_CACHE.invalidate(edge_name)
     try:
+        edge_id = session.query(models.Edge.edge_id).filter_by(edge_name=edge_name).scalar()
+        delete_content_counters(edge_id=edge_id, session=session)
         session.query(models.Edge).filter_by(edge_name=edge_name).delete()
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Edge %s cannot be found' % edge_name)
@@ -186,15 +204,12 @@ def get_edges(status=None, session=None):
     """
 
     try:
+        query = BAKERY(lambda session: session.query(models.Edge))
         if status:
-            if (isinstance(status, str) or isinstance(status, unicode)):
-                status = EdgeStatus.from_sym(status)
-            edges = session.query(models.Edge).filter_by(status=status).all()
-        else:
-            edges = session.query(models.Edge).all()
+            status = EdgeStatus.normalize(status)
+            query += lambda q: q.filter(models.Edge.status == bindparam('status'))
+        edges = run_baked_query(query, session, status=status).all()
 
-        for edge in edges:
-            edge['edge_type'] = edge.edge_type
         return edges
     except sqlalchemy.orm.exc.NoResultFound:
         raise exceptions.NoObject('Cannot find edges with status: %s' % status)
@@ -13,21 +13,117 @@
 operations related to Requests.
 """
 
+import datetime
+import json
+
 import sqlalchemy
 import sqlalchemy.orm
+from sqlalchemy import and_, bindparam, func, or_, select, text
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import defer
 from sqlalchemy.exc import DatabaseError, IntegrityError
 
 from ess.common import exceptions
 from ess.core.edges import get_edge_id
+from ess.core.transitions import record_transitions
 from ess.orm import models
-from ess.orm.constants import DataType, RequestStatus, GranularityType
+from ess.orm.constants import NAME_LENGTH, SCOPE_LENGTH, DataType, RequestStatus, GranularityType
+from ess.orm.enum import EnumSymbol
 from ess.orm.session import read_session, transactional_session
+from ess.orm.utils import (BAKERY, DEFAULT_CHUNK_SIZE, bulk_insert_ignore, chunks, project_columns, run_baked_query,
+                           select_records)
+
+
+# the statuses of the requests in flight, which the new requests of the same data subscribe to
+COALESCED_STATUSES = [RequestStatus.NEW, RequestStatus.BROKERING, RequestStatus.ASSIGNING, RequestStatus.ASSIGNED,
+                      RequestStatus.PRECACHING, RequestStatus.PRECACHED, RequestStatus.TOSPLITTING, RequestStatus.SPLITTING]
+# the statuses out of the pipeline (AVAILABLE, ERROR, WAITING, ...), in which the primary requests
+# complete their subscribed requests
+SUBSCRIPTION_FINAL_STATUSES = [status for status in RequestStatus
+                               if status not in COALESCED_STATUSES and status != RequestStatus.SUBSCRIBED]
+
+
+# the columns of the data keys of the coalesced requests
+DATA_KEY_COLUMNS = ['scope', 'name', 'data_type', 'granularity_type', 'granularity_level']
+# number of data keys to lock with one statement
+DATA_KEY_CHUNK_SIZE = 100
+
+
+def _get_data_key_row(key):
+    # the requests without granularity level have the level -1, the data key cannot be null
+    return dict(zip(DATA_KEY_COLUMNS, key[:4] + (-1 if key[4] is None else key[4],)))
+
+
+def _get_data_key_criteria(table, key_rows):
+    return or_(*[and_(*[table.c[column] == key_row[column] for column in DATA_KEY_COLUMNS]) for key_row in key_rows])
+
+
+def _lock_primary_requests(keys, session=None):
+    """
+    Lock the data keys of requests to coalesce, adding the keys of the data submitted for the first time,
+    and lock their primary requests in flight. The submissions of the same data wait for each other, so that
+    concurrent first submissions do not both become primary requests.
+
+    Every submission locks the data keys in the same order. On MySQL the missing keys are inserted with
+    ON DUPLICATE KEY UPDATE, which locks a key inserted meanwhile exclusively instead of sharing it first.
+
+    :param keys: List of the data keys (scope, name, data_type, granularity_type, granularity_level).
+    :param session: The database session in use.
+
+    :returns: dictionary of the data keys to (request_id, priority) of their primary request in flight.
+    """
+    table, requests = models.RequestDataKey.__table__, models.Request.__table__
+    key_rows = dict([(tuple(_get_data_key_row(key)[column] for column in DATA_KEY_COLUMNS), key) for key in set(keys)])
+    primary_ids = {}
+    # the same order in every process, whatever the order of the enum symbols
+    for chunk in chunks(sorted(key_rows.keys(), key=lambda key_row: tuple(str(item) for item in key_row)),
+                        DATA_KEY_CHUNK_SIZE):
+        criteria = _get_data_key_criteria(table, [dict(zip(DATA_KEY_COLUMNS, key_row)) for key_row in chunk])
+        existing = set()
+        if session.bind.dialect.name != 'sqlite':
+            # on SQLite the insert of all the keys begins the transaction, which locks the database before the reads
+            query = select([table.c[column] for column in DATA_KEY_COLUMNS]).where(criteria)
+            existing = set([tuple(row) for row in session.execute(query)])
+        missing = [dict(zip(DATA_KEY_COLUMNS, key_row), request_id=None) for key_row in chunk if key_row not in existing]
+        if missing and session.bind.dialect.name == 'mysql':
+            # the keys inserted meanwhile keep their primary request
+            stmt = mysql.insert(table).on_duplicate_key_update(request_id=table.c.request_id)
+            session.execute(stmt, missing)
+        elif missing:
+            bulk_insert_ignore(table, missing, DATA_KEY_COLUMNS, session=session)
+
+        query = select([table.c[column] for column in DATA_KEY_COLUMNS] + [table.c.request_id]).where(criteria)\
+            .order_by(*[table.c[column] for column in DATA_KEY_COLUMNS]).with_for_update()
+        for row in session.execute(query).fetchall():
+            if row[-1] is not None:
+                primary_ids[row[-1]] = key_rows[tuple(row[:-1])]
+
+    primaries = {}
+    for chunk in chunks(sorted(primary_ids.keys()), DEFAULT_CHUNK_SIZE):
+        query = select([requests.c.request_id, requests.c.priority])\
+            .where(and_(requests.c.request_id.in_(chunk), requests.c.status.in_(COALESCED_STATUSES)))\
+            .order_by(requests.c.request_id).with_for_update()
+        for request_id, priority in session.execute(query).fetchall():
+            primaries[primary_ids[request_id]] = (request_id, priority)
+    return primaries
+
+
+def _set_primary_requests(primaries, session=None):
+    """
+    Set the primary requests of data keys locked by _lock_primary_requests.
+
+    :param primaries: Dictionary of the data keys to the ids of their new primary request.
+    """
+    table = models.RequestDataKey.__table__
+    for key, request_id in primaries.items():
+        key_row = _get_data_key_row(key)
+        session.execute(table.update().where(_get_data_key_criteria(table, [key_row])).values(request_id=request_id))
 
 
 @transactional_session
 def add_request(scope, name, data_type=DataType.DATASET, granularity_type=GranularityType.FILE,
                 granularity_level=None, priority=0, edge_id=None, status=RequestStatus.NEW,
-                request_meta=None, processing_meta=None, errors=None, session=None):
+                request_meta=None, processing_meta=None, errors=None, coalesce=False, session=None):
     """
     Add a request.
 
@@ -42,6 +138,9 @@ def add_request(scope, name, data_type=DataType.DATASET, granularity_type=Granul
     :param request_meta: The metadata of the request, as Json.
     :param processing_meta: The processing metadata, as Json.
     :param errors: The processing errors, as Json.
+    :param coalesce: If a request for the same scope, name, data type and granularity is in flight, subscribe
+                     the new request to it instead of processing it. The subscribed request is completed with
+                     the primary request. The coalesced submissions of the same data wait for each other.
     :param session: The database session in use.
 
     :raises DuplicatedObject: If an request with the same name exists.
@@ -49,21 +148,39 @@ def add_request(scope, name, data_type=DataType.DATASET, granularity_type=Granul
 
     :returns: request id.
     """
-    if isinstance(data_type, str) or isinstance(data_type, unicode):
-        data_type = DataType.from_sym(str(data_type))
+    data_type = DataType.normalize(data_type)
 
-    if isinstance(granularity_type, str) or isinstance(granularity_type, unicode):
-        granularity_type = GranularityType.from_sym(str(granularity_type))
+    granularity_type = GranularityType.normalize(granularity_type)
 
-    if isinstance(status, str) or isinstance(status, unicode):
-        status = RequestStatus.from_sym(str(status))
+    status = RequestStatus.normalize(status)
 
-    new_request = models.Request(scope=scope, name=name, data_type=data_type, granularity_type=granularity_type,
-                                 granularity_level=granularity_level, priority=priority, edge_id=edge_id, status=status,
-                                 request_meta=request_meta, processing_meta=processing_meta, errors=errors)
+    if priority is None:
+        # the requests are fetched in the order of their priority
+        priority = 0
 
     try:
+        primary = None
+        key = (scope, name, data_type, granularity_type, granularity_level)
+        if coalesce and status == RequestStatus.NEW:
+            primary = _lock_primary_requests([key], session=session).get(key)
+        if primary:
+            status = RequestStatus.SUBSCRIBED
+
+        new_request = models.Request(scope=scope, name=name, data_type=data_type, granularity_type=granularity_type,
+                                     granularity_level=granularity_level, priority=priority, edge_id=edge_id, status=status,
+                                     request_meta=request_meta, processing_meta=processing_meta, errors=errors)
         new_request.save(session=session)
+        record_transitions([new_request.request_id], None, status, session=session)
+
+        if primary:
+            primary_request_id, primary_priority = primary
+            models.RequestSubscription(request_id=new_request.request_id, primary_request_id=primary_request_id).save(session=session)
+            if priority > (primary_priority or 0):
+                # the primary request is processed with the highest priority of its subscribers
+                table = models.Request.__table__
+                session.execute(table.update().where(table.c.request_id == primary_request_id).values(priority=priority))
+        elif coalesce and status == RequestStatus.NEW:
+            _set_primary_requests({key: new_request.request_id}, session=session)
     except IntegrityError as error:
         raise exceptions.DuplicatedObject('Request %s:%s already exists!: %s' % (scope, name, error))
     except DatabaseError as error:
@@ -72,6 +189,251 @@ def add_request(scope, name, data_type=DataType.DATASET, granularity_type=Granul
     return new_request.request_id
 
 
+# the attributes of the requests added in bulk
+REQUEST_ATTRIBUTES = ['scope', 'name', 'data_type', 'granularity_type', 'granularity_level', 'priority', 'edge_id',
+                      'status', 'request_meta', 'processing_meta', 'errors']
+
+# the results of the requests added in bulk
+BULK_CREATED = 'created'
+BULK_DUPLICATE = 'duplicate'
+BULK_INVALID = 'invalid'
+
+
+def _normalize_enum(enum, value, default):
+    value = enum.normalize(value) if value is not None else default
+    if not isinstance(value, EnumSymbol) or value.cls_ is not enum:
+        raise ValueError("Invalid value for %r: %r" % (enum.__name__, value))
+    return value
+
+
+def _validate_request(request):
+    """
+    Validate the attributes of a request added in bulk.
+
+    :raises ValueError: If the request is not valid.
+
+    :returns: dictionary of all the attributes of the request.
+    """
+    if not isinstance(request, dict):
+        raise ValueError("A request should be a dictionary: %r" % (request,))
+    unknown = [key for key in request if key not in REQUEST_ATTRIBUTES]
+    if unknown:
+        raise ValueError("Unknown attributes: %s" % ', '.join(sorted(unknown)))
+    for key, length in (('scope', SCOPE_LENGTH), ('name', NAME_LENGTH)):
+        if not request.get(key) or not isinstance(request[key], basestring) or len(request[key]) > length:
+            raise ValueError("%s should be a string of 1 to %s characters: %r" % (key, length, request.get(key)))
+    for key in ('granularity_level', 'priority', 'edge_id'):
+        value = request.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, long))):
+            raise ValueError("%s should be an integer: %r" % (key, value))
+
+    row = dict([(key, request.get(key)) for key in REQUEST_ATTRIBUTES])
+    row['data_type'] = _normalize_enum(DataType, row['data_type'], DataType.DATASET)
+    row['granularity_type'] = _normalize_enum(GranularityType, row['granularity_type'], GranularityType.FILE)
+    row['status'] = _normalize_enum(RequestStatus, row['status'], RequestStatus.NEW)
+    if row['priority'] is None:
+        row['priority'] = 0
+    return row
+
+
+def _get_data_key(row):
+    return (row['scope'], row['name'], row['data_type'], row['granularity_type'], row['granularity_level'])
+
+
+def _next_request_ids(count, session=None):
+    """
+    Get the next request ids of the sequence, to insert requests with executemany.
+    """
+    sequence = models.Request.__table__.c.request_id.default
+    dialect = session.bind.dialect
+    if dialect.name == 'oracle':
+        query = text('SELECT %s FROM dual CONNECT BY LEVEL <= :count' % sequence.next_value().compile(dialect=dialect))
+        rows = session.execute(query, {'count': count})
+    else:
+        rows = session.execute(select([sequence.next_value()]).select_from(func.generate_series(1, count)))
+    return sorted([row[0] for row in rows])
+
+
+# the auto-increment lock modes and increments of the MySQL databases, by url
+_AUTOINC_SETTINGS = {}
+
+
+def _get_autoinc_increment(session=None):
+    """
+    Get the step between the auto-increment ids of the rows inserted by one MySQL statement, or None if the ids
+    are not regular. They are not with the interleaved lock mode (2), where concurrent inserts share the
+    auto-increment counter. The step is auto_increment_increment, set to more than 1 by multi-master setups.
+    """
+    url = str(session.bind.engine.url)
+    if url not in _AUTOINC_SETTINGS:
+        _AUTOINC_SETTINGS[url] = tuple(session.execute(text('SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment')).first())
+    lock_mode, increment = _AUTOINC_SETTINGS[url]
+    return increment if lock_mode in (0, 1) else None
+
+
+def _insert_requests(rows, session=None):
+    """
+    Insert requests. With a sequence (PostgreSQL and Oracle) the ids are fetched first and the requests
+    are inserted with executemany. On MySQL the requests are inserted with one multi-row statement, whose
+    ids follow LAST_INSERT_ID() by auto_increment_increment when the auto-increment lock mode is not
+    interleaved. Otherwise they are inserted one by one to get their autoincremented id.
+
+    :returns: list of the request ids, in the order of the rows.
+    """
+    table = models.Request.__table__
+    dialect = session.bind.dialect.name
+    if dialect in ('postgresql', 'oracle'):
+        request_ids = _next_request_ids(len(rows), session=session)
+        session.execute(table.insert(), [dict(row, request_id=request_id) for row, request_id in zip(rows, request_ids)])
+        return request_ids
+    increment = _get_autoinc_increment(session=session) if dialect == 'mysql' and len(rows) > 1 else None
+    if increment:
+        result = session.execute(table.insert().values(rows))
+        # LAST_INSERT_ID() is the id of the first row inserted by the statement
+        return range(result.lastrowid, result.lastrowid + result.rowcount * increment, increment)
+    return [session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+def _get_requests_in_flight(rows, session=None):
+    """
+    Get the requests in flight and the subscribed requests for the same data as rows. The data keys are
+    locked before, by _lock_primary_requests.
+
+    :returns: dictionary of the data keys to lists of (request_id, priority, status, request_meta), by request_id.
+    """
+    table = models.Request.__table__
+    keys = set([_get_data_key(row) for row in rows])
+    query = select([table.c.request_id, table.c.scope, table.c.name, table.c.data_type, table.c.granularity_type,
+                    table.c.granularity_level, table.c.priority, table.c.status, table.c.request_meta])\
+        .where(and_(table.c.scope.in_(list(set([key[0] for key in keys]))),
+                    table.c.name.in_(list(set([key[1] for key in keys]))),
+                    table.c.status.in_(COALESCED_STATUSES + [RequestStatus.SUBSCRIBED])))\
+        .order_by(table.c.request_id)
+    in_flight = {}
+    for row in session.execute(query).fetchall():
+        key = tuple(row[1:6])
+        if key in keys:
+            in_flight.setdefault(key, []).append((row[0], row[6], row[7], row[8]))
+    return in_flight
+
+
+@transactional_session
+def add_requests(requests, coalesce=False, chunk_size=DEFAULT_CHUNK_SIZE, session=None):
+    """
+    Add requests in bulk. Every request gets a result:
+        created: the request is added, with its request_id (and primary_request_id if it is subscribed).
+        duplicate: the request repeats an earlier request of the list (or, with coalesce, a request in flight)
+                   with the same data and request_meta. request_id is the id of the earlier request.
+        invalid: the request is not added, error tells why.
+
+    The requests are inserted in chunks with executemany where the database has a sequence.
+
+    :param requests: List of dictionaries of the attributes of the requests, as for add_request.
+    :param coalesce: Subscribe the new requests to the requests in flight for the same data, as add_request,
+                     and to the first new request for the same data in the list.
+    :param chunk_size: Number of requests to insert at once.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: list of the results of the requests, in their order, as dictionaries with result, request_id
+              and, for the subscribed requests, primary_request_id, for the invalid requests, error.
+    """
+    results = [None] * len(requests)
+    rows = []
+    first_indexes = {}
+    duplicates = []
+    for index, request in enumerate(requests):
+        try:
+            row = _validate_request(request)
+        except ValueError as error:
+            results[index] = {'result': BULK_INVALID, 'request_id': None, 'error': str(error)}
+            continue
+        key = _get_data_key(row) + (json.dumps(row['request_meta'], sort_keys=True),)
+        if key in first_indexes:
+            duplicates.append((index, first_indexes[key]))
+        else:
+            first_indexes[key] = index
+            rows.append((index, row))
+
+    subscriptions = models.RequestSubscription.__table__
+    table = models.Request.__table__
+    try:
+        # the data keys of all the requests are locked at once, in order
+        coalesced_keys = [_get_data_key(item[1]) for item in rows if coalesce and item[1]['status'] == RequestStatus.NEW]
+        locked = _lock_primary_requests(coalesced_keys, session=session) if coalesced_keys else {}
+        for chunk in chunks(rows, chunk_size):
+            coalesced = [item[1] for item in chunk if coalesce and item[1]['status'] == RequestStatus.NEW]
+            in_flight = _get_requests_in_flight(coalesced, session=session) if coalesced else {}
+
+            # the primary request of every data, with its priority, and the requests subscribed to it
+            primaries, new_rows = {}, []
+            for index, row in chunk:
+                if not (coalesce and row['status'] == RequestStatus.NEW):
+                    new_rows.append((index, row))
+                    continue
+                key = _get_data_key(row)
+                existing = [request for request in in_flight.get(key, []) if request[3] == row['request_meta']]
+                if existing:
+                    results[index] = {'result': BULK_DUPLICATE, 'request_id': existing[0][0]}
+                    continue
+                if key not in primaries:
+                    primary = locked.get(key)
+                    if primary:
+                        primaries[key] = {'request_id': primary[0], 'priority': primary[1] or 0,
+                                          'current_priority': primary[1] or 0, 'row': None}
+                    else:
+                        # the first new request for the data is processed
+                        primaries[key] = {'request_id': None, 'priority': row['priority'], 'row': row}
+                        new_rows.append((index, row))
+                        continue
+                primaries[key]['priority'] = max(primaries[key]['priority'], row['priority'])
+                row['status'] = RequestStatus.SUBSCRIBED
+                row['key'] = key
+                new_rows.append((index, row))
+
+            # the primary requests are processed with the highest priority of their subscribers
+            for primary in primaries.values():
+                if primary['row']:
+                    primary['row']['priority'] = primary['priority']
+
+            if not new_rows:
+                continue
+            request_ids = _insert_requests([dict([(k, item[1][k]) for k in REQUEST_ATTRIBUTES]) for item in new_rows],
+                                           session=session)
+            for (index, row), request_id in zip(new_rows, request_ids):
+                row['request_id'] = request_id
+                results[index] = {'result': BULK_CREATED, 'request_id': request_id}
+            for status in set([row['status'] for index, row in new_rows]):
+                record_transitions([row['request_id'] for index, row in new_rows if row['status'] == status], None, status,
+                                   session=session)
+            for key, primary in primaries.items():
+                if primary['row']:
+                    primary['request_id'] = primary['row']['request_id']
+                elif primary['priority'] > primary['current_priority']:
+                    session.execute(table.update().where(table.c.request_id == primary['request_id'])
+                                                  .values(priority=primary['priority']))
+                # the requests of the next chunks subscribe to the primary requests of this chunk
+                locked[key] = (primary['request_id'], primary['priority'])
+            _set_primary_requests(dict([(item[0], item[1]['request_id']) for item in primaries.items() if item[1]['row']]),
+                                  session=session)
+
+            subscribed = []
+            for index, row in new_rows:
+                if row['status'] == RequestStatus.SUBSCRIBED:
+                    primary_request_id = primaries[row['key']]['request_id']
+                    results[index]['primary_request_id'] = primary_request_id
+                    subscribed.append({'request_id': row['request_id'], 'primary_request_id': primary_request_id})
+            if subscribed:
+                session.execute(subscriptions.insert(), subscribed)
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+    for index, first_index in duplicates:
+        results[index] = {'result': BULK_DUPLICATE, 'request_id': results[first_index]['request_id']}
+    return results
+
+
 @transactional_session
 def update_request(request_id, parameters, session=None):
     """
@@ -99,20 +461,206 @@ def update_request(request_id, parameters, session=None):
            (isinstance(parameters['status'], str) or isinstance(parameters['status'], unicode)):
             parameters['status'] = RequestStatus.from_sym(str(parameters['status']))
 
+        if 'priority' in parameters and parameters['priority'] is None:
+            # the requests are fetched in the order of their priority
+            parameters['priority'] = 0
+
         request = session.query(models.Request).filter_by(request_id=request_id).one()
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('Request %s cannot be found: %s' % (request_id, error))
 
     try:
-        request.update(parameters)
+        from_status = request.status
+        request.update(parameters, session=session)
+        if parameters.get('status') and parameters['status'] != from_status:
+            record_transitions([request.request_id], from_status, parameters['status'], session=session)
+        if parameters.get('status') in SUBSCRIPTION_FINAL_STATUSES:
+            complete_subscriptions([request.request_id], session=session)
     except DatabaseError as error:
         raise exceptions.DatabaseException(error.args)
 
     return request.request_id
 
 
+def _normalize_request_parameters(parameters):
+    parameters = dict(parameters)
+    if 'data_type' in parameters:
+        parameters['data_type'] = DataType.normalize(parameters['data_type'])
+    if 'granularity_type' in parameters:
+        parameters['granularity_type'] = GranularityType.normalize(parameters['granularity_type'])
+    if 'status' in parameters:
+        parameters['status'] = RequestStatus.normalize(parameters['status'])
+    return parameters
+
+
+@transactional_session
+def transition_requests(request_ids, from_status, to_status, parameters=None, with_subscribers=False, session=None):
+    """
+    Atomically switch requests from one status to another, only the ones which are still in the
+    from status. Parallel daemons transitioning the same requests get disjoint sets of requests.
+    The requests subscribed to the requests transitioned out of the pipeline (to AVAILABLE, ERROR,
+    WAITING, ...) are completed with them.
+
+    On PostgreSQL the transitioned requests are returned by the guarded update. On MySQL and Oracle
+    the requests in the from status are locked first, then updated. Other databases (SQLite)
+    update the requests first and then select them back by the update time.
+
+    :param request_ids: List of request ids.
+    :param from_status: The status of the requests to transition.
+    :param to_status: The status of the transitioned requests.
+    :param parameters: A dictionary of other parameters to set on the transitioned requests.
+    :param with_subscribers: Return also the subscribed requests completed with the transitioned requests.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: list of the transitioned request ids, in the order of request_ids, without duplicates.
+              With with_subscribers, (list of the transitioned request ids, list of the completed
+              subscribed requests as returned by complete_subscriptions).
+    """
+    from_status = RequestStatus.normalize(from_status)
+    to_status = RequestStatus.normalize(to_status)
+    parameters = _normalize_request_parameters(parameters or {})
+    parameters['status'] = to_status
+    parameters['updated_at'] = datetime.datetime.utcnow()
+
+    table = models.Request.__table__
+    transitioned = set()
+    try:
+        dialect = session.bind.dialect.name
+        for chunk in chunks(list(set(request_ids)), DEFAULT_CHUNK_SIZE):
+            criteria = and_(table.c.request_id.in_(chunk), table.c.status == from_status)
+            if dialect == 'postgresql':
+                result = session.execute(table.update().where(criteria).values(parameters).returning(table.c.request_id))
+                transitioned.update([row[0] for row in result])
+            elif dialect in ('mysql', 'oracle'):
+                locked_ids = [row[0] for row in session.execute(select([table.c.request_id]).where(criteria).with_for_update())]
+                if locked_ids:
+                    session.execute(table.update().where(and_(table.c.request_id.in_(locked_ids), table.c.status == from_status))
+                                                  .values(parameters))
+                transitioned.update(locked_ids)
+            else:
+                result = session.execute(table.update().where(criteria).values(parameters))
+                if result.rowcount == len(chunk):
+                    transitioned.update(chunk)
+                elif result.rowcount:
+                    query = select([table.c.request_id]).where(and_(table.c.request_id.in_(chunk),
+                                                                    table.c.status == to_status,
+                                                                    table.c.updated_at == parameters['updated_at']))
+                    transitioned.update([row[0] for row in session.execute(query)])
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+    ordered_ids = []
+    for request_id in request_ids:
+        if request_id in transitioned:
+            ordered_ids.append(request_id)
+            transitioned.remove(request_id)
+
+    record_transitions(ordered_ids, from_status, to_status, transitioned_at=parameters['updated_at'], session=session)
+    subscribers = []
+    if ordered_ids and to_status in SUBSCRIPTION_FINAL_STATUSES:
+        subscribers = complete_subscriptions(ordered_ids, session=session)
+    if with_subscribers:
+        return ordered_ids, subscribers
+    return ordered_ids
+
+
+@transactional_session
+def complete_subscriptions(primary_request_ids, session=None):
+    """
+    Complete the requests subscribed to primary requests out of the pipeline (in AVAILABLE, ERROR,
+    WAITING, ...), with the status, the edge, the processing metadata and the errors of their primary
+    request. The subscriptions are deleted.
+
+    :param primary_request_ids: List of primary request ids.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: list of the completed subscribed requests, as dictionaries with request_id, primary_request_id,
+              scope, name, status and request_meta.
+    """
+    requests, subscriptions = models.Request.__table__, models.RequestSubscription.__table__
+    completed = []
+    try:
+        for chunk in chunks(list(set(primary_request_ids)), DEFAULT_CHUNK_SIZE):
+            subscribers = {}
+            query = select([subscriptions.c.primary_request_id, subscriptions.c.request_id])\
+                .where(subscriptions.c.primary_request_id.in_(chunk))
+            for primary_request_id, request_id in session.execute(query):
+                subscribers.setdefault(primary_request_id, []).append(request_id)
+            if not subscribers:
+                continue
+
+            query = select([requests.c.request_id, requests.c.status, requests.c.edge_id, requests.c.processing_meta,
+                            requests.c.errors]).where(and_(requests.c.request_id.in_(list(subscribers.keys())),
+                                                           requests.c.status.in_(SUBSCRIPTION_FINAL_STATUSES)))
+            completed_ids = []
+            for primary_request_id, status, edge_id, processing_meta, errors in session.execute(query).fetchall():
+                parameters = {'status': status, 'edge_id': edge_id, 'errors': errors,
+                              'processing_meta': dict(processing_meta or {}, primary_request_id=primary_request_id)}
+                for ids in chunks(subscribers[primary_request_id], DEFAULT_CHUNK_SIZE):
+                    query = select([requests.c.request_id, requests.c.scope, requests.c.name, requests.c.request_meta])\
+                        .where(and_(requests.c.request_id.in_(ids), requests.c.status == RequestStatus.SUBSCRIBED))\
+                        .order_by(requests.c.request_id).with_for_update()
+                    rows = session.execute(query).fetchall()
+                    if not rows:
+                        continue
+                    ids = [row[0] for row in rows]
+                    session.execute(requests.update().where(requests.c.request_id.in_(ids)).values(parameters))
+                    record_transitions(ids, RequestStatus.SUBSCRIBED, status, session=session)
+                    completed.extend([{'request_id': request_id, 'primary_request_id': primary_request_id,
+                                       'scope': scope, 'name': name, 'status': status, 'request_meta': request_meta}
+                                      for request_id, scope, name, request_meta in rows])
+                completed_ids.append(primary_request_id)
+            if completed_ids:
+                session.execute(subscriptions.delete().where(subscriptions.c.primary_request_id.in_(completed_ids)))
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+    return completed
+
+
 @read_session
-def get_request(scope=None, name=None, request_id=None, request_meta=None, session=None):
+def get_subscriptions(primary_request_id, session=None):
+    """
+    Get the requests subscribed to a primary request.
+
+    :param primary_request_id: The primary request id.
+    :param session: The database session in use.
+
+    :returns: list of the subscribed request ids.
+    """
+    table = models.RequestSubscription.__table__
+    query = select([table.c.request_id]).where(table.c.primary_request_id == primary_request_id).order_by(table.c.request_id)
+    return [row[0] for row in session.execute(query)]
+
+
+def _release_subscriptions(request_id, session=None):
+    """
+    Delete the subscription of a request. If the request is a primary request, its oldest subscribed
+    request becomes the primary request of the others and is processed.
+    """
+    requests, subscriptions = models.Request.__table__, models.RequestSubscription.__table__
+    data_keys = models.RequestDataKey.__table__
+    session.execute(subscriptions.delete().where(subscriptions.c.request_id == request_id))
+
+    subscriber_ids = get_subscriptions(request_id, session=session)
+    if subscriber_ids:
+        new_primary_id = subscriber_ids[0]
+        session.execute(subscriptions.delete().where(subscriptions.c.request_id == new_primary_id))
+        session.execute(subscriptions.update().where(subscriptions.c.primary_request_id == request_id)
+                                              .values(primary_request_id=new_primary_id))
+        result = session.execute(requests.update().where(and_(requests.c.request_id == new_primary_id,
+                                                              requests.c.status == RequestStatus.SUBSCRIBED))
+                                                  .values(status=RequestStatus.NEW))
+        if result.rowcount:
+            record_transitions([new_primary_id], RequestStatus.SUBSCRIBED, RequestStatus.NEW, session=session)
+        session.execute(data_keys.update().where(data_keys.c.request_id == request_id).values(request_id=new_primary_id))
+
+
+@read_session
+def get_request(scope=None, name=None, request_id=None, request_meta=None, columns=None, session=None):
     """
     Get a request or raise a NoObject exception.
 
@@ -120,93 +668,146 @@ def get_request(scope=None, name=None, request_id=None, request_meta=None, sessi
     :param name: The name of the request data.
     :param request_id: The id of the request.
     :param request_meta: The metadata of the request, as Json.
+    :param columns: List of the column names to return as a record instead of the model.
+                    request_id is always returned.
     :param session: The database session in use.
 
     :raises NoObject: If no request is founded.
+    :raises CoreException: If a column does not exist.
 
-    :returns: Request model.
+    :returns: Request model, or record of the columns.
     """
 
     try:
+        if columns:
+            table = models.Request.__table__
+            if request_id:
+                criteria = [table.c.request_id == request_id]
+            else:
+                criteria = [table.c.scope == scope, table.c.name == name]
+                if request_meta:
+                    criteria.append(table.c.request_meta.like(request_meta))
+            records = select_records(session, table, project_columns(table, columns, required=['request_id']), criteria)
+            if not records:
+                raise sqlalchemy.orm.exc.NoResultFound()
+            return records[0]
+
         if request_id:
-            request = session.query(models.Request).filter_by(request_id=request_id).one()
+            query = BAKERY(lambda session: session.query(models.Request))
+            query += lambda q: q.filter(models.Request.request_id == bindparam('request_id'))
+            request = run_baked_query(query, session, request_id=request_id).one()
         else:
             request = session.query(models.Request).filter_by(scope=scope, name=name).filter(request_meta.like(request_meta)).one()
 
-        request['data_type'] = request.data_type
-        request['granularity_type'] = request.granularity_type
-        request['status'] = request.status
         return request
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('request %s:%s(id:%s,meta:%s) cannot be found: %s' % (scope, name, request_id, request_meta, error))
 
 
 @read_session
-def get_requests_by_edge(edge_name, edge_id=None, session=None):
+def get_requests_by_edge(edge_name, edge_id=None, columns=None, session=None):
     """
     Get requests by edge.
 
     :param edge_name: The name of the edge.
     :param edge_id: The id of the edge
+    :param columns: List of the column names to return as records instead of the models.
+                    request_id is always returned.
     :param session: The database session in use.
 
     :raises NoObject: If no request is founded.
+    :raises CoreException: If a column does not exist.
 
-    :returns: list of Request model.
+    :returns: list of Request model, or records of the columns.
     """
 
     try:
         if not edge_id:
             edge_id = get_edge_id(edge_name)
 
-        requests = session.query(models.Request).filter_by(edge_id=edge_id).all()
+        if columns:
+            table = models.Request.__table__
+            return select_records(session, table, project_columns(table, columns, required=['request_id']),
+                                  [table.c.edge_id == edge_id])
+
+        query = BAKERY(lambda session: session.query(models.Request))
+        query += lambda q: q.filter(models.Request.edge_id == bindparam('edge_id'))
+        requests = run_baked_query(query, session, edge_id=edge_id).all()
 
-        for request in requests:
-            request['data_type'] = request.data_type
-            request['granularity_type'] = request.granularity_type
-            request['status'] = request.status
         return requests
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('No requests at %s: %s' % (edge_name, error))
 
 
 @read_session
-def get_requests(status=None, edge_name=None, edge_id=None, session=None):
+def get_requests(status=None, edge_name=None, edge_id=None, with_metadata=True, columns=None,
+                 order_by_priority=False, limit=None, after=None, session=None):
     """
     Get requests.
 
     :param status: The status of the request data.
     :param edge_name: The name of the edge.
     :param edge_id: The id of the edge
+    :param with_metadata: Load and decode request_meta, processing_meta and errors. If False, they are
+                          deferred and not available on the returned requests.
+    :param columns: List of the column names to return as records instead of the models.
+                    request_id is always returned.
+    :param order_by_priority: Order the requests by priority descending, then by request_id.
+                              The requests are ordered when limit or after is set.
+    :param limit: Maximum number of requests to return.
+    :param after: (priority, request_id) of the last request of a previous call, to continue after it.
     :param session: The database session in use.
 
     :raises NoObject: If no request is founded.
+    :raises CoreException: If a column does not exist.
 
-    :returns: Request models.
+    :returns: Request models, or records of the columns.
     """
 
     try:
         if edge_name and not edge_id:
             edge_id = get_edge_id(edge_name)
-
-        if status:
-            if (isinstance(status, str) or isinstance(status, unicode)):
-                status = RequestStatus.from_sym(status)
-
+        status = RequestStatus.normalize(status)
+        order_by_priority = order_by_priority or bool(limit) or after is not None
+        after_priority, after_request_id = after if after is not None else (None, None)
+        if after is not None and after_priority is None:
+            # the requests without a priority, created before the priorities were required, have priority 0
+            after_priority = 0
+
+        if columns:
+            table = models.Request.__table__
+            criteria = []
+            if status:
+                criteria.append(table.c.status == status)
             if edge_id:
-                requests = session.query(models.Request).filter_by(status=status, edge_id=edge_id).all()
-            else:
-                requests = session.query(models.Request).filter_by(status=status).all()
-        else:
-            if edge_id:
-                requests = session.query(models.Request).filter_by(edge_id=edge_id).all()
-            else:
-                requests = session.query(models.Request).all()
+                criteria.append(table.c.edge_id == edge_id)
+            if after is not None:
+                criteria.append(or_(table.c.priority < after_priority,
+                                    and_(table.c.priority == after_priority, table.c.request_id > after_request_id)))
+            columns = project_columns(table, columns, required=['request_id'])
+            order_by = [table.c.priority.desc(), table.c.request_id] if order_by_priority else None
+            return select_records(session, table, columns, criteria, order_by=order_by, limit=limit)
+
+        query = BAKERY(lambda session: session.query(models.Request))
+        if status:
+            query += lambda q: q.filter(models.Request.status == bindparam('status'))
+        if edge_id:
+            query += lambda q: q.filter(models.Request.edge_id == bindparam('edge_id'))
+        if after is not None:
+            query += lambda q: q.filter(or_(models.Request.priority < bindparam('after_priority'),
+                                            and_(models.Request.priority == bindparam('after_priority'),
+                                                 models.Request.request_id > bindparam('after_request_id'))))
+        if not with_metadata:
+            query += lambda q: q.options(defer(models.Request.request_meta),
+                                         defer(models.Request.processing_meta),
+                                         defer(models.Request.errors))
+        if order_by_priority:
+            query += lambda q: q.order_by(models.Request.priority.desc(), models.Request.request_id)
+        if limit:
+            query += lambda q: q.limit(bindparam('limit'))
+        requests = run_baked_query(query, session, status=status, edge_id=edge_id, after_priority=after_priority,
+                                   after_request_id=after_request_id, limit=limit).all()
 
-        for request in requests:
-            request['data_type'] = request.data_type
-            request['granularity_type'] = request.granularity_type
-            request['status'] = request.status
         return requests
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('Cannot find request with status: %s, %s' % (status, error))
@@ -215,7 +816,7 @@ def get_requests(status=None, edge_name=None, edge_id=None, session=None):
 @transactional_session
 def delete_request(request_id, session=None):
     """
-    Delete a request or raise a NoObject exception.
+    Delete a request and its transitions or raise a NoObject exception.
 
     :param request_id: The request id.
     :param session: The database session in use.
@@ -224,6 +825,8 @@ def delete_request(request_id, session=None):
     """
 
     try:
+        _release_subscriptions(request_id, session=session)
         session.query(models.Request).filter_by(request_id=request_id).delete()
+        session.query(models.RequestTransition).filter_by(request_id=request_id).delete()
     except sqlalchemy.orm.exc.NoResultFound as error:
         raise exceptions.NoObject('Request %s cannot be found: %s' % (request_id, error))
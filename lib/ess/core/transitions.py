@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+operations related to the transitions of the requests between statuses, to time the stages of the requests.
+
+The transitions are kept with the session changing the statuses, moved to a buffer of the process when the
+session commits (and dropped when it rolls back), and inserted in bulk by a background thread of the buffer,
+so that the transactions changing the statuses do not insert them.
+"""
+
+import atexit
+import datetime
+import logging
+import socket
+import threading
+
+from sqlalchemy import and_, case, event, func, or_, select
+from sqlalchemy.exc import DatabaseError
+from sqlalchemy.orm import Session
+
+from ess.common import exceptions
+from ess.core.edges import get_edge_id
+from ess.orm.constants import RequestStatus
+from ess.orm.models import Edge, Request, RequestArchive, RequestTransition
+from ess.orm.session import get_session, read_session, transactional_session
+from ess.orm.utils import DEFAULT_CHUNK_SIZE, chunks
+
+
+# number of buffered transitions and seconds after which the buffer is inserted
+DEFAULT_FLUSH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 10
+# maximum number of buffered transitions, the next ones are dropped while they cannot be inserted
+DEFAULT_MAX_BUFFERED = 100000
+
+# seconds of the transitions to time the stages from, by default and at most
+DEFAULT_STAGE_PERIOD = 24 * 3600
+MAX_STAGE_PERIOD = 7 * 24 * 3600
+# upper bounds in seconds of the stage duration histogram buckets
+STAGE_BUCKETS = (1, 10, 60, 600, 3600, 6 * 3600, 24 * 3600)
+# the stage from the creation of a request to one of these statuses
+TOTAL_STAGE = 'TOTAL'
+TOTAL_STATUSES = [RequestStatus.AVAILABLE, RequestStatus.ERROR]
+
+_SESSION_KEY = 'ess_request_transitions'
+
+
+class TransitionLog(object):
+    """
+    Thread-safe buffer of the request transitions of the process, inserted in bulk.
+    """
+
+    def __init__(self, flush_size=DEFAULT_FLUSH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL, max_buffered=DEFAULT_MAX_BUFFERED):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.host = socket.gethostname()
+        self.default_daemon = None
+        self.dropped = 0
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def set_daemon(self, daemon, default=False):
+        """
+        Set the name recorded with the transitions of the current thread, or of all the threads without one.
+        The transitions of the threads without a name get the name of the thread.
+        """
+        if default:
+            self.default_daemon = daemon
+        else:
+            self._local.daemon = daemon
+
+    def get_daemon(self):
+        return getattr(self._local, 'daemon', None) or self.default_daemon or threading.current_thread().name
+
+    def add(self, rows):
+        """
+        Add transitions to the buffer and wake up the flushing thread when the buffer is full.
+        """
+        with self._lock:
+            space = max(self.max_buffered - len(self._rows), 0)
+            self.dropped += max(len(rows) - space, 0)
+            self._rows.extend(rows[:space])
+            full = len(self._rows) >= self.flush_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='TransitionLog')
+                self._thread.daemon = True
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Insert the buffered transitions, with a session of their own. If they cannot be inserted,
+        they are buffered again for the next flush.
+
+        :returns: number of inserted transitions.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            table = RequestTransition.__table__
+            session = get_session()
+            try:
+                for chunk in chunks(rows, DEFAULT_CHUNK_SIZE):
+                    session.execute(table.insert(), chunk)
+                session.commit()
+                return len(rows)
+            except Exception as error:
+                session.rollback()
+                logging.error("Failed to insert %s request transitions: %s" % (len(rows), error))
+                with self._lock:
+                    self._rows = rows[:self.max_buffered] + self._rows
+                    self.dropped += max(len(self._rows) - self.max_buffered, 0)
+                    self._rows = self._rows[:self.max_buffered]
+                return 0
+            finally:
+                session.remove()
+
+    def stats(self):
+        with self._lock:
+            return {'buffered': len(self._rows), 'dropped': self.dropped}
+
+
+TRANSITION_LOG = TransitionLog()
+
+
+def _after_commit(session):
+    rows = session.info.pop(_SESSION_KEY, None)
+    if rows:
+        TRANSITION_LOG.add(rows)
+
+
+def _after_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+event.listen(Session, 'after_commit', _after_commit)
+event.listen(Session, 'after_rollback', _after_rollback)
+atexit.register(TRANSITION_LOG.flush)
+
+
+def set_transition_daemon(daemon, default=False):
+    """
+    Set the name of the daemon recorded with the request transitions of the current thread.
+
+    :param daemon: The name of the daemon.
+    :param default: Set it for all the threads of the process without a name instead.
+    """
+    TRANSITION_LOG.set_daemon(daemon, default=default)
+
+
+def record_transitions(request_ids, from_status, to_status, transitioned_at=None, session=None):
+    """
+    Record transitions of requests, inserted once the session commits.
+
+    :param request_ids: List of request ids.
+    :param from_status: The status of the requests before the transition, None for new requests.
+    :param to_status: The status of the requests after the transition.
+    :param transitioned_at: The time of the transition, now by default.
+    :param session: The database session changing the statuses.
+    """
+    if not request_ids:
+        return
+    transitioned_at = transitioned_at or datetime.datetime.utcnow()
+    daemon, host = TRANSITION_LOG.get_daemon()[:64], TRANSITION_LOG.host[:128]
+    rows = session.info.setdefault(_SESSION_KEY, [])
+    for request_id in request_ids:
+        rows.append({'request_id': request_id, 'from_status': from_status, 'to_status': to_status,
+                     'transitioned_at': transitioned_at, 'daemon': daemon, 'host': host})
+
+
+def flush_transitions():
+    """
+    Insert the buffered request transitions of the process.
+
+    :returns: number of inserted transitions.
+    """
+    return TRANSITION_LOG.flush()
+
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile of sorted values.
+    """
+    return values[min(int(round(fraction * (len(values) - 1))), len(values) - 1)]
+
+
+def summarize_durations(durations, buckets=STAGE_BUCKETS):
+    """
+    Summarize durations in seconds with their percentiles and histogram.
+    """
+    durations = sorted(durations)
+    labels = ['<=%ss' % bound for bound in buckets] + ['>%ss' % buckets[-1]]
+    counts = [0] * (len(buckets) + 1)
+    for duration in durations:
+        for i, bound in enumerate(buckets):
+            if duration <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return {'count': len(durations),
+            'p50': percentile(durations, 0.5),
+            'p95': percentile(durations, 0.95),
+            'p99': percentile(durations, 0.99),
+            'mean': sum(durations) / len(durations),
+            'max': durations[-1],
+            'histogram': dict(zip(labels, counts))}
+
+
+@read_session
+def get_transitions(request_id, session=None):
+    """
+    Get the recorded transitions of a request.
+
+    :param request_id: The request id.
+    :param session: The database session in use.
+
+    :returns: list of RequestTransition models, in the order of the transitions.
+    """
+    return session.query(RequestTransition).filter_by(request_id=request_id)\
+        .order_by(RequestTransition.transitioned_at, RequestTransition.transition_id).all()
+
+
+def _has_window_functions(dialect):
+    """
+    Whether the database has the window functions, to pair the transitions of the requests.
+    """
+    version = dialect.server_version_info or ()
+    if dialect.name == 'sqlite':
+        return version >= (3, 25)
+    if dialect.name == 'mysql':
+        return version >= ((10, 2) if getattr(dialect, '_is_mariadb', False) else (8,))
+    return dialect.name in ('postgresql', 'oracle')
+
+
+def _get_transitions_query(since, until, edge_id):
+    """
+    Select the transitions of the requests between since and until, with the edge of their requests.
+    """
+    transitions, requests, archives = RequestTransition.__table__, Request.__table__, RequestArchive.__table__
+    # the edge of the requests, archived or not
+    request_edge_id = func.coalesce(requests.c.edge_id, archives.c.edge_id)
+    query = select([transitions.c.request_id, transitions.c.transition_id, transitions.c.from_status,
+                    transitions.c.to_status, transitions.c.transitioned_at, request_edge_id.label('edge_id')])\
+        .select_from(transitions.outerjoin(requests, requests.c.request_id == transitions.c.request_id)
+                                .outerjoin(archives, archives.c.request_id == transitions.c.request_id))\
+        .where(and_(transitions.c.transitioned_at >= since, transitions.c.transitioned_at <= until))
+    if edge_id:
+        query = query.where(request_edge_id == edge_id)
+    return query
+
+
+def _iter_paired_stages(since, until, edge_id, session=None):
+    """
+    Pair the transitions of the requests in the database, with LEAD over the transitions of every request:
+    a stage is the time from a transition to a status to the next transition, out of the same status.
+
+    :returns: iterator of (edge_id, stage, started_at, ended_at) of the stages.
+    """
+    columns = RequestTransition.__table__.c
+    query = _get_transitions_query(since, until, edge_id).alias('transitions')
+    order_by = [query.c.transitioned_at, query.c.transition_id]
+    paired = select([query.c.edge_id, query.c.to_status, query.c.transitioned_at,
+                     func.lead(query.c.from_status, type_=columns.from_status.type)
+                         .over(partition_by=query.c.request_id, order_by=order_by).label('next_from_status'),
+                     func.lead(query.c.transitioned_at, type_=columns.transitioned_at.type)
+                         .over(partition_by=query.c.request_id, order_by=order_by).label('next_transitioned_at'),
+                     func.min(case([(query.c.from_status.is_(None), query.c.transitioned_at)]), type_=columns.transitioned_at.type)
+                         .over(partition_by=query.c.request_id).label('created_at')]).alias('paired')
+    # only the transitions ending a stage are fetched
+    query = select([paired.c.edge_id, paired.c.to_status, paired.c.transitioned_at, paired.c.next_from_status,
+                    paired.c.next_transitioned_at, paired.c.created_at])\
+        .where(or_(paired.c.next_from_status == paired.c.to_status,
+                   and_(paired.c.to_status.in_(TOTAL_STATUSES), paired.c.created_at.isnot(None))))
+    for edge_id, to_status, transitioned_at, next_from_status, next_transitioned_at, created_at in session.execute(query):
+        if next_from_status == to_status:
+            yield edge_id, str(to_status), transitioned_at, next_transitioned_at
+        if to_status in TOTAL_STATUSES and created_at:
+            yield edge_id, TOTAL_STAGE, created_at, transitioned_at
+
+
+def _iter_stages(since, until, edge_id, session=None):
+    """
+    Pair the transitions of the requests in order, for the databases without the window functions.
+
+    :returns: iterator of (edge_id, stage, started_at, ended_at) of the stages.
+    """
+    transitions = RequestTransition.__table__
+    query = _get_transitions_query(since, until, edge_id)\
+        .order_by(transitions.c.request_id, transitions.c.transitioned_at, transitions.c.transition_id)
+    current_request_id, entered_at, created_at = None, {}, None
+    for request_id, transition_id, from_status, to_status, transitioned_at, request_edge_id in session.execute(query):
+        if request_id != current_request_id:
+            current_request_id, entered_at, created_at = request_id, {}, None
+        if from_status is None:
+            created_at = transitioned_at
+        elif from_status in entered_at:
+            yield request_edge_id, str(from_status), entered_at.pop(from_status), transitioned_at
+        if to_status in TOTAL_STATUSES and created_at:
+            yield request_edge_id, TOTAL_STAGE, created_at, transitioned_at
+        entered_at[to_status] = transitioned_at
+
+
+@read_session
+def get_stage_durations(edge_name=None, edge_id=None, since=None, until=None, session=None):
+    """
+    Get the durations of the stages of the requests per edge, in seconds: the time the requests spent in a status,
+    from their transition to it to their transition out of it, and the TOTAL time from their creation to AVAILABLE
+    or ERROR. Only the stages which started and ended between since and until are timed, over MAX_STAGE_PERIOD
+    at most.
+
+    The transitions are paired in the database where it has the window functions, so that only the
+    transitions ending a stage are fetched.
+
+    :param edge_name: The name of the edge, to only time the requests of an edge.
+    :param edge_id: The id of the edge.
+    :param since: The time of the first transitions, DEFAULT_STAGE_PERIOD ago by default. It is moved to
+                  MAX_STAGE_PERIOD before until if it is earlier.
+    :param until: The time of the last transitions, now by default.
+    :param session: The database session in use.
+
+    :raises NoObject: If the edge cannot be found.
+    :raises DatabaseException: If there is a database error.
+
+    :returns: list of dictionaries of the edge_id, edge_name, stage, count, p50, p95, p99, mean, max and
+              histogram of the stages, by edge and stage.
+    """
+    if edge_name and not edge_id:
+        edge_id = get_edge_id(edge_name, session=session)
+    until = until or datetime.datetime.utcnow()
+    since = max(since or until - datetime.timedelta(seconds=DEFAULT_STAGE_PERIOD),
+                until - datetime.timedelta(seconds=MAX_STAGE_PERIOD))
+
+    durations = {}
+    try:
+        if _has_window_functions(session.bind.dialect):
+            stages = _iter_paired_stages(since, until, edge_id, session=session)
+        else:
+            stages = _iter_stages(since, until, edge_id, session=session)
+        for request_edge_id, stage, started_at, ended_at in stages:
+            durations.setdefault((request_edge_id, stage), []).append((ended_at - started_at).total_seconds())
+
+        edge_ids = list(set([key[0] for key in durations if key[0]]))
+        edge_names = {}
+        for chunk in chunks(edge_ids, DEFAULT_CHUNK_SIZE):
+            edges = Edge.__table__
+            edge_names.update(session.execute(select([edges.c.edge_id, edges.c.edge_name]).where(edges.c.edge_id.in_(chunk))).fetchall())
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
+
+    stages = []
+    for (request_edge_id, stage), stage_durations in sorted(durations.items()):
+        summary = summarize_durations(stage_durations)
+        summary.update({'edge_id': request_edge_id, 'edge_name': edge_names.get(request_edge_id), 'stage': stage})
+        stages.append(summary)
+    return stages
+
+
+@transactional_session
+def purge_transitions(older_than, limit=DEFAULT_CHUNK_SIZE, session=None):
+    """
+    Delete a batch of the request transitions recorded a while ago.
+
+    :param older_than: Seconds since the transitions.
+    :param limit: Maximum number of transitions to delete.
+    :param session: The database session in use.
+
+    :raises DatabaseException: If there is a database error.
+
+    :returns: number of deleted transitions.
+    """
+    transitioned_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than)
+    table = RequestTransition.__table__
+    query = select([table.c.transition_id]).where(table.c.transitioned_at < transitioned_before)\
+        .order_by(table.c.transition_id).limit(limit)
+    try:
+        transition_ids = [row[0] for row in session.execute(query)]
+        for chunk in chunks(transition_ids, DEFAULT_CHUNK_SIZE):
+            session.execute(table.delete().where(and_(table.c.transition_id.in_(chunk),
+                                                      table.c.transitioned_at < transitioned_before)))
+        return len(transition_ids)
+    except DatabaseError as error:
+        raise exceptions.DatabaseException(error.args)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+import time
+import traceback
+
+from ess.common.constants import Sections
+from ess.common.exceptions import ESSException
+from ess.common.utils import setup_logging
+from ess.core.archive import (ARCHIVE_CONTENT_STATUSES, ARCHIVE_REQUEST_STATUSES, DEFAULT_ARCHIVE_AGE,
+                              DEFAULT_ARCHIVE_BATCH_SIZE, archive_contents, archive_requests, purge_archives)
+from ess.core.transitions import purge_transitions
+from ess.daemons.common.basedaemon import BaseDaemon
+from ess.orm.constants import ContentStatus, RequestStatus
+
+setup_logging(__name__)
+
+
+class Archiver(BaseDaemon):
+    """
+    The Archiver daemon class, moving the finished contents and requests to the archive tables.
+    """
+
+    def __init__(self, num_threads=1, **kwargs):
+        super(Archiver, self).__init__(num_threads, **kwargs)
+
+        self.config_section = Sections.Archiver
+        self.archive_interval = int(getattr(self, 'archive_interval', 3600))
+        self.archive_after = int(getattr(self, 'archive_after', DEFAULT_ARCHIVE_AGE))
+        self.batch_size = int(getattr(self, 'batch_size', DEFAULT_ARCHIVE_BATCH_SIZE))
+        self.max_batches = int(getattr(self, 'max_batches', 100))
+        # 0 to keep the archived rows
+        self.purge_after = int(getattr(self, 'purge_after', 0))
+        # seconds to keep the request transitions, 0 to keep them
+        self.transitions_purge_after = int(getattr(self, 'transitions_purge_after', 30 * 24 * 3600))
+        self.content_statuses = self.get_statuses('content_statuses', ContentStatus, ARCHIVE_CONTENT_STATUSES)
+        self.request_statuses = self.get_statuses('request_statuses', RequestStatus, ARCHIVE_REQUEST_STATUSES)
+        self.last_archived_at = 0
+
+        self.setup_logger()
+
+    def get_statuses(self, option, enum, default):
+        if not hasattr(self, option):
+            return default
+        return [enum.normalize(status) for status in getattr(self, option).split(',') if status.strip()]
+
+    def archive_in_batches(self, archive_func, statuses):
+        """
+        Archive batches until a batch is not full or max_batches are archived, committing every batch.
+        """
+        archived = 0
+        for i in range(self.max_batches):
+            num_archived = archive_func(statuses=statuses, older_than=self.archive_after, limit=self.batch_size)
+            archived += num_archived
+            if num_archived < self.batch_size or self.graceful_stop.is_set():
+                break
+        return archived
+
+    def archive(self):
+        """
+        Periodically archive the finished contents and requests, and purge the old archives and request transitions.
+        """
+        if time.time() < self.last_archived_at + self.archive_interval:
+            return
+
+        self.last_archived_at = time.time()
+        num_contents = self.archive_in_batches(archive_contents, self.content_statuses)
+        num_requests = self.archive_in_batches(archive_requests, self.request_statuses)
+        self.logger.info("Archived %s contents and %s requests" % (num_contents, num_requests))
+
+        if self.purge_after:
+            purged = 0
+            for i in range(self.max_batches):
+                num_purged = purge_archives(older_than=self.purge_after, limit=self.batch_size)
+                purged += num_purged
+                if num_purged < self.batch_size:
+                    break
+            self.logger.info("Purged %s archived contents and requests" % purged)
+
+        if self.transitions_purge_after:
+            purged = 0
+            for i in range(self.max_batches):
+                num_purged = purge_transitions(older_than=self.transitions_purge_after, limit=self.batch_size)
+                purged += num_purged
+                if num_purged < self.batch_size:
+                    break
+            self.logger.info("Purged %s request transitions" % purged)
+
+    def run(self):
+        """
+        Main run function.
+        """
+        try:
+            self.logger.info("Starting main thread")
+
+            while not self.graceful_stop.is_set():
+                try:
+                    self.archive()
+                except ESSException as error:
+                    self.logger.error("Main thread ESSException: %s" % str(error))
+                except Exception as error:
+                    self.logger.critical("Main thread exception: %s\n%s" % (str(error), traceback.format_exc()))
+                self.graceful_stop.wait(10)
+        except KeyboardInterrupt:
+            self.stop()
+        except Exception as error:
+            self.logger.error("Main thread ESSException: %s, %s" % (str(error), traceback.format_exc()))
+
+
+if __name__ == '__main__':
+    daemon = Archiver()
+    daemon.run()
@@ -15,9 +15,10 @@ from ess.common.exceptions import DuplicatedObject, NoObject, ESSException
 from ess.common.utils import setup_logging
 from ess.core.catalog import add_collection
 from ess.core.edges import get_edge_id
-from ess.core.requests import add_request, get_requests, update_request
+from ess.core.requests import add_request, get_requests, transition_requests
 from ess.daemons.common.basedaemon import BaseDaemon
 from ess.orm.constants import RequestStatus
+from ess.orm.session import unit_of_work
 
 setup_logging(__name__)
 
@@ -42,10 +43,9 @@ class Assigner(BaseDaemon):
             self.head_client = None
 
     def assign_local_requests(self):
-        reqs = get_requests(edge_name=self.resource_name, status=RequestStatus.ASSIGNING)
-        for req in reqs:
-            req.status = RequestStatus.ASSIGNED
-            update_request(req.request_id, {'status': req.status})
+        with unit_of_work():
+            reqs = get_requests(edge_name=self.resource_name, status=RequestStatus.ASSIGNING, columns=['request_id'])
+            transition_requests([req.request_id for req in reqs], RequestStatus.ASSIGNING, RequestStatus.ASSIGNED)
 
     def assign_remote_requests(self):
         if not self.head_client:
@@ -115,9 +115,9 @@ class Assigner(BaseDaemon):
         if req['name'] == 'assign_remote_requests':
             self.assign_remote_requests()
 
-    def finish_tasks(self):
+    def sleep_for_tasks(self):
         """
-        Finish processing the finished tasks, for example, update db status.
+        Sleep for tasks
         """
         self.graceful_stop.wait(30)
 
@@ -16,7 +16,7 @@ from ess.common.exceptions import NoObject, NoRequestedData, NoSuitableEdges, No
 from ess.common.utils import setup_logging
 from ess.core.catalog import add_collection, get_collection
 from ess.core.edges import get_edges
-from ess.core.requests import get_requests, update_request
+from ess.core.requests import get_requests, transition_requests, update_request
 from ess.daemons.common.basedaemon import BaseDaemon
 from ess.orm.constants import EdgeStatus, RequestStatus, CollectionType, CollectionStatus
 
@@ -44,14 +44,21 @@ class Broker(BaseDaemon):
         """
         Get tasks to process
         """
+        capacity = self.get_task_capacity()
+        if not capacity:
+            self.logger.info("Main thread has %s queued tasks, not getting more" % self.tasks.qsize())
+            return
 
-        requests = get_requests(status=RequestStatus.NEW)
+        requests = get_requests(status=RequestStatus.NEW, limit=capacity)
+        # only the requests still NEW are claimed, another broker may have claimed the others
+        request_ids = set(transition_requests([req.request_id for req in requests], RequestStatus.NEW, RequestStatus.BROKERING))
+        requests = [req for req in requests if req.request_id in request_ids]
 
         self.logger.info("Main thread get %s tasks" % len(requests))
         for req in requests:
             req.errors = None
+            req.status = RequestStatus.BROKERING
             self.tasks.put(req)
-            update_request(request_id=req.request_id, parameters={'status': RequestStatus.BROKERING})
         if requests:
             self.get_resources()
 
@@ -10,7 +10,10 @@
 
 
 import logging
+import os
+import socket
 import threading
+import time
 import traceback
 import Queue
 
@@ -22,6 +25,9 @@ from ess.common.constants import Sections
 from ess.common.config import config_has_section, config_has_option, config_list_options, config_get
 from ess.common.exceptions import ESSException, DaemonPluginError
 from ess.common.utils import setup_logging
+from ess.core.catalog import reclaim_expired_contents, renew_leases
+from ess.core.transitions import set_transition_daemon
+from ess.orm.session import unit_of_work
 
 
 setup_logging(__name__)
@@ -47,6 +53,18 @@ class BaseDaemon(Thread):
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
+        # leased content status to the status to return to when the lease expires
+        self.reclaim_statuses = {}
+        self.reclaim_interval = int(getattr(self, 'reclaim_interval', 300))
+        self.last_reclaimed_at = 0
+        self.reclaim_chunk_size = int(getattr(self, 'reclaim_chunk_size', 1000))
+        # contents leased by this daemon and not finished yet, their leases are renewed while they are processed
+        self.leased_content_ids = set()
+        self.last_renewed_at = 0
+
+        # maximum number of tasks waiting for the worker threads, the next ones are fetched by priority when they are free
+        self.max_queued_tasks = int(getattr(self, 'max_queued_tasks', 10 * int(num_threads)))
+
         self.plugins = {}
 
         self.logger = None
@@ -71,6 +89,12 @@ class BaseDaemon(Thread):
     def get_resouce_name(self):
         return config_get(Sections.ResourceManager, 'resource_name')
 
+    def get_lease_owner(self):
+        """
+        Owner name of the contents leased by this daemon.
+        """
+        return '%s:%s:%s' % (socket.gethostname(), os.getpid(), self.name)
+
     def get_head_service(self):
         if config_has_option(Sections.ResourceManager, 'head_service'):
             return config_get(Sections.ResourceManager, 'head_service')
@@ -141,6 +165,47 @@ class BaseDaemon(Thread):
                 self.logger.error("Messaging broker plugin throws an exception: %s, %s" % (error, traceback.format_exc()))
                 raise DaemonPluginError("Messaging broker plugin throws an exception: %s" % (error))
 
+    def reap_expired_leases(self):
+        """
+        Periodically return the contents with expired leases to the status they were claimed from.
+        """
+        if not self.reclaim_statuses or time.time() < self.last_reclaimed_at + self.reclaim_interval:
+            return
+
+        self.last_reclaimed_at = time.time()
+        num_contents = 0
+        while True:
+            # one batch of contents locked per transaction
+            num_reclaimed = reclaim_expired_contents(self.reclaim_statuses, edge_name=self.resource_name,
+                                                     limit=self.reclaim_chunk_size)
+            num_contents += num_reclaimed
+            if num_reclaimed < self.reclaim_chunk_size:
+                break
+        if num_contents:
+            self.logger.info("Reclaimed %s contents with expired leases" % num_contents)
+
+    def renew_content_leases(self):
+        """
+        Periodically renew the leases of the contents being processed, as the heartbeat of this daemon.
+        The contents whose lease was lost, reclaimed after it expired, are forgotten.
+        """
+        lease_seconds = int(getattr(self, 'lease_seconds', 3600))
+        if not self.leased_content_ids or time.time() < self.last_renewed_at + lease_seconds / 3:
+            return
+
+        self.last_renewed_at = time.time()
+        renewed = renew_leases(self.get_lease_owner(), list(self.leased_content_ids), lease_seconds=lease_seconds)
+        lost = self.leased_content_ids - set(renewed)
+        if lost:
+            self.logger.warn("Lost the leases of %s contents, they will not be finished by this daemon" % len(lost))
+            self.leased_content_ids -= lost
+
+    def get_task_capacity(self):
+        """
+        Number of tasks which can be queued for the worker threads.
+        """
+        return max(self.max_queued_tasks - self.tasks.qsize(), 0)
+
     def get_tasks(self):
         """
         Get tasks to process
@@ -168,6 +233,8 @@ class BaseDaemon(Thread):
     def run_tasks(self, thread_id):
         log_prefix = "[Thread %s]: " % thread_id
         self.logger.info(log_prefix + "Starting worker thread")
+        # the main thread is named after the daemon, the worker threads are not
+        set_transition_daemon(self.name)
 
         while not self.graceful_stop.is_set():
             try:
@@ -177,6 +244,7 @@ class BaseDaemon(Thread):
 
                     try:
                         self.logger.info(log_prefix + "Processing task: %s" % task)
+                        # not in a unit of work, so that no connection is held while the plugins process the task
                         task = self.process_task(task)
                     except ESSException as error:
                         self.logger.error(log_prefix + "Caught an ESSException: %s" % str(error))
@@ -217,8 +285,12 @@ class BaseDaemon(Thread):
 
             while not self.graceful_stop.is_set():
                 try:
-                    self.get_tasks()
-                    self.finish_tasks()
+                    # every cycle reuses one session and connection per step instead of one per query
+                    with unit_of_work():
+                        self.reap_expired_leases()
+                        self.get_tasks()
+                    with unit_of_work():
+                        self.finish_tasks()
                     self.sleep_for_tasks()
                 except ESSException as error:
                     self.logger.error("Main thread ESSException: %s" % str(error))
@@ -19,8 +19,9 @@ import time
 import traceback
 
 from ess.common.constants import Sections
-from ess.common.config import config_has_section, config_has_option, config_list_options, config_get
+from ess.common.config import config_has_section, config_has_option, config_list_options, config_get, config_get_int
 from ess.common.utils import setup_logging
+from ess.orm.session import DATABASE_SECTION, set_pool_overrides
 
 
 setup_logging('ess.log')
@@ -34,10 +35,17 @@ DAEMONS = {
     'precacher': ['ess.daemons.precacher.daemon.PreCacher', Sections.PreCacher],
     'splitter': ['ess.daemons.splitter.daemon.Splitter', Sections.Splitter],
     'stager': ['ess.daemons.stager.daemon.Stager', Sections.Stager],
-    'finisher': ['ess.daemons.finisher.daemon.Finisher', Sections.Finisher]
+    'finisher': ['ess.daemons.finisher.daemon.Finisher', Sections.Finisher],
+    'archiver': ['ess.daemons.archiver.daemon.Archiver', Sections.Archiver]
 }
 RUNNING_DAEMONS = []
 
+# pool options of the daemon sections, which are not passed to the daemons
+POOL_OPTIONS = ('pool_size', 'max_overflow')
+# default pool of sqlalchemy
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+
 
 def load_config_daemons():
     if config_has_section(Sections.Main) and config_has_option(Sections.Main, 'daemons'):
@@ -57,7 +65,7 @@ def load_daemon_attrs(section):
     if config_has_section(section):
         options = config_list_options(section)
         for option, value in options:
-            if not option.startswith('plugin.'):
+            if not option.startswith('plugin.') and option not in POOL_OPTIONS:
                 if isinstance(value, str) and value.lower() == 'true':
                     value = True
                 if isinstance(value, str) and value.lower() == 'false':
@@ -84,11 +92,37 @@ def load_daemon(daemon):
     return impl
 
 
+def get_pool_option(section, option, default):
+    if config_has_option(section, option):
+        return config_get_int(section, option)
+    if config_has_option(DATABASE_SECTION, option):
+        return config_get_int(DATABASE_SECTION, option)
+    return default
+
+
+def configure_daemons_pool(daemons):
+    """
+    All daemons share the engine of the process. If a daemon section overrides pool_size or max_overflow,
+    the pool of the engine is sized as the sum of the pools of the daemons, the daemons without
+    an override counting with the pool of the database section.
+    """
+    sections = [DAEMONS[daemon][1] for daemon in daemons if daemon in DAEMONS]
+    if not [section for section in sections for option in POOL_OPTIONS if config_has_option(section, option)]:
+        return
+
+    pool_size = sum([get_pool_option(section, 'pool_size', DEFAULT_POOL_SIZE) for section in sections])
+    max_overflow = sum([get_pool_option(section, 'max_overflow', DEFAULT_MAX_OVERFLOW) for section in sections])
+    logging.info("Configured the database pool with pool_size %s and max_overflow %s for daemons %s" % (pool_size, max_overflow, daemons))
+    if not set_pool_overrides(pool_size=pool_size, max_overflow=max_overflow):
+        logging.warning("The database engine is already created, the pool of the daemons is not applied")
+
+
 def run_daemons():
     global RUNNING_DAEMONS
 
     daemons = load_config_daemons()
     logging.info("Configured to run daemons: %s" % str(daemons))
+    configure_daemons_pool(daemons)
     for daemon in daemons:
         daemon_thr = load_daemon(daemon)
         RUNNING_DAEMONS.append(daemon_thr)
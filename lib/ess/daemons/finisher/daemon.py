@@ -17,10 +17,14 @@ from ess.client.client import Client
 from ess.common.constants import Sections
 from ess.common.exceptions import ESSException
 from ess.common.utils import setup_logging, date_to_str
-from ess.core.catalog import get_contents_statistics, get_contents_by_edge
-from ess.core.requests import get_requests, update_request
+from ess.core.catalog import (get_contents_statistics, is_collection_complete, iter_contents_by_edge,
+                              update_collection_replicas_requests)
+from ess.core.counters import reconcile_content_counters
+from ess.core.edges import get_edge_id
+from ess.core.requests import get_requests, transition_requests
 from ess.daemons.common.basedaemon import BaseDaemon
-from ess.orm.constants import RequestStatus, ContentType, ContentStatus, GranularityType
+from ess.orm.constants import ContentType, GranularityType, RequestStatus
+from ess.orm.session import unit_of_work
 
 setup_logging(__name__)
 
@@ -34,15 +38,19 @@ class Finisher(BaseDaemon):
         super(Finisher, self).__init__(num_threads, **kwargs)
 
         self.config_section = Sections.Finisher
+        self.sync_chunk_size = int(getattr(self, 'sync_chunk_size', 1000))
+        self.reconcile_interval = int(getattr(self, 'reconcile_interval', 3600))
+        self.last_reconciled_at = 0
 
         self.setup_logger()
 
         self.resource_name = self.get_resouce_name()
-        head_service = self.get_head_service()
-        if head_service:
-            self.head_client = Client(head_service)
-        else:
-            self.head_client = None
+        if not getattr(self, 'head_client', None):
+            head_service = self.get_head_service()
+            if head_service:
+                self.head_client = Client(head_service)
+            else:
+                self.head_client = None
 
         if hasattr(self, 'send_messaging') and self.send_messaging:
             self.send_messaging = True
@@ -56,9 +64,9 @@ class Finisher(BaseDaemon):
         if not self.head_client:
             return
 
-        contents = get_contents_by_edge(edge_name=edge_name,
-                                        edge_id=edge_id,
-                                        coll_id=coll_id)
+        contents = iter_contents_by_edge(edge_name=edge_name,
+                                         edge_id=edge_id,
+                                         coll_id=coll_id)
 
         contents_list = []
         for content in contents:
@@ -76,74 +84,81 @@ class Finisher(BaseDaemon):
                     'pfn': content.pfn,
                     'object_metadata': content.object_metadata}
             contents_list.append(cont)
-        self.head_client.add_contents(collection_scope, collection_name, edge_name, contents_list)
+            if len(contents_list) >= self.sync_chunk_size:
+                self.head_client.add_contents(collection_scope, collection_name, edge_name, contents_list)
+                contents_list = []
+        if contents_list:
+            self.head_client.add_contents(collection_scope, collection_name, edge_name, contents_list)
+
+    def reconcile_counters(self):
+        """
+        Periodically correct the drift of the content counters of the edge.
+        """
+        if time.time() < self.last_reconciled_at + self.reconcile_interval:
+            return
+
+        self.last_reconciled_at = time.time()
+        corrected = reconcile_content_counters(edge_id=get_edge_id(self.resource_name))
+        if corrected:
+            self.logger.warning("Corrected %s drifted content counters" % corrected)
 
     def finish_local_requests(self):
+        """
+        Finish the requests whose files are all available. The contents are synchronized to the head service
+        without holding a database connection, and every request is finished in a unit of its own, so that a
+        failure of a request does not undo the requests finished before.
+        """
         reqs = get_requests(edge_name=self.resource_name, status=RequestStatus.SPLITTING)
         for req in reqs:
-            if req.granularity_type == GranularityType.FILE:
-                statistics = get_contents_statistics(edge_name=self.resource_name,
-                                                     edge_id=req.edge_id,
-                                                     coll_id=req.processing_meta['coll_id'],
-                                                     content_type=ContentType.FILE)
-
-                items = {}
-                for item in statistics:
-                    items[item.status] = items.counter
-                if len(items.keys()) == 1 and items.keys()[0] == ContentStatus.AVAILABLE and items.values()[0] > 0:
-                    self.logger.info('All files are available for request(%s): %s' % (req.request_id, items))
-
-                    # To sync content info to the head service
-                    self.sync_contents(collection_scope=req.scope,
-                                       collection_name=req.name,
-                                       edge_name=self.resource_name,
-                                       edge_id=req.edge_id,
-                                       coll_id=req.processing_meta['coll_id'])
-
-                    req.status = RequestStatus.AVAILABLE
-                    self.logger.info("Updating request %s to status %s" % (req.request_id, req.status))
-                    update_request(req.request_id, {'status': req.status})
-
-                    if self.send_messaging:
-                        msg = {'event_type': 'REQUEST_DONE',
-                               'payload': {'scope': req.scope,
-                                           'name': req.name,
-                                           'metadata': req.request_metadata},
-                               'created_at': date_to_str(datetime.datetime.utcnow())}
-                        self.messaging_queue.put(msg)
-                else:
-                    self.logger.info('Not all files are available for request(%s): %s' % (req.request_id, items))
-            if req.granularity_type == GranularityType.PARTIAL:
-                statistics = get_contents_statistics(edge_name=self.resource_name,
-                                                     edge_id=req.edge_id,
-                                                     coll_id=req.processing_meta['coll_id'],
-                                                     content_type=ContentType.PARTIAL)
-                items = {}
-                for item in statistics:
-                    items[item.status] = item.counter
-                if len(items.keys()) == 1 and items.keys()[0] == ContentStatus.AVAILABLE and items.values()[0] > 0:
-                    self.logger.info('All partial files are available for request(%s): %s' % (req.request_id, items))
-
-                    # To sync content info to the head service
-                    self.sync_contents(collection_scope=req.scope,
-                                       collection_name=req.name,
-                                       edge_name=self.resource_name,
-                                       edge_id=req.edge_id,
-                                       coll_id=req.processing_meta['coll_id'])
-
-                    req.status = RequestStatus.AVAILABLE
-                    self.logger.info("Updating request %s to status %s" % (req.request_id, req.status))
-                    update_request(req.request_id, {'status': req.status})
-
-                    if self.send_messaging:
-                        msg = {'event_type': 'REQUEST_DONE',
-                               'payload': {'scope': req.scope,
-                                           'name': req.name,
-                                           'metadata': req.request_meta},
-                               'created_at': date_to_str(datetime.datetime.utcnow())}
-                        self.messaging_queue.put(msg)
-                else:
-                    self.logger.info('Not all partial files are available for request(%s): %s' % (req.request_id, items))
+            try:
+                self.finish_local_request(req)
+            except Exception as error:
+                self.logger.error("Failed to finish request %s: %s, %s" % (req.request_id, error, traceback.format_exc()))
+
+    def finish_local_request(self, req):
+        coll_id = req.processing_meta['coll_id']
+        # the whole files for the requests of files, the partial files for the requests of partial files
+        content_type = ContentType.PARTIAL if req.granularity_type == GranularityType.PARTIAL else ContentType.FILE
+        if not is_collection_complete(coll_id=coll_id, edge_id=req.edge_id, content_type=content_type):
+            statistics = get_contents_statistics(edge_name=self.resource_name,
+                                                 edge_id=req.edge_id,
+                                                 coll_id=coll_id,
+                                                 content_type=content_type)
+            items = dict([('%s:%s' % (item.content_type, item.status), item.counter) for item in statistics])
+            self.logger.info('Not all files are available for request(%s): %s' % (req.request_id, items))
+            return
+
+        self.logger.info('All files are available for request(%s)' % req.request_id)
+
+        # To sync content info to the head service
+        self.sync_contents(collection_scope=req.scope,
+                           collection_name=req.name,
+                           edge_name=self.resource_name,
+                           edge_id=req.edge_id,
+                           coll_id=coll_id)
+
+        req.status = RequestStatus.AVAILABLE
+        self.logger.info("Updating request %s to status %s" % (req.request_id, req.status))
+        with unit_of_work():
+            request_ids, subscribers = transition_requests([req.request_id], RequestStatus.SPLITTING, req.status,
+                                                           with_subscribers=True)
+            if not request_ids:
+                # finished by another finisher
+                return
+            update_collection_replicas_requests(coll_id=coll_id, edge_id=req.edge_id, num_requests=-1)
+        if subscribers:
+            self.logger.info("Completed the requests %s subscribed to request %s"
+                             % ([subscriber['request_id'] for subscriber in subscribers], req.request_id))
+
+        if self.send_messaging:
+            # one message for the request and one for every subscribed request completed with it
+            for metadata in [req.request_meta] + [subscriber['request_meta'] for subscriber in subscribers]:
+                msg = {'event_type': 'REQUEST_DONE',
+                       'payload': {'scope': req.scope,
+                                   'name': req.name,
+                                   'metadata': metadata},
+                       'created_at': date_to_str(datetime.datetime.utcnow())}
+                self.messaging_queue.put(msg)
 
     def run(self):
         """
@@ -159,6 +174,7 @@ class Finisher(BaseDaemon):
 
             while not self.graceful_stop.is_set():
                 try:
+                    self.reconcile_counters()
                     self.finish_local_requests()
 
                     for i in range(5):
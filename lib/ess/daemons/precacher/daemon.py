@@ -15,10 +15,12 @@ import traceback
 from ess.common.constants import Sections
 from ess.common.exceptions import NoRequestedData, NoPluginException, DaemonPluginError
 from ess.common.utils import setup_logging
-from ess.core.requests import get_requests, update_request
-from ess.core.catalog import add_contents
+from ess.core.requests import get_requests, transition_requests, update_request
+from ess.core.catalog import add_contents, get_collection_id, update_collection_replicas_requests
+from ess.core.edges import get_edge_id
 from ess.daemons.common.basedaemon import BaseDaemon
 from ess.orm.constants import ContentType, RequestStatus
+from ess.orm.session import unit_of_work
 
 
 setup_logging(__name__)
@@ -42,12 +44,19 @@ class PreCacher(BaseDaemon):
         """
         Get tasks to process
         """
-        requests = get_requests(status=RequestStatus.ASSIGNED, edge_name=self.resource_name)
+        capacity = self.get_task_capacity()
+        if not capacity:
+            self.logger.info("Main thread has %s queued tasks, not getting more" % self.tasks.qsize())
+            return
+
+        requests = get_requests(status=RequestStatus.ASSIGNED, edge_name=self.resource_name, limit=capacity)
+        request_ids = set(transition_requests([req.request_id for req in requests], RequestStatus.ASSIGNED, RequestStatus.PRECACHING))
+        requests = [req for req in requests if req.request_id in request_ids]
 
         self.logger.info("Main thread get %s tasks" % len(requests))
         for req in requests:
+            req.status = RequestStatus.PRECACHING
             self.tasks.put(req)
-            update_request(request_id=req.request_id, parameters={'status': RequestStatus.PRECACHING})
 
     def pre_cache(self, scope, name):
         if 'precache' in self.plugins:
@@ -80,7 +89,10 @@ class PreCacher(BaseDaemon):
                             'pfn': file['pfn'],
                             'object_metadata': {'md5': file['md5'], 'adler32': file['adler32']}}
                 ret_files.append(ret_file)
-            add_contents(req.scope, req.name, self.resource_name, ret_files)
+            with unit_of_work():
+                add_contents(req.scope, req.name, self.resource_name, ret_files)
+                update_collection_replicas_requests(coll_id=get_collection_id(req.scope, req.name),
+                                                    edge_id=get_edge_id(self.resource_name))
             req.status = RequestStatus.PRECACHED
             req.processing_meta['collection_status'] = str(req.status)
             return req
@@ -106,6 +118,10 @@ class PreCacher(BaseDaemon):
             except Exception as error:
                 self.logger.critical("Failed to update request %s: %s, %s" % (req, error, traceback.format_exc()))
 
+    def sleep_for_tasks(self):
+        """
+        Sleep for tasks, out of the unit of work of finishing the tasks.
+        """
         self.graceful_stop.wait(10)
 
 
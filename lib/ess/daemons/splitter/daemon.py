@@ -16,10 +16,12 @@ import Queue
 from ess.common.constants import Sections
 from ess.common.exceptions import ESSException, NoPluginException, DaemonPluginError
 from ess.common.utils import setup_logging
-from ess.core.catalog import add_contents, get_contents_by_edge, update_contents_by_id
-from ess.core.requests import get_requests, update_request
+from ess.core.catalog import add_contents, claim_contents, iter_contents_by_edge, update_contents_by_id
+from ess.core.requests import get_requests, transition_requests, update_request
 from ess.daemons.common.basedaemon import BaseDaemon
 from ess.orm.constants import ContentType, ContentStatus, RequestStatus, GranularityType
+from ess.orm.session import unit_of_work
+from ess.orm.utils import DEFAULT_CHUNK_SIZE
 
 setup_logging(__name__)
 
@@ -35,6 +37,10 @@ class Splitter(BaseDaemon):
         self.config_section = Sections.Splitter
         self.output_queue = Queue.Queue()
 
+        self.claim_limit = int(getattr(self, 'claim_limit', 100))
+        self.lease_seconds = int(getattr(self, 'lease_seconds', 3600))
+        self.reclaim_statuses = {ContentStatus.SPLITTING: ContentStatus.TOSPLIT}
+
         self.setup_logger()
 
     def start_splitter_process(self):
@@ -81,19 +87,24 @@ class Splitter(BaseDaemon):
             self.logger.info("Main thread get %s split requests" % len(requests))
 
         for req in requests:
+            if not transition_requests([req.request_id], RequestStatus.PRECACHED, RequestStatus.TOSPLITTING):
+                # claimed by another splitter
+                continue
             self.logger.info("Prepare to_split files for request %s" % req.request_id)
-            update_request(request_id=req.request_id, parameters={'status': RequestStatus.TOSPLITTING})
             self.prepare_to_split_files(req)
             update_request(request_id=req.request_id, parameters={'status': RequestStatus.SPLITTING})
 
     def prepare_to_split_files(self, req):
         if req.granularity_type == GranularityType.PARTIAL:
             coll_id = req.processing_meta['coll_id']
-            files = get_contents_by_edge(edge_name=self.resource_name,
-                                         coll_id=coll_id,
-                                         content_type=ContentType.FILE,
-                                         status=ContentStatus.PRECACHED)
-
+            files = iter_contents_by_edge(edge_name=self.resource_name,
+                                          coll_id=coll_id,
+                                          content_type=ContentType.FILE,
+                                          status=ContentStatus.PRECACHED,
+                                          columns=['coll_id', 'scope', 'name', 'min_id', 'max_id',
+                                                   'edge_id', 'pfn', 'priority'])
+
+            num_sub_files = 0
             sub_files = []
             for file in files:
                 for i in range(file.min_id, file.max_id + 1, req.granularity_level):
@@ -114,37 +125,50 @@ class Splitter(BaseDaemon):
 
                     sub_files.append(new_file)
 
-            self.logger.debug("Creating new splitting files: %s" % sub_files)
-            self.logger.info("Creating %s new splitting files" % len(sub_files))
+                if len(sub_files) >= DEFAULT_CHUNK_SIZE:
+                    self.logger.debug("Creating new splitting files: %s" % sub_files)
+                    add_contents(req.scope, req.name, self.resource_name, sub_files)
+                    num_sub_files += len(sub_files)
+                    sub_files = []
 
-            add_contents(req.scope, req.name, self.resource_name, sub_files)
+            if sub_files:
+                self.logger.debug("Creating new splitting files: %s" % sub_files)
+                add_contents(req.scope, req.name, self.resource_name, sub_files)
+                num_sub_files += len(sub_files)
+            self.logger.info("Created %s new splitting files" % num_sub_files)
 
     def get_splitter_tasks(self):
         """
         Get tasks to splitter
         """
-        files = get_contents_by_edge(edge_name=self.resource_name, status=ContentStatus.TOSPLIT,
-                                     content_type=ContentType.PARTIAL)
+        files = claim_contents(edge_name=self.resource_name,
+                               from_status=ContentStatus.TOSPLIT,
+                               to_status=ContentStatus.SPLITTING,
+                               limit=self.claim_limit,
+                               owner=self.get_lease_owner(),
+                               lease_seconds=self.lease_seconds,
+                               content_type=ContentType.PARTIAL)
+        self.leased_content_ids.update([file.content_id for file in files])
 
         # self.logger.debug("Main thread get %s files to split" % len(files))
-
-        update_files = {}
-        for file in files:
-            update_files[file.content_id] = {'status': ContentStatus.SPLITTING}
-        update_contents_by_id(update_files)
-
         return files
 
     def finish_splitter_tasks(self, files):
         """
         Finish processing the finished tasks, for example, update db status.
+        Contents whose lease was lost are skipped, they are split again by the daemon which claimed them.
         """
         update_files = {}
         for file in files:
+            self.leased_content_ids.discard(file['content_id'])
             update_files[file['content_id']] = {'status': ContentStatus.TOSTAGEDOUT,
                                                 'pfn_size': file['size'],
-                                                'pfn': file['pfn']}
-        update_contents_by_id(update_files)
+                                                'pfn': file['pfn'],
+                                                'lease_owner': None,
+                                                'lease_expired_at': None}
+        num_files = update_contents_by_id(update_files, lease_owner=self.get_lease_owner())
+        if num_files < len(update_files):
+            self.logger.warn("Skipped %s splitted files whose lease was lost" % (len(update_files) - num_files))
 
     def run(self):
         """
@@ -159,12 +183,16 @@ class Splitter(BaseDaemon):
 
             while not self.graceful_stop.is_set():
                 try:
-                    self.prepare_split_request_task()
+                    with unit_of_work():
+                        self.reap_expired_leases()
+                        self.renew_content_leases()
+                        self.prepare_split_request_task()
 
                     if self.plugins['splitter'].need_more_requests():
                         self.logger.info("Splitter plugin needs more events")
 
-                        files = self.get_splitter_tasks()
+                        with unit_of_work():
+                            files = self.get_splitter_tasks()
                         if files:
                             self.logger.info('Got %s files to split' % len(files))
                             self.plugins['splitter'].send_requests(files)
@@ -175,7 +203,8 @@ class Splitter(BaseDaemon):
                         outputs = self.plugins['splitter'].get_outputs()
                         self.logger.info('Got %s splitted outputs' % len(outputs))
 
-                        self.finish_splitter_tasks(outputs)
+                        with unit_of_work():
+                            self.finish_splitter_tasks(outputs)
 
                     time.sleep(5)
                 except ESSException as error:
@@ -17,13 +17,18 @@ import Queue
 from ess.common.constants import Sections
 from ess.common.exceptions import ESSException, NoPluginException, DaemonPluginError
 from ess.common.utils import setup_logging, date_to_str
-from ess.core.catalog import get_contents_by_edge, update_contents_by_id
+from ess.core.catalog import claim_contents, update_contents_by_id
 from ess.daemons.common.basedaemon import BaseDaemon
 from ess.orm.constants import ContentStatus
+from ess.orm.session import unit_of_work
 
 setup_logging(__name__)
 
 
+# the columns of the contents needed to stage them out
+STAGER_COLUMNS = ['content_id', 'coll_id', 'pfn', 'pfn_size', 'scope', 'name', 'min_id', 'max_id']
+
+
 class Stager(BaseDaemon):
     """
     The Stager daemon class
@@ -36,6 +41,10 @@ class Stager(BaseDaemon):
         self.request_queue = Queue.Queue()
         self.finished_queue = Queue.Queue()
 
+        self.claim_limit = int(getattr(self, 'claim_limit', 100))
+        self.lease_seconds = int(getattr(self, 'lease_seconds', 3600))
+        self.reclaim_statuses = {ContentStatus.STAGINGOUT: ContentStatus.TOSTAGEDOUT}
+
         self.setup_logger()
 
         if hasattr(self, 'send_messaging') and self.send_messaging:
@@ -80,12 +89,13 @@ class Stager(BaseDaemon):
         """
         Get tasks to stage out.
         """
-        files = get_contents_by_edge(edge_name=self.resource_name, status=ContentStatus.TOSTAGEDOUT, content_type=None)
-
-        update_files = {}
-        for file in files:
-            update_files[file.content_id] = {'status': ContentStatus.STAGINGOUT}
-        update_contents_by_id(update_files)
+        files = claim_contents(edge_name=self.resource_name,
+                               from_status=ContentStatus.TOSTAGEDOUT,
+                               to_status=ContentStatus.STAGINGOUT,
+                               limit=self.claim_limit,
+                               owner=self.get_lease_owner(),
+                               lease_seconds=self.lease_seconds,
+                               columns=STAGER_COLUMNS)
 
         for file in files:
             to_stageout = {'content_id': file.content_id,
@@ -96,20 +106,25 @@ class Stager(BaseDaemon):
                            'min_id': file.min_id,
                            'max_id': file.max_id,
                            'pfn': file.pfn}
+            self.leased_content_ids.add(file.content_id)
             self.request_queue.put(to_stageout)
 
     def finish_stager_tasks(self):
         """
         Finish processing the finished tasks, for example, update db status.
+        Contents whose lease was lost are skipped, they are staged out again by the daemon which claimed them.
         """
 
         update_files = {}
-        messages = []
+        messages = {}
         while not self.finished_queue.empty():
             file = self.finished_queue.get()
+            self.leased_content_ids.discard(file['content_id'])
             update_files[file['content_id']] = {'status': ContentStatus.AVAILABLE,
                                                 'pfn_size': file['pfn_size'],
-                                                'pfn': file['pfn']}
+                                                'pfn': file['pfn'],
+                                                'lease_owner': None,
+                                                'lease_expired_at': None}
             msg = {'event_type': 'FILE_AVAILABLE',
                    'payload': {'scope': file['scope'],
                                'name': file['name'],
@@ -117,14 +132,16 @@ class Stager(BaseDaemon):
                                'lastEvent': file['max_id'],
                                'pfn': file['pfn']},
                    'created_at': date_to_str(datetime.datetime.utcnow())}
-            messages.append(msg)
+            messages[file['content_id']] = msg
 
         self.logger.info('Got %s staged outputs' % len(update_files))
-        update_contents_by_id(update_files)
+        leased = update_contents_by_id(update_files, lease_owner=self.get_lease_owner(), with_ids=True)
+        if len(leased) < len(update_files):
+            self.logger.warn("Skipped %s staged outputs whose lease was lost" % (len(update_files) - len(leased)))
 
         if self.send_messaging:
-            for msg in messages:
-                self.messaging_queue.put(msg)
+            for id in leased:
+                self.messaging_queue.put(messages[id])
 
     def run(self):
         """
@@ -141,12 +158,16 @@ class Stager(BaseDaemon):
 
             while not self.graceful_stop.is_set():
                 try:
-                    if self.request_queue.qsize() < 1:
-                        self.get_stager_tasks()
+                    with unit_of_work():
+                        self.reap_expired_leases()
+                        self.renew_content_leases()
+                        if self.request_queue.qsize() < 1:
+                            self.get_stager_tasks()
 
                     if self.finished_queue.qsize() > 0:
                         self.logger.info("Output stager has outputs")
-                        self.finish_stager_tasks()
+                        with unit_of_work():
+                            self.finish_stager_tasks()
 
                     time.sleep(5)
                 except ESSException as error:
@@ -110,3 +110,4 @@ class RequestStatus(DeclEnum):
     TOSPLITTING = 'T', 'TOSPLITTING'
     SPLITTING = 'S', 'SPLITTING'
     SPLITTED = 'L', 'SPLITTED'
+    SUBSCRIBED = 'U', 'SUBSCRIBED'
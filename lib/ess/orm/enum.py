@@ -50,10 +50,18 @@ class EnumMeta(type):
     def __init__(cls, classname, bases, dict_):  # pylint: disable=E0101
         cls._reg = reg = cls._reg.copy()
         cls._syms = syms = cls._syms.copy()
+        cls._names = names = cls._names.copy()
         for k, v in dict_.items():
             if isinstance(v, tuple):
-                sym = reg[v[0]] = syms[v[1]] = EnumSymbol(cls, k, *v)
+                sym = reg[v[0]] = syms[v[1]] = names[k] = EnumSymbol(cls, k, *v)
                 setattr(cls, k, sym)
+
+        # symbol, name and description, in upper case too, to symbol
+        cls._lookup = lookup = {}
+        for name, sym in names.items():
+            for key in (name, name.upper(), sym.description, sym.description.upper(), unicode(sym.description)):
+                lookup[key] = sym
+            lookup[sym] = sym
         return type.__init__(cls, classname, bases, dict_)
 
     def __iter__(cls):
@@ -66,6 +74,7 @@ class DeclEnum(object):
     __metaclass__ = EnumMeta
     _reg = {}
     _syms = {}
+    _names = {}
 
     @classmethod
     def from_string(cls, value):
@@ -81,6 +90,36 @@ class DeclEnum(object):
         except KeyError:
             raise ValueError("Invalid value for %r: %r" % (cls.__name__, value))
 
+    @classmethod
+    def from_name(cls, name):
+        try:
+            return cls._names[name]
+        except KeyError:
+            raise ValueError("Invalid name for %r: %r" % (cls.__name__, name))
+
+    @classmethod
+    def normalize(cls, value):
+        """
+        Get the symbol of a symbol, a name or a description in any case.
+        None, empty values and values which are not strings are returned as they are.
+
+        :raises ValueError: If a string is not a name or a description of the enum.
+        """
+        if not value:
+            return value
+        try:
+            return cls._lookup[value]
+        except KeyError:
+            if not isinstance(value, basestring):
+                return value
+            try:
+                return cls._lookup[value.strip().upper()]
+            except KeyError:
+                raise ValueError("Invalid value for %r: %r" % (cls.__name__, value))
+        except TypeError:
+            # unhashable
+            return value
+
     @classmethod
     def values(cls):
         return cls._reg.keys()
@@ -117,4 +156,8 @@ class DeclEnumType(SchemaType, TypeDecorator):
     def process_result_value(self, value, dialect):
         if value is None:
             return None
-        return self.enum.from_string(value.strip())
+        try:
+            return self.enum._reg[value]
+        except KeyError:
+            # padded by CHAR columns
+            return self.enum.from_string(value.strip())
@@ -18,11 +18,11 @@ import datetime
 from sqlalchemy import BigInteger, Boolean, Column, DateTime, Integer, String as _String, UniqueConstraint, event, DDL
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import backref, object_mapper, relationship
+from sqlalchemy.orm import backref, class_mapper, object_mapper, relationship
 from sqlalchemy.schema import CheckConstraint, ForeignKeyConstraint, Index, PrimaryKeyConstraint, Sequence, Table
 
 from ess.common.utils import date_to_str
-from ess.orm.enum import EnumSymbol
+from ess.orm.enum import DeclEnumType, EnumSymbol
 from ess.orm.types import JSON
 from ess.orm.session import BASE
 from ess.orm.constants import (SCOPE_LENGTH, NAME_LENGTH,
@@ -42,6 +42,14 @@ def compile_binary_oracle(type_, compiler, **kw):
     return "NUMBER(1)"
 
 
+# model class to the list of (attribute, converter) of its columns
+_SERIALIZERS = {}
+
+
+def _enum_description(sym):
+    return sym.description
+
+
 @event.listens_for(Table, "after_create")
 def _psql_autoincrement(target, connection, **kw):
     if connection.dialect.name == 'mysql' and target.name == 'ess_coll':
@@ -112,8 +120,54 @@ class ModelBase(object):
         return self.__dict__.items()
 
     def to_dict(self):
-        return {key: self._expand_item(value) for key, value
-                in self.__dict__.items() if not key.startswith('_')}
+        """
+        Serialize the loaded columns, converting the enums and the dates.
+        """
+        values = self.__dict__
+        item = {}
+        for key, convert in self._get_serializer():
+            if key in values:
+                value = values[key]
+                item[key] = convert(value) if convert is not None and value is not None else value
+        return item
+
+    @classmethod
+    def rows_to_dicts(cls, rows):
+        """
+        Serialize the rows of a query of columns of the model, like to_dict.
+
+        :param rows: Iterable of keyed tuples.
+
+        :returns: Generator of dictionaries.
+        """
+        converters = dict(cls._get_serializer())
+        keys, convert_list = None, None
+        for row in rows:
+            if keys is None:
+                keys = row.keys()
+                convert_list = [converters.get(key) for key in keys]
+            yield dict([(key, convert(value) if convert is not None and value is not None else value)
+                        for key, convert, value in zip(keys, convert_list, row)])
+
+    @classmethod
+    def _get_serializer(cls):
+        """
+        Get the attributes of the columns with their converters, computed once per model.
+        """
+        try:
+            return _SERIALIZERS[cls]
+        except KeyError:
+            fields = []
+            for prop in class_mapper(cls).column_attrs:
+                column_type = prop.columns[0].type
+                if isinstance(column_type, DeclEnumType):
+                    fields.append((prop.key, _enum_description))
+                elif isinstance(column_type, DateTime):
+                    fields.append((prop.key, date_to_str))
+                else:
+                    fields.append((prop.key, None))
+            _SERIALIZERS[cls] = fields
+            return fields
 
     @classmethod
     def _expand_item(cls, obj):
@@ -217,6 +271,8 @@ class CollectionContent(BASE, ModelBase):
     pfn_size = Column(BigInteger)
     pfn = Column(String(1024))
     object_metadata = Column(JSON())
+    lease_owner = Column(String(128))
+    lease_expired_at = Column(DateTime)
     _table_args = (PrimaryKeyConstraint('content_id', name='ESS_COLL_CONTENT_PK'),
                    # PrimaryKeyConstraint('scope', 'name', 'coll_id', 'content_type', 'min_id', 'max_id', 'edge_id', 'content_id', name='ESS_COLL_CONTENT_PK'),
                    ForeignKeyConstraint(['edge_id'], ['ess_edges.edge_id'], name='ESS_CONTENT_EDGE_ID_FK'),
@@ -225,9 +281,27 @@ class CollectionContent(BASE, ModelBase):
                    UniqueConstraint('scope', 'name', 'coll_id', 'content_type', 'min_id', 'max_id', 'edge_id', name='ESS_CONTENT_UQ'),
                    Index('ESS_CONTENT_SCOPE_NAME_IDX', 'scope', 'name', 'edge_id', 'status'),
                    Index('ESS_CONTENT_SCOPE_NAME_MM_IDX', 'scope', 'name', 'content_type', 'min_id', 'max_id', 'edge_id', 'status'),
+                   Index('ESS_CONTENT_BEST_MATCH_IDX', 'scope', 'name', 'status', 'min_id', 'max_id'),
                    Index('ESS_CONTENT_COLLECTION_ID_IDX', 'coll_id', 'status'),
-                   Index('ESS_CONTENT_EDGE_ID_IDX', 'edge_id', 'status'),
-                   Index('ESS_CONTENT_STATUS_PRIO_IDX', 'status', 'priority'))
+                   # claims of the daemons, by edge, status and content type in the order of the priority
+                   Index('ESS_CONTENT_EDGE_CLAIM_IDX', 'edge_id', 'status', 'content_type', 'priority'),
+                   # contents of a collection at an edge and the counters reconciliation
+                   Index('ESS_CONTENT_EDGE_COLL_IDX', 'edge_id', 'coll_id', 'content_type', 'status'),
+                   Index('ESS_CONTENT_LEASE_IDX', 'status', 'lease_expired_at'),
+                   Index('ESS_CONTENT_STATUS_UPD_IDX', 'status', 'updated_at'))
+
+
+class ContentCounter(BASE, ModelBase):
+    """Represents the number and the bytes of the contents per edge, collection, content type and status"""
+    __tablename__ = 'ess_content_counters'
+    edge_id = Column(Integer)
+    coll_id = Column(BigInteger)
+    content_type = Column(ContentType.db_type(name='ESS_COUNTER_CONTENT_TYPE'))
+    status = Column(ContentStatus.db_type(name='ESS_COUNTER_STATUS'))
+    counter = Column(BigInteger, default=0)
+    bytes = Column(BigInteger, default=0)
+    _table_args = (PrimaryKeyConstraint('edge_id', 'coll_id', 'content_type', 'status', name='ESS_CONTENT_COUNTERS_PK'),
+                   Index('ESS_CONTENT_COUNTERS_COLL_IDX', 'coll_id', 'edge_id'))
 
 
 class Request(BASE, ModelBase):
@@ -239,7 +313,7 @@ class Request(BASE, ModelBase):
     data_type = Column(DataType.db_type(name='ESS_REQUESTS_DATA_TYPE'), default=DataType.DATASET)
     granularity_type = Column(GranularityType.db_type(name='ESS_REQUESTS_GRANULARITY_TYPE'), default=GranularityType.PARTIAL)
     granularity_level = Column(Integer())
-    priority = Column(Integer())
+    priority = Column(Integer(), default=0)
     edge_id = Column(Integer)
     status = Column(RequestStatus.db_type(name='ESS_REQUESTS_STATUS'), default=RequestStatus.NEW)
     request_meta = Column(JSON())  # task id, job id, pandq queues inside
@@ -248,8 +322,101 @@ class Request(BASE, ModelBase):
     _table_args = (PrimaryKeyConstraint('request_id', name='ESS_REQUESTS_PK'),
                    ForeignKeyConstraint(['edge_id'], ['ess_edges.edge_id'], name='ESS_REQUESTS_EDGE_ID_FK'),
                    CheckConstraint('status IS NOT NULL', name='ESS_REQ_STATUS_ID_NN'),
+                   CheckConstraint('priority IS NOT NULL', name='ESS_REQ_PRIORITY_NN'),
                    Index('ESS_REQUESTS_SCOPE_NAME_IDX', 'scope', 'name', 'data_type', 'request_id'),
-                   Index('ESS_REQUESTS_STATUS_PRIO_IDX', 'status', 'priority', 'request_id'))
+                   Index('ESS_REQUESTS_STATUS_PRIO_IDX', 'status', 'priority', 'request_id'),
+                   Index('ESS_REQUESTS_EDGE_STATUS_IDX', 'edge_id', 'status'),
+                   Index('ESS_REQUESTS_STATUS_UPD_IDX', 'status', 'updated_at'))
+
+
+class RequestSubscription(BASE, ModelBase):
+    """Represents a request coalesced with an in-flight request of the same data, the primary request processing both"""
+    __tablename__ = 'ess_req_subscriptions'
+    request_id = Column(BigInteger().with_variant(Integer, "sqlite"), autoincrement=False)
+    primary_request_id = Column(BigInteger().with_variant(Integer, "sqlite"))
+    _table_args = (PrimaryKeyConstraint('request_id', name='ESS_REQ_SUBSCRIPTIONS_PK'),
+                   Index('ESS_REQ_SUBS_PRIMARY_IDX', 'primary_request_id'))
+
+
+class RequestDataKey(BASE, ModelBase):
+    """Represents the data of coalesced requests with their primary request, locked to coalesce the requests one after the other"""
+    __tablename__ = 'ess_req_data_keys'
+    scope = Column(String(SCOPE_LENGTH))
+    name = Column(String(NAME_LENGTH))
+    data_type = Column(DataType.db_type(name='ESS_REQ_KEYS_DATA_TYPE'))
+    granularity_type = Column(GranularityType.db_type(name='ESS_REQ_KEYS_GRANULARITY_TYPE'))
+    # -1 for the requests without granularity level, the primary key cannot be null
+    granularity_level = Column(Integer())
+    request_id = Column(BigInteger().with_variant(Integer, "sqlite"))
+    _table_args = (PrimaryKeyConstraint('scope', 'name', 'data_type', 'granularity_type', 'granularity_level',
+                                        name='ESS_REQ_DATA_KEYS_PK'),
+                   Index('ESS_REQ_DATA_KEYS_REQUEST_IDX', 'request_id'))
+
+
+class RequestTransition(BASE, ModelBase):
+    """Represents a transition of a request from a status to another, to time the stages of the requests"""
+    __tablename__ = 'ess_req_transitions'
+    transition_id = Column(BigInteger().with_variant(Integer, "sqlite"), Sequence('ESS_REQ_TRANSITION_ID_SEQ'))
+    request_id = Column(BigInteger().with_variant(Integer, "sqlite"))
+    # no from_status when the request is created
+    from_status = Column(RequestStatus.db_type(name='ESS_REQ_TRANS_FROM_STATUS'))
+    to_status = Column(RequestStatus.db_type(name='ESS_REQ_TRANS_TO_STATUS'))
+    transitioned_at = Column(DateTime)
+    daemon = Column(String(64))
+    host = Column(String(128))
+    _table_args = (PrimaryKeyConstraint('transition_id', name='ESS_REQ_TRANSITIONS_PK'),
+                   Index('ESS_REQ_TRANS_REQUEST_IDX', 'request_id', 'transitioned_at'),
+                   Index('ESS_REQ_TRANS_AT_IDX', 'transitioned_at'))
+
+
+class CollectionContentArchive(BASE, ModelBase):
+    """Represents the archived files, moved out of ess_coll_content in a terminal status"""
+    __tablename__ = 'ess_coll_content_archive'
+    content_id = Column(BigInteger().with_variant(Integer, "sqlite"))
+    coll_id = Column(BigInteger)
+    scope = Column(String(SCOPE_LENGTH))
+    name = Column(String(NAME_LENGTH))
+    min_id = Column(BigInteger)
+    max_id = Column(BigInteger)
+    content_type = Column(ContentType.db_type(name='ESS_CONTENT_ARCH_TYPE'))
+    edge_id = Column(Integer)
+    status = Column(ContentStatus.db_type(name='ESS_CONTENT_ARCH_STATUS'))
+    priority = Column(Integer())
+    num_success = Column(Integer())
+    num_failure = Column(Integer())
+    last_failed_at = Column(DateTime)
+    pfn_size = Column(BigInteger)
+    pfn = Column(String(1024))
+    object_metadata = Column(JSON())
+    lease_owner = Column(String(128))
+    lease_expired_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # archived_at is part of the primary key, so that the table can be partitioned by range of archived_at
+    _table_args = (PrimaryKeyConstraint('content_id', 'archived_at', name='ESS_CONTENT_ARCH_PK'),
+                   Index('ESS_CONT_ARCH_SCOPE_NAME_IDX', 'scope', 'name', 'edge_id'),
+                   Index('ESS_CONTENT_ARCH_COLL_ID_IDX', 'coll_id'),
+                   Index('ESS_CONTENT_ARCH_AT_IDX', 'archived_at'))
+
+
+class RequestArchive(BASE, ModelBase):
+    """Represents the archived requests, moved out of ess_requests in a terminal status"""
+    __tablename__ = 'ess_requests_archive'
+    request_id = Column(BigInteger().with_variant(Integer, "sqlite"))
+    scope = Column(String(SCOPE_LENGTH))
+    name = Column(String(NAME_LENGTH))
+    data_type = Column(DataType.db_type(name='ESS_REQ_ARCH_DATA_TYPE'))
+    granularity_type = Column(GranularityType.db_type(name='ESS_REQ_ARCH_GRANULARITY_TYPE'))
+    granularity_level = Column(Integer())
+    priority = Column(Integer())
+    edge_id = Column(Integer)
+    status = Column(RequestStatus.db_type(name='ESS_REQ_ARCH_STATUS'))
+    request_meta = Column(JSON())
+    processing_meta = Column(JSON())
+    errors = Column(JSON())
+    archived_at = Column(DateTime, default=datetime.datetime.utcnow)
+    _table_args = (PrimaryKeyConstraint('request_id', 'archived_at', name='ESS_REQUESTS_ARCH_PK'),
+                   Index('ESS_REQ_ARCH_SCOPE_NAME_IDX', 'scope', 'name', 'data_type'),
+                   Index('ESS_REQ_ARCH_AT_IDX', 'archived_at'))
 
 
 def register_models(engine):
@@ -261,7 +428,13 @@ def register_models(engine):
               Collection,
               CollectionReplicas,
               CollectionContent,
-              Request)
+              ContentCounter,
+              Request,
+              RequestSubscription,
+              RequestDataKey,
+              RequestTransition,
+              CollectionContentArchive,
+              RequestArchive)
 
     for model in models:
         model.metadata.create_all(engine)   # pylint: disable=maybe-no-member
@@ -276,7 +449,13 @@ def unregister_models(engine):
               Collection,
               CollectionReplicas,
               CollectionContent,
-              Request)
+              ContentCounter,
+              Request,
+              RequestSubscription,
+              RequestDataKey,
+              RequestTransition,
+              CollectionContentArchive,
+              RequestArchive)
 
     for model in models:
         model.metadata.drop_all(engine)   # pylint: disable=maybe-no-member
@@ -16,11 +16,13 @@ https://github.com/rucio/rucio/blob/master/lib/rucio/db/sqla/session.py
 """
 
 import sys
+import time
 
+from contextlib import contextmanager
 from functools import wraps
 from inspect import isgeneratorfunction
 from retrying import retry
-from threading import Lock
+from threading import Lock, local
 from os.path import basename
 
 from sqlalchemy import create_engine, event
@@ -28,8 +30,9 @@ from sqlalchemy.exc import DatabaseError, DisconnectionError, OperationalError,
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from ess.common.config import config_get, config_has_option
+from ess.common.config import config_get, config_get_int, config_has_option
 from ess.common.exceptions import ESSException, DatabaseException
+from ess.orm.telemetry import POOL_TELEMETRY
 
 
 DATABASE_SECTION = 'database'
@@ -43,6 +46,18 @@ if config_has_option(DATABASE_SECTION, 'schema'):
 
 _MAKER, _ENGINE, _LOCK = None, None, Lock()
 
+# pool parameters overriding the database section, for example set by ess_main from the daemon sections
+_POOL_OVERRIDES = {}
+
+# the units of work of the threads
+_UNITS = local()
+
+# connections checked in for less seconds than this are not pinged when checked out again
+DEFAULT_POOL_PING_IDLE = 30
+
+# seconds to skip a read replica after it failed
+DEFAULT_REPLICA_RETRY_INTERVAL = 30
+
 
 def _fk_pragma_on_connect(dbapi_con, con_record):
     # Hack for previous versions of sqlite3
@@ -52,10 +67,27 @@ def _fk_pragma_on_connect(dbapi_con, con_record):
         pass
 
 
+def _get_pool_ping_idle():
+    if config_has_option(DATABASE_SECTION, 'pool_ping_idle'):
+        return config_get_int(DATABASE_SECTION, 'pool_ping_idle')
+    return DEFAULT_POOL_PING_IDLE
+
+
+def pool_checkin_listener(dbapi_conn, connection_rec):
+    """
+    Records when a connection is returned to the pool, for the idle-aware ping.
+    :param dbapi_conn: DBAPI connection
+    :param connection_rec: connection record
+    """
+    if connection_rec is not None:
+        connection_rec.info['checked_in_at'] = time.time()
+
+
 def mysql_ping_listener(dbapi_conn, connection_rec, connection_proxy):
     """
     Ensures that MySQL connections checked out of the
-    pool are alive.
+    pool are alive. Only the connections which were idle in the pool
+    for more than pool_ping_idle seconds are pinged.
     Borrowed from:
     http://groups.google.com/group/sqlalchemy/msg/a4ce563d802c929f
     :param dbapi_conn: DBAPI connection
@@ -63,9 +95,15 @@ def mysql_ping_listener(dbapi_conn, connection_rec, connection_proxy):
     :param connection_proxy: connection proxy
     """
 
+    checked_in_at = connection_rec.info.get('checked_in_at')
+    if checked_in_at is None or time.time() - checked_in_at < _get_pool_ping_idle():
+        # a new connection, or one which was just used
+        return
+
     try:
         dbapi_conn.cursor().execute('select 1')
     except dbapi_conn.OperationalError as ex:
+        POOL_TELEMETRY.record_ping_failure()
         if ex.args[0] in (2006, 2013, 2014, 2045, 2055):
             msg = 'Got mysql server has gone away: %s' % ex
             raise DisconnectionError(msg)
@@ -124,6 +162,38 @@ def my_on_connect(dbapi_con, connection_record):
     dbapi_con.action = caller
 
 
+def _create_engine(sql_connection):
+    """ Creates an engine with the pool parameters of the database section and the listeners of its dialect.
+        :param sql_connection: The database url.
+        :returns: engine
+    """
+    config_params = [('pool_size', int), ('max_overflow', int), ('pool_timeout', int),
+                     ('pool_recycle', int), ('echo', int), ('echo_pool', str),
+                     ('pool_reset_on_return', str), ('use_threadlocal', int), ('pool_pre_ping', int)]
+    params = {}
+    for param, param_type in config_params:
+        try:
+            params[param] = param_type(config_get(DATABASE_SECTION, param))
+        except:  # noqa: B901
+            pass
+    if 'sqlite' not in sql_connection:
+        # the sqlite pools have no size
+        params.update(_POOL_OVERRIDES)
+    engine = create_engine(sql_connection, **params)
+    if 'mysql' in sql_connection:
+        if not params.get('pool_pre_ping'):
+            event.listen(engine, 'checkin', pool_checkin_listener)
+            event.listen(engine, 'checkout', mysql_ping_listener)
+        event.listen(engine, 'connect', mysql_convert_decimal_to_float)
+    elif 'postgresql' in sql_connection:
+        event.listen(engine, 'connect', psql_convert_decimal_to_float)
+    elif 'sqlite' in sql_connection:
+        event.listen(engine, 'connect', _fk_pragma_on_connect)
+    elif 'oracle' in sql_connection:
+        event.listen(engine, 'connect', my_on_connect)
+    return engine
+
+
 def get_engine(echo=True):
     """ Creates a engine to a specific database.
         :returns: engine
@@ -131,29 +201,41 @@ def get_engine(echo=True):
     global _ENGINE
     if not _ENGINE:
         sql_connection = config_get(DATABASE_SECTION, 'default')
-        config_params = [('pool_size', int), ('max_overflow', int), ('pool_timeout', int),
-                         ('pool_recycle', int), ('echo', int), ('echo_pool', str),
-                         ('pool_reset_on_return', str), ('use_threadlocal', int)]
-        params = {}
-        for param, param_type in config_params:
-            try:
-                params[param] = param_type(config_get(DATABASE_SECTION, param))
-            except:  # noqa: B901
-                pass
-        _ENGINE = create_engine(sql_connection, **params)
-        if 'mysql' in sql_connection:
-            event.listen(_ENGINE, 'checkout', mysql_ping_listener)
-            event.listen(_ENGINE, 'connect', mysql_convert_decimal_to_float)
-        elif 'postgresql' in sql_connection:
-            event.listen(_ENGINE, 'connect', psql_convert_decimal_to_float)
-        elif 'sqlite' in sql_connection:
-            event.listen(_ENGINE, 'connect', _fk_pragma_on_connect)
-        elif 'oracle' in sql_connection:
-            event.listen(_ENGINE, 'connect', my_on_connect)
+        _ENGINE = _create_engine(sql_connection)
+        POOL_TELEMETRY.instrument(_ENGINE)
     assert _ENGINE
     return _ENGINE
 
 
+def set_pool_overrides(pool_size=None, max_overflow=None):
+    """
+    Override the pool size and overflow of the database section.
+    It has to be called before the engine is created.
+
+    :param pool_size: Number of connections kept in the pool.
+    :param max_overflow: Number of connections allowed above the pool size.
+
+    :returns: True if the overrides are applied, False if the engine is already created.
+    """
+    if pool_size is not None:
+        _POOL_OVERRIDES['pool_size'] = int(pool_size)
+    if max_overflow is not None:
+        _POOL_OVERRIDES['max_overflow'] = int(max_overflow)
+    return _ENGINE is None
+
+
+def get_pool_stats():
+    """
+    Get the statistics of the connection pool.
+
+    :returns: dictionary of the pool statistics, with the pool size and overflow when the engine is created.
+    """
+    stats = POOL_TELEMETRY.stats(pool=_ENGINE.pool if _ENGINE else None)
+    if REPLICAS.urls:
+        stats['replicas'] = REPLICAS.stats()
+    return stats
+
+
 def get_dump_engine(echo=False):
     """ Creates a dump engine to a specific database.
         :returns: engine """
@@ -209,6 +291,200 @@ def get_session():
     return session
 
 
+class ReplicaSet(object):
+    """
+    Read replicas of the database, chosen round-robin. A replica failing to connect
+    is skipped for retry_interval seconds, the reads going to the other replicas or to the primary.
+    """
+
+    def __init__(self, urls, retry_interval=DEFAULT_REPLICA_RETRY_INTERVAL):
+        """
+        :param urls: List of the database urls of the replicas.
+        :param retry_interval: Seconds to skip a failed replica.
+        """
+        self.urls = urls
+        self.retry_interval = retry_interval
+        self._makers = [None] * len(urls)
+        self._down_until = [0] * len(urls)
+        self._failures = [0] * len(urls)
+        self._reads = [0] * len(urls)
+        self._next = 0
+        self._lock = Lock()
+
+    def choose(self):
+        """
+        Choose the next healthy replica.
+
+        :returns: the index of the replica or None if no replica is healthy.
+        """
+        now = time.time()
+        with self._lock:
+            for i in range(len(self.urls)):
+                replica = (self._next + i) % len(self.urls)
+                if self._down_until[replica] <= now:
+                    self._next = replica + 1
+                    self._reads[replica] += 1
+                    return replica
+        return None
+
+    def mark_down(self, replica):
+        """
+        Skip a failed replica for retry_interval seconds.
+        """
+        with self._lock:
+            self._down_until[replica] = time.time() + self.retry_interval
+            self._failures[replica] += 1
+
+    def get_maker(self, replica):
+        """
+        Get the sessionmaker of a replica, creating its engine at the first use.
+
+        :returns: sessionmaker or None if the engine of the replica cannot be created.
+        """
+        if self._makers[replica] is None:
+            with self._lock:
+                if self._makers[replica] is None:
+                    try:
+                        engine = _create_engine(self.urls[replica])
+                    except Exception as error:
+                        print(error)
+                        self._down_until[replica] = time.time() + self.retry_interval
+                        self._failures[replica] += 1
+                        return None
+                    self._makers[replica] = sessionmaker(bind=engine, autocommit=False, autoflush=True, expire_on_commit=True)
+        return self._makers[replica]
+
+    def stats(self):
+        """
+        Get the reads, the failures and the health of the replicas.
+
+        :returns: list of dictionaries of the replicas.
+        """
+        now = time.time()
+        with self._lock:
+            # the credentials of the urls are not returned
+            return [{'replica': url.split('@')[-1],
+                     'reads': self._reads[i],
+                     'failures': self._failures[i],
+                     'healthy': self._down_until[i] <= now} for i, url in enumerate(self.urls)]
+
+
+def _get_replicas_config():
+    urls, retry_interval = [], DEFAULT_REPLICA_RETRY_INTERVAL
+    if config_has_option(DATABASE_SECTION, 'replicas'):
+        urls = [url.strip() for url in config_get(DATABASE_SECTION, 'replicas').split(',') if url.strip()]
+    if config_has_option(DATABASE_SECTION, 'replica_retry_interval'):
+        retry_interval = config_get_int(DATABASE_SECTION, 'replica_retry_interval')
+    return urls, retry_interval
+
+
+REPLICAS = ReplicaSet(*_get_replicas_config())
+
+
+def get_read_session(read_your_writes=False):
+    """ Creates a session to read from a healthy replica, or to the primary database
+        if there is no replica, no healthy replica or the reads have to see the writes just committed.
+        :param read_your_writes: Read from the primary database.
+        :returns: (session, index of the replica or None for the primary database)
+    """
+    if not read_your_writes:
+        replica = REPLICAS.choose()
+        while replica is not None:
+            maker = REPLICAS.get_maker(replica)
+            if maker is not None:
+                return scoped_session(maker), replica
+            replica = REPLICAS.choose()
+    return get_session(), None
+
+
+class _ReplicaUnavailable(Exception):
+    """ A replica failed to serve a read, which is retried on the primary database. """
+
+
+def _is_connection_error(error):
+    return isinstance(error, (OperationalError, DisconnectionError)) or getattr(error, 'connection_invalidated', False)
+
+
+class UnitOfWork(object):
+    """
+    One session of a thread, bound to one connection, shared by the decorated calls of a unit of work.
+    The session and the connection are created at the first use.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.session = None
+
+    def get_session(self):
+        if self.session is None:
+            get_session()
+            self.connection = POOL_TELEMETRY.timed_checkout(_ENGINE.connect)
+            self.session = _MAKER(bind=self.connection, expire_on_commit=False)
+        return self.session
+
+    def close(self, commit=True):
+        if self.session is None:
+            return
+        try:
+            if commit:
+                self.session.commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.session.close()
+            self.connection.close()
+            self.session, self.connection = None, None
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Context in which the decorated calls of the thread share one session and one connection,
+    instead of creating a session and checking out a connection for every call.
+    The transactional calls still commit at their end. The remaining work of the unit is
+    committed at the end of the unit, or rolled back if the unit raises an exception.
+    Nested units join the outermost one.
+
+    :returns: the unit of work.
+    """
+    unit = getattr(_UNITS, 'unit', None)
+    if unit is not None:
+        yield unit
+        return
+
+    unit = UnitOfWork()
+    _UNITS.unit = unit
+    try:
+        yield unit
+    except:  # noqa: B901
+        _UNITS.unit = None
+        unit.close(commit=False)
+        raise
+    else:
+        _UNITS.unit = None
+        unit.close(commit=True)
+
+
+def get_unit_session():
+    """
+    Get the session of the unit of work of the current thread.
+
+    :returns: session or None if no unit of work is active.
+    """
+    unit = getattr(_UNITS, 'unit', None)
+    if unit is None:
+        return None
+    return unit.get_session()
+
+
+def _release_session(session, in_unit):
+    if in_unit:
+        # the next call of the unit starts with an empty identity map, like with a new session
+        session.expunge_all()
+    else:
+        session.remove()
+
+
 def retry_if_db_connection_error(exception):
     """Return True if error in connecting to db."""
     print(exception)
@@ -233,6 +509,9 @@ def read_session(function):
     session is a sqlalchemy session, and you can get one calling get_session().
     This is useful if only SELECTs and the like are being done; anything involving
     INSERTs, UPDATEs etc should use transactional_session.
+    If read replicas are configured, the reads go to a replica, falling back to the primary
+    database if it fails. Inside a unit of work or when called with read_your_writes=True,
+    the reads go to the primary database.
     '''
     @retry(retry_on_exception=retry_if_db_connection_error,
            wait_fixed=0.5,
@@ -244,9 +523,16 @@ def read_session(function):
         if isgeneratorfunction(function):
             raise ESSException('read_session decorator should not be used with generator. Use stream_session instead.')
 
+        read_your_writes = kwargs.pop('read_your_writes', False)
         if not kwargs.get('session'):
-            session = get_session()
+            session = get_unit_session()
+            in_unit = session is not None
+            replica = None
+            if not in_unit:
+                session, replica = get_read_session(read_your_writes)
             try:
+                if not in_unit and replica is None:
+                    POOL_TELEMETRY.timed_checkout(session.connection)
                 kwargs['session'] = session
                 return function(*args, **kwargs)
             except TimeoutError as error:
@@ -254,12 +540,19 @@ def read_session(function):
                 raise DatabaseException(str(error))
             except DatabaseError as error:
                 session.rollback()  # pylint: disable=maybe-no-member
-                raise DatabaseException(str(error))
+                if replica is None or not _is_connection_error(error):
+                    raise DatabaseException(str(error))
+                print('Read replica %s failed, falling back to the primary database: %s' % (replica, error))
+                REPLICAS.mark_down(replica)
             except:  # noqa: B901
-                session.rollback()  # pylint: disable=maybe-no-member
+                # other errors, for example NoObject, do not end the transaction of a unit of work and its locks
+                if not in_unit:
+                    session.rollback()  # pylint: disable=maybe-no-member
                 raise
             finally:
-                session.remove()
+                _release_session(session, in_unit)
+            del kwargs['session']
+            return new_funct(*args, read_your_writes=True, **kwargs)
         try:
             return function(*args, **kwargs)
         except:  # noqa: B901
@@ -275,6 +568,9 @@ def stream_session(function):
     session is a sqlalchemy session, and you can get one calling get_session().
     This is useful if only SELECTs and the like are being done; anything involving
     INSERTs, UPDATEs etc should use transactional_session.
+    If read replicas are configured, the reads go to a replica, falling back to the primary
+    database if it fails. Inside a unit of work or when called with read_your_writes=True,
+    the reads go to the primary database.
     '''
     @retry(retry_on_exception=retry_if_db_connection_error,
            wait_fixed=0.5,
@@ -286,11 +582,19 @@ def stream_session(function):
         if not isgeneratorfunction(function):
             raise ESSException('stream_session decorator should be used only with generator. Use read_session instead.')
 
+        read_your_writes = kwargs.pop('read_your_writes', False)
         if not kwargs.get('session'):
-            session = get_session()
+            session = get_unit_session()
+            in_unit = session is not None
+            replica, streamed = None, False
+            if not in_unit:
+                session, replica = get_read_session(read_your_writes)
             try:
+                if not in_unit and replica is None:
+                    POOL_TELEMETRY.timed_checkout(session.connection)
                 kwargs['session'] = session
                 for row in function(*args, **kwargs):
+                    streamed = True
                     yield row
             except TimeoutError as error:
                 print(error)
@@ -299,12 +603,22 @@ def stream_session(function):
             except DatabaseError as error:
                 print(error)
                 session.rollback()  # pylint: disable=maybe-no-member
-                raise DatabaseException(str(error))
+                # the stream can only fall back to the primary database before the first row
+                if replica is None or streamed or not _is_connection_error(error):
+                    raise DatabaseException(str(error))
+                REPLICAS.mark_down(replica)
             except:  # noqa: B901
-                session.rollback()  # pylint: disable=maybe-no-member
+                # other errors and the streams closed early do not end the transaction of a unit of work
+                if not in_unit:
+                    session.rollback()  # pylint: disable=maybe-no-member
                 raise
+            else:
+                return
             finally:
-                session.remove()
+                _release_session(session, in_unit)
+            del kwargs['session']
+            for row in new_funct(*args, read_your_writes=True, **kwargs):
+                yield row
         else:
             try:
                 for row in function(*args, **kwargs):
@@ -324,8 +638,13 @@ def transactional_session(function):
     @wraps(function)
     def new_funct(*args, **kwargs):
         if not kwargs.get('session'):
-            session = get_session()
+            session = get_unit_session()
+            in_unit = session is not None
+            if not in_unit:
+                session = get_session()
             try:
+                if not in_unit:
+                    POOL_TELEMETRY.timed_checkout(session.connection)
                 kwargs['session'] = session
                 result = function(*args, **kwargs)
                 session.commit()  # pylint: disable=maybe-no-member
@@ -341,7 +660,7 @@ def transactional_session(function):
                 session.rollback()  # pylint: disable=maybe-no-member
                 raise
             finally:
-                session.remove()  # pylint: disable=maybe-no-member
+                _release_session(session, in_unit)
         else:
             result = function(*args, **kwargs)
         return result
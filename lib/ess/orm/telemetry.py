@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Telemetry of the connection pool: checkout latency, checked out and overflow connections,
+invalidations, ping failures and checkout timeouts, collected from the pool events and
+from the timed checkouts of the sessions.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+
+
+# upper bounds in milliseconds of the checkout latency histogram buckets
+LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolTelemetry(object):
+    """
+    Thread-safe counters of the connection pool of an engine.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._engine = None
+        self.reset()
+
+    def reset(self):
+        """
+        Reset all counters.
+        """
+        with self._lock:
+            self.latency_counts = [0] * (len(self.buckets) + 1)
+            self.checkouts = 0
+            self.timed_checkouts = 0
+            self.latency_total = 0.0
+            self.latency_max = 0.0
+            self.checked_out = 0
+            self.max_checked_out = 0
+            self.max_overflow = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.ping_failures = 0
+            self.timeouts = 0
+
+    def record_latency(self, seconds):
+        milliseconds = seconds * 1000.0
+        with self._lock:
+            self.timed_checkouts += 1
+            self.latency_total += milliseconds
+            self.latency_max = max(self.latency_max, milliseconds)
+            for i, bound in enumerate(self.buckets):
+                if milliseconds <= bound:
+                    self.latency_counts[i] += 1
+                    break
+            else:
+                self.latency_counts[-1] += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_ping_failure(self):
+        with self._lock:
+            self.ping_failures += 1
+
+    def on_connect(self, dbapi_conn, connection_rec):
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, dbapi_conn, connection_rec, connection_proxy):
+        pool = self._engine.pool if self._engine is not None else None
+        overflow = pool.overflow() if hasattr(pool, 'overflow') else 0
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.max_overflow = max(self.max_overflow, overflow)
+
+    def on_checkin(self, dbapi_conn, connection_rec):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def on_invalidate(self, dbapi_conn, connection_rec, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self, pool=None):
+        """
+        Get the statistics of the pool.
+
+        :param pool: The pool of the engine, to add its size and current overflow.
+
+        :returns: dictionary of the pool statistics.
+        """
+        with self._lock:
+            labels = ['<=%sms' % bound for bound in self.buckets] + ['>%sms' % self.buckets[-1]]
+            stats = {'checkouts': self.checkouts,
+                     'timed_checkouts': self.timed_checkouts,
+                     'checked_out': self.checked_out,
+                     'max_checked_out': self.max_checked_out,
+                     'connects': self.connects,
+                     'invalidations': self.invalidations,
+                     'ping_failures': self.ping_failures,
+                     'timeouts': self.timeouts,
+                     'checkout_latency': {'avg_ms': self.latency_total / self.timed_checkouts if self.timed_checkouts else 0,
+                                          'max_ms': self.latency_max,
+                                          'histogram': dict(zip(labels, self.latency_counts))}}
+
+        if pool is not None:
+            stats['pool_class'] = pool.__class__.__name__
+            stats['status'] = pool.status()
+            # only the queue pools have a size and an overflow
+            if hasattr(pool, 'overflow'):
+                overflow = max(pool.overflow(), 0)
+                with self._lock:
+                    self.max_overflow = max(self.max_overflow, overflow)
+                    stats['max_overflow'] = self.max_overflow
+                stats['size'] = pool.size()
+                stats['checked_in'] = pool.checkedin()
+                stats['overflow'] = overflow
+        return stats
+
+    def instrument(self, engine):
+        """
+        Listen to the pool events of an engine.
+
+        :param engine: The engine.
+        """
+        self._engine = engine
+        event.listen(engine, 'connect', self.on_connect)
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+        event.listen(engine, 'invalidate', self.on_invalidate)
+
+    def timed_checkout(self, connect):
+        """
+        Check out a connection, timing the wait for a free connection of the pool until pool_timeout.
+
+        :param connect: The function checking out the connection, for example engine.connect or session.connection.
+
+        :returns: the connection.
+        """
+        start = time.time()
+        try:
+            connection = connect()
+        except TimeoutError:
+            self.record_timeout()
+            raise
+        self.record_latency(time.time() - start)
+        return connection
+
+
+POOL_TELEMETRY = PoolTelemetry()
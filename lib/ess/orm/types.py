@@ -20,10 +20,84 @@ import uuid
 
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.dialects.oracle import RAW, CLOB
-from sqlalchemy.dialects.mysql import BINARY
-from sqlalchemy.types import TypeDecorator, CHAR, String
+from sqlalchemy.dialects.mysql import BINARY, MEDIUMTEXT
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.types import TypeDecorator, CHAR, String, Text
 import sqlalchemy.types as types
 
+from ess.common.config import config_get, config_has_option
+from ess.common.exceptions import ESSException
+
+
+# the json libraries tried in order when the codec is not configured
+JSON_CODECS = ('ujson', 'simplejson', 'json')
+
+# first mysql version with the native JSON type
+MYSQL_JSON_VERSION = (5, 7, 8)
+
+
+class JSONCodec(object):
+    """
+    Encoder and decoder of the JSON columns.
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def load_json_codec(name=None):
+    """
+    Load the codec of a json library.
+
+    :param name: Name of the json library, ujson, simplejson or json.
+                 If None, [database] json_codec or the first importable one of JSON_CODECS.
+
+    :raises ESSException: If the configured library cannot be imported.
+
+    :returns: JSONCodec.
+    """
+    if name is None and config_has_option('database', 'json_codec'):
+        name = config_get('database', 'json_codec')
+
+    for codec_name in ([name] if name else JSON_CODECS):
+        try:
+            module = __import__(codec_name)
+        except ImportError:
+            if name:
+                raise ESSException('JSON codec %s cannot be imported' % name)
+            continue
+        return JSONCodec(codec_name, module.dumps, module.loads)
+    return JSONCodec('json', json.dumps, json.loads)
+
+
+JSON_CODEC = load_json_codec()
+
+
+def set_json_codec(name=None):
+    """
+    Change the codec of the JSON columns.
+
+    :param name: Name of the json library, or None for the default one.
+
+    :returns: JSONCodec.
+    """
+    global JSON_CODEC
+    JSON_CODEC = load_json_codec(name)
+    return JSON_CODEC
+
+
+class NativeJSONText(Text):
+    """
+    Text stored in a native JSON column, encoded and decoded by the JSON type instead of the driver.
+    """
+
+
+@compiles(NativeJSONText, 'mysql')
+def compile_native_json_mysql(type_, compiler, **kw):
+    return "JSON"
+
 
 class GUID(TypeDecorator):
     """
@@ -75,10 +149,19 @@ class GUID(TypeDecorator):
             return str(uuid.UUID(value)).replace('-', '').lower()
 
 
+def mysql_has_native_json(dialect):
+    """
+    Whether the mysql server supports the native JSON type. MariaDB only aliases it to LONGTEXT.
+    """
+    version = getattr(dialect, 'server_version_info', None)
+    return bool(version) and not getattr(dialect, '_is_mariadb', False) and tuple(version[:3]) >= MYSQL_JSON_VERSION
+
+
 class JSON(TypeDecorator):
     """
     Platform independent json type
-    JSONB for postgres , JSON for the rest
+    JSONB for postgres, JSON for mysql >= 5.7.8, MEDIUMTEXT for older mysql, CLOB for oracle, text for the rest.
+    The values are encoded and decoded with JSON_CODEC.
     """
 
     impl = types.JSON
@@ -87,8 +170,9 @@ class JSON(TypeDecorator):
         if dialect.name == 'postgresql':
             return dialect.type_descriptor(JSONB())
         elif dialect.name == 'mysql':
-            return dialect.type_descriptor(String(1024))
-            # return dialect.type_descriptor(types.JSON())
+            if mysql_has_native_json(dialect):
+                return dialect.type_descriptor(NativeJSONText())
+            return dialect.type_descriptor(MEDIUMTEXT())
         elif dialect.name == 'oracle':
             return dialect.type_descriptor(CLOB())
         else:
@@ -97,21 +181,12 @@ class JSON(TypeDecorator):
     def process_bind_param(self, value, dialect):
         if value is None:
             return value
-        elif dialect.name == 'postgresql':
-            return json.dumps(value)
-        elif dialect.name == 'oracle':
-            return json.dumps(value)
-        elif dialect.name == 'mysql':
-            return json.dumps(value)
-        else:
-            return json.dumps(value)
+        return JSON_CODEC.dumps(value)
 
     def process_result_value(self, value, dialect):
         if value is None:
             return value
-        elif dialect.name == 'oracle':
-            return json.loads(value)
-        elif dialect.name == 'mysql':
-            return json.loads(value)
-        else:
-            return json.loads(value)
+        elif dialect.name == 'postgresql' and not isinstance(value, basestring):
+            # already decoded by psycopg2
+            return value
+        return JSON_CODEC.loads(value)
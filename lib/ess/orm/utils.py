@@ -10,17 +10,143 @@
 
 
 """
-Utils to create the database or destroy the database
+Utils to create the database or destroy the database, bulk database operations, baked queries
+and projections of columns.
 """
 
 import traceback
 
+from sqlalchemy import and_, bindparam, select, text
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.engine import reflection
-from sqlalchemy.schema import DropTable, DropConstraint, ForeignKeyConstraint, MetaData, Table
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import scoped_session
+from sqlalchemy.schema import DropTable, DropConstraint, ForeignKeyConstraint, MetaData, Sequence, Table
 
+from ess.common import exceptions
 from ess.orm import session, models
 
 
+DEFAULT_CHUNK_SIZE = 1000
+
+# cache of the constructed and compiled hot queries, keyed by their shape
+BAKERY = baked.bakery(size=500)
+
+
+def run_baked_query(baked_query, session, **params):
+    """
+    Bind a baked query to a session and its parameters.
+
+    :param baked_query: The baked query, built from BAKERY with bindparam for the values.
+    :param session: The database session in use, a scoped session or a session.
+    :param params: The values of the bound parameters.
+
+    :returns: baked query result, with all(), first() and one() like a query.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    return baked_query(session).params(**params)
+
+
+class Record(object):
+    """
+    Lightweight row of projected columns, without an ORM identity. The columns are
+    attributes, and can be read by name or by position like the query rows.
+    """
+    __slots__ = ()
+
+    def __init__(self, row):
+        for key, value in zip(self.__slots__, row):
+            setattr(self, key, value)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def _asdict(self):
+        return dict([(key, getattr(self, key)) for key in self.__slots__])
+
+    def __iter__(self):
+        return iter([getattr(self, key) for key in self.__slots__])
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            key = self.__slots__[key]
+        return getattr(self, key)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(['%s=%r' % (key, getattr(self, key)) for key in self.__slots__]))
+
+
+# record classes, keyed by table name and projected columns
+_RECORD_CLASSES = {}
+
+
+def get_record_class(table, columns):
+    """
+    Get the record class of projected columns of a table, created once per projection.
+
+    :param table: The table.
+    :param columns: List of the column names.
+
+    :returns: subclass of Record with the columns as slots.
+    """
+    key = (table.name, tuple(columns))
+    try:
+        return _RECORD_CLASSES[key]
+    except KeyError:
+        record_class = type(str('%sRecord' % table.name), (Record,), {'__slots__': tuple(columns)})
+        _RECORD_CLASSES[key] = record_class
+        return record_class
+
+
+def project_columns(table, columns, required=()):
+    """
+    Check the projected columns of a table and prepend the required ones.
+
+    :param table: The table.
+    :param columns: List of the column names. All columns if empty.
+    :param required: Names of the columns always projected, for example the primary key.
+
+    :raises CoreException: If a column does not exist.
+
+    :returns: list of the column names.
+    """
+    if not columns:
+        return [column.name for column in table.c]
+
+    unknown = [column for column in columns if column not in table.c]
+    if unknown:
+        raise exceptions.CoreException('Unknown %s columns: %s' % (table.name, unknown))
+    return [column for column in required if column not in columns] + list(columns)
+
+
+def select_records(session, table, columns, criteria, order_by=None, limit=None):
+    """
+    Select projected columns with a Core select, bypassing the ORM identity map.
+
+    :param session: The database session in use.
+    :param table: The table.
+    :param columns: List of the column names, as returned by project_columns.
+    :param criteria: List of the filter clauses.
+    :param order_by: List of the ordering clauses.
+    :param limit: Maximum number of rows.
+
+    :returns: list of records.
+    """
+    record_class = get_record_class(table, columns)
+    query = select([table.c[column] for column in columns])
+    if criteria:
+        query = query.where(and_(*criteria))
+    if order_by:
+        query = query.order_by(*order_by)
+    if limit:
+        query = query.limit(limit)
+    return [record_class(row) for row in session.execute(query)]
+
+
 def build_database(echo=True, tests=False):
     """Build the database. """
     engine = session.get_engine(echo=echo)
@@ -86,3 +212,82 @@ def dump_schema():
     """ Creates a schema dump to a specific database. """
     engine = session.get_dump_engine()
     models.register_models(engine)
+
+
+def chunks(items, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Split a list into successive lists with at most chunk_size items. """
+    for i in range(0, len(items), chunk_size):
+        yield items[i:i + chunk_size]
+
+
+def _fill_defaults(table, rows):
+    """ Fill the python side column defaults, which are not applied to textual statements. """
+    for column in table.columns:
+        if column.default is None or isinstance(column.default, Sequence):
+            continue
+        for row in rows:
+            if row.get(column.name) is None:
+                if column.default.is_callable:
+                    row[column.name] = column.default.arg(None)
+                else:
+                    row[column.name] = column.default.arg
+    return rows
+
+
+def _oracle_merge_ignore(table, columns, unique_columns, dialect):
+    """
+    Build an Oracle MERGE statement which only inserts rows not matching the unique columns.
+    DECODE is used to compare the unique columns, to consider NULL values as equal as the unique index does.
+    """
+    preparer = dialect.identifier_preparer
+    table_name = preparer.format_table(table)
+
+    source = ', '.join([':%s AS %s' % (c, preparer.quote(c)) for c in columns])
+    condition = ' AND '.join(['DECODE(t.%s, s.%s, 1, 0) = 1' % (preparer.quote(c), preparer.quote(c)) for c in unique_columns])
+    insert_columns = [preparer.quote(c) for c in columns]
+    insert_values = ['s.%s' % preparer.quote(c) for c in columns]
+    for column in table.primary_key.columns:
+        if column.name not in columns and isinstance(column.default, Sequence):
+            insert_columns.append(preparer.quote(column.name))
+            insert_values.append('%s.nextval' % preparer.format_sequence(column.default))
+
+    sql = ('MERGE INTO %s t USING (SELECT %s FROM dual) s ON (%s) WHEN NOT MATCHED THEN INSERT (%s) VALUES (%s)' %
+           (table_name, source, condition, ', '.join(insert_columns), ', '.join(insert_values)))
+    return text(sql).bindparams(*[bindparam(c, type_=table.c[c].type) for c in columns])
+
+
+def bulk_insert_ignore(table, rows, unique_columns, chunk_size=DEFAULT_CHUNK_SIZE, session=None):
+    """
+    Insert rows in chunks with executemany, ignoring the rows conflicting with an unique constraint.
+
+    :param table: The table to insert into.
+    :param rows: List of dictionaries, all with the same keys.
+    :param unique_columns: Names of the columns of the unique constraint to check.
+    :param chunk_size: Number of rows to insert with one statement.
+    :param session: The database session in use.
+
+    :returns: number of inserted rows.
+    """
+    if not rows:
+        return 0
+
+    dialect = session.bind.dialect
+    if dialect.name == 'mysql':
+        stmt = table.insert().prefix_with('IGNORE')
+    elif dialect.name == 'postgresql':
+        stmt = postgresql.insert(table).on_conflict_do_nothing(index_elements=unique_columns)
+    elif dialect.name == 'sqlite':
+        stmt = table.insert().prefix_with('OR IGNORE')
+    elif dialect.name == 'oracle':
+        rows = _fill_defaults(table, rows)
+        columns = sorted(rows[0].keys())
+        stmt = _oracle_merge_ignore(table, columns, unique_columns, dialect)
+    else:
+        stmt = table.insert()
+
+    inserted = 0
+    for chunk in chunks(rows, chunk_size):
+        result = session.execute(stmt, chunk)
+        # some drivers cannot report the rowcount of executemany
+        inserted += result.rowcount if result.rowcount >= 0 else len(chunk)
+    return inserted
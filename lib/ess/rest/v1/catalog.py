@@ -18,14 +18,17 @@ from web import application, header, input, data
 from ess.common import exceptions
 from ess.common.constants import HTTP_STATUS_CODE
 from ess.rest.v1.controller import ESSController
-from ess.core.catalog import get_collection, add_contents, get_content_best_match, get_contents_by_edge
+from ess.core.catalog import (get_collection, add_contents, get_content_best_match, get_available_content_best_match,
+                              get_contents_best_match, iter_contents_by_edge)
 from ess.orm.constants import ContentStatus
+from ess.orm.models import CollectionContent
 
 
 URLS = (
     'collection/(.*)/(.*)', 'CatalogCollection',
     'content/(.*)/(.*)', 'CatalogContent',
     'contents/(.*)/(.*)/(.*)', 'CatalogContents',
+    'contents_match', 'CatalogContentsMatch',
 )
 
 
@@ -96,7 +99,10 @@ class CatalogContent(ESSController):
             status = params['status']
 
         try:
-            content = get_content_best_match(scope=scope, name=name, min_id=min_id, max_id=max_id, status=status)
+            if status == str(ContentStatus.AVAILABLE) and min_id is not None and max_id is not None:
+                content = get_available_content_best_match(scope=scope, name=name, min_id=min_id, max_id=max_id)
+            else:
+                content = get_content_best_match(scope=scope, name=name, min_id=min_id, max_id=max_id, status=status)
             if content.status != ContentStatus.AVAILABLE:
                 content.pfn_size = 0
                 content.pfn = None
@@ -128,13 +134,15 @@ class CatalogContents(ESSController):
         header('Content-Type', 'application/json')
 
         try:
-            contents = get_contents_by_edge(edge_name=edge_name,
-                                            collection_scope=collection_scope,
-                                            collection_name=collection_name)
-            for content in contents:
-                if content.status != ContentStatus.AVAILABLE:
-                    content.pfn_size = 0
-                    content.pfn = None
+            contents = []
+            rows = iter_contents_by_edge(edge_name=edge_name,
+                                         collection_scope=collection_scope,
+                                         collection_name=collection_name)
+            for content in CollectionContent.rows_to_dicts(rows):
+                if content['status'] != ContentStatus.AVAILABLE.description:
+                    content['pfn_size'] = 0
+                    content['pfn'] = None
+                contents.append(content)
         except exceptions.NoObject as error:
             raise self.generate_http_response(HTTP_STATUS_CODE.NotFound, exc_cls=error.__class__.__name__, exc_msg=error)
         except exceptions.ESSException as error:
@@ -144,7 +152,7 @@ class CatalogContents(ESSController):
             print(format_exc())
             raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=exceptions.CoreException.__name__, exc_msg=error)
 
-        raise self.generate_http_response(HTTP_STATUS_CODE.OK, data=[c.to_dict() for c in contents])
+        raise self.generate_http_response(HTTP_STATUS_CODE.OK, data=contents)
 
     def POST(self, collection_scope, collection_name, edge_name):
         """ Add or update list of contents in a collection on an edge.
@@ -159,9 +167,9 @@ class CatalogContents(ESSController):
         header('Content-Type', 'application/json')
 
         try:
-            json_data = data
+            json_data = data()
             files = json.loads(json_data)
-            add_contents(collection_scope, collection_name, edge_name, files)
+            ret = add_contents(collection_scope, collection_name, edge_name, files)
         except exceptions.DuplicatedObject as error:
             raise self.generate_http_response(HTTP_STATUS_CODE.NotFound, exc_cls=error.__class__.__name__, exc_msg=error)
         except exceptions.ESSException as error:
@@ -171,7 +179,57 @@ class CatalogContents(ESSController):
             print(format_exc())
             raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=exceptions.CoreException.__name__, exc_msg=error)
 
-        raise self.generate_http_response(HTTP_STATUS_CODE.OK, data={'status': 0, 'message': 'added successfully'})
+        raise self.generate_http_response(HTTP_STATUS_CODE.OK, data={'status': 0, 'message': 'added successfully',
+                                                                     'inserted': ret['inserted'], 'skipped': ret['skipped']})
+
+
+class CatalogContentsMatch(ESSController):
+    """ Get the best matched contents of many ranges. """
+
+    def POST(self):
+        """ Get the narrowest content containing each range.
+        The body is a dictionary with 'ranges', a list of [scope, name, min_id, max_id],
+        and optional 'status' and 'edge_name'.
+        HTTP Success:
+            200 OK
+        HTTP Error:
+            400 Bad request
+            404 Not Found
+            500 InternalError
+        :returns: list of contents in the order of the ranges, None for the ranges without a content.
+        """
+
+        header('Content-Type', 'application/json')
+
+        try:
+            json_data = json.loads(data())
+            ranges = json_data['ranges']
+        except Exception as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.BadRequest, exc_cls=exceptions.BadRequest.__name__, exc_msg=error)
+
+        try:
+            contents = get_contents_best_match(ranges, edge_name=json_data.get('edge_name', None),
+                                               status=json_data.get('status', None))
+            ret = []
+            for content in contents:
+                if content is None:
+                    ret.append(None)
+                    continue
+                content = content.to_dict()
+                if content['status'] != str(ContentStatus.AVAILABLE):
+                    content['pfn_size'] = 0
+                    content['pfn'] = None
+                ret.append(content)
+        except exceptions.NoObject as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.NotFound, exc_cls=error.__class__.__name__, exc_msg=error)
+        except exceptions.ESSException as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=error.__class__.__name__, exc_msg=error)
+        except Exception as error:
+            print(error)
+            print(format_exc())
+            raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=exceptions.CoreException.__name__, exc_msg=error)
+
+        raise self.generate_http_response(HTTP_STATUS_CODE.OK, data=ret)
 
 
 """----------------------
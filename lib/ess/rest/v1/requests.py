@@ -10,18 +10,27 @@
 
 
 import json
+from StringIO import StringIO
 from traceback import format_exc
 
-from web import application, data, header
+from web import application, ctx, data, header, input
 
 
 from ess.common import exceptions
 from ess.common.constants import HTTP_STATUS_CODE
+from ess.common.utils import iter_json_array
 from ess.rest.v1.controller import ESSController
-from ess.core.requests import add_request, get_request, update_request, delete_request, get_requests
+from ess.core.requests import add_request, add_requests, get_request, update_request, delete_request, get_requests
+from ess.core.transitions import set_transition_daemon
+from ess.orm.utils import DEFAULT_CHUNK_SIZE
+
+
+# the request transitions of the service are recorded with the name rest
+set_transition_daemon('rest', default=True)
 
 
 URLS = (
+    '/bulk', 'BulkRequests',
     '/(.+)', 'Request',
     '/', 'Requests',
 )
@@ -32,11 +41,13 @@ class Requests(ESSController):
 
     def GET(self):
         """
-        Get requests.
+        Get requests. With limit, or after the priority,request_id of the last request
+        of a previous page, the requests are ordered by priority.
 
         HTTP Success:
             200 OK
         HTTP Error:
+            400 Bad request
             404 Not Found
             500 InternalError
         :returns: A list containing requests.
@@ -54,7 +65,19 @@ class Requests(ESSController):
                 edge_name = params['edge_name']
             if 'edge_id' in params:
                 edge_id = int(params['edge_id'])
-            reqs = get_requests(status=status, edge_name=edge_name, edge_id=edge_id)
+            limit = None
+            after = None
+            if 'limit' in params:
+                limit = int(params['limit'])
+            if 'after' in params:
+                # priority,request_id of the last request of the previous page
+                after_priority, after_request_id = params['after'].split(',')
+                after = (int(after_priority), int(after_request_id))
+        except ValueError as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.BadRequest, exc_cls=exceptions.BadRequest.__name__, exc_msg=error)
+
+        try:
+            reqs = get_requests(status=status, edge_name=edge_name, edge_id=edge_id, limit=limit, after=after)
         except exceptions.NoObject as error:
             raise self.generate_http_response(HTTP_STATUS_CODE.NotFound, exc_cls=error.__class__.__name__, exc_msg=error)
         except exceptions.ESSException as error:
@@ -67,7 +90,8 @@ class Requests(ESSController):
         raise self.generate_http_response(HTTP_STATUS_CODE.OK, data=[req.to_dict() for req in reqs])
 
     def POST(self):
-        """ Create Request.
+        """ Create Request. A request for the same data as a request in flight is subscribed to it,
+        unless coalesce is false.
         HTTP Success:
             200 OK
         HTTP Error:
@@ -75,10 +99,11 @@ class Requests(ESSController):
             500 Internal Error
         """
         json_data = data()
-        args = ['scope', 'name', 'data_type', 'status', 'granularity_type', 'granularity_level', 'priority', 'request_meta']
+        args = ['scope', 'name', 'data_type', 'status', 'granularity_type', 'granularity_level', 'priority', 'request_meta',
+                'coalesce']
 
         try:
-            parameters = {}
+            parameters = {'coalesce': True}
             json_data = json.loads(json_data)
             for key, value in json_data.items():
                 if key in args:
@@ -100,6 +125,55 @@ class Requests(ESSController):
         raise self.generate_http_response(HTTP_STATUS_CODE.OK, data={'request_id': request_id})
 
 
+class BulkRequests(ESSController):
+    """ Create Requests in bulk """
+
+    def POST(self):
+        """ Create Requests from a json array of requests. The array is read and the requests are added
+        in chunks, so that large arrays are not loaded at once. The requests for the same data as a request
+        in flight are subscribed to it, unless the coalesce parameter is false.
+        Every request gets a result: created, duplicate of an earlier request or invalid.
+        If the array cannot be decoded, the chunks of requests before the error are added: with coalesce,
+        sending the array again returns them as duplicates.
+        HTTP Success:
+            200 OK
+        HTTP Error:
+            400 Bad request
+            500 Internal Error
+        :returns: A list of the results of the requests, in their order.
+        """
+        header('Content-Type', 'application/json')
+        params = input()
+        coalesce = params.get('coalesce', 'true').lower() not in ('false', '0')
+
+        if ctx.env.get('CONTENT_LENGTH'):
+            requests = iter_json_array(ctx.env['wsgi.input'], size=int(ctx.env['CONTENT_LENGTH']))
+        else:
+            requests = iter_json_array(StringIO(data()))
+
+        results = []
+        try:
+            chunk = []
+            for request in requests:
+                chunk.append(request)
+                if len(chunk) >= DEFAULT_CHUNK_SIZE:
+                    results += add_requests(chunk, coalesce=coalesce)
+                    chunk = []
+            if chunk:
+                results += add_requests(chunk, coalesce=coalesce)
+        except ValueError as error:
+            exc_msg = 'Cannot decode json array of requests, %s requests before were added: %s' % (len(results), error)
+            raise self.generate_http_response(HTTP_STATUS_CODE.BadRequest, exc_cls=exceptions.BadRequest.__name__, exc_msg=exc_msg)
+        except exceptions.ESSException as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=error.__class__.__name__, exc_msg=error)
+        except Exception as error:
+            print(error)
+            print(format_exc())
+            raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=exceptions.CoreException.__name__, exc_msg=error)
+
+        raise self.generate_http_response(HTTP_STATUS_CODE.OK, data=results)
+
+
 class Request(ESSController):
     """ Update, get and delete Request. """
 
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+import datetime
+from traceback import format_exc
+
+from web import application, header, input
+
+
+from ess.common import exceptions
+from ess.common.constants import HTTP_STATUS_CODE
+from ess.core.cache import get_cache_stats
+from ess.core.transitions import DEFAULT_STAGE_PERIOD, TRANSITION_LOG, get_stage_durations
+from ess.orm.session import get_pool_stats
+from ess.rest.v1.controller import ESSController
+
+
+URLS = (
+    '/stages', 'StageStats',
+    '/', 'Stats',
+    '', 'Stats',
+)
+
+
+class Stats(ESSController):
+    """ Statistics of the service process. """
+
+    def GET(self):
+        """ Get the statistics of the database connection pool and of the caches of the process.
+        HTTP Success:
+            200 OK
+        HTTP Error:
+            500 InternalError
+        :returns: dictionary with the pool, the cache and the request transitions buffer statistics.
+        """
+        header('Content-Type', 'application/json')
+
+        try:
+            stats = {'pool': get_pool_stats(), 'cache': get_cache_stats(), 'transitions': TRANSITION_LOG.stats()}
+        except exceptions.ESSException as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=error.__class__.__name__, exc_msg=error)
+        except Exception as error:
+            print(error)
+            print(format_exc())
+            raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=exceptions.CoreException.__name__, exc_msg=error)
+
+        raise self.generate_http_response(HTTP_STATUS_CODE.OK, data=stats)
+
+
+class StageStats(ESSController):
+    """ Durations of the stages of the requests. """
+
+    def GET(self):
+        """ Get the p50, p95 and p99 durations in seconds of the stages of the requests, per edge and stage,
+        from the request transitions of the last period seconds, MAX_STAGE_PERIOD at most.
+        HTTP Success:
+            200 OK
+        HTTP Error:
+            400 Bad request
+            404 Not Found
+            500 InternalError
+        :returns: list of the durations of the stages.
+        """
+        header('Content-Type', 'application/json')
+        params = input()
+
+        try:
+            period = int(params.get('period', DEFAULT_STAGE_PERIOD))
+        except ValueError as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.BadRequest, exc_cls=exceptions.BadRequest.__name__, exc_msg=error)
+
+        try:
+            since = datetime.datetime.utcnow() - datetime.timedelta(seconds=period)
+            stages = get_stage_durations(edge_name=params.get('edge_name', None), since=since)
+        except exceptions.NoObject as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.NotFound, exc_cls=error.__class__.__name__, exc_msg=error)
+        except exceptions.ESSException as error:
+            raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=error.__class__.__name__, exc_msg=error)
+        except Exception as error:
+            print(error)
+            print(format_exc())
+            raise self.generate_http_response(HTTP_STATUS_CODE.InternalError, exc_cls=exceptions.CoreException.__name__, exc_msg=error)
+
+        raise self.generate_http_response(HTTP_STATUS_CODE.OK, data=stages)
+
+
+"""----------------------
+   Web service startup
+----------------------"""
+
+
+APP = application(URLS, globals())
+application = APP.wsgifunc()
@@ -17,15 +17,25 @@ import json
 
 import unittest2 as unittest
 from uuid import uuid4 as uuid
-from nose.tools import assert_equal, assert_raises
+from nose.tools import assert_equal, assert_raises, assert_true
+from sqlalchemy.orm.exc import MultipleResultsFound
 
 from ess.common import exceptions
 from ess.common.utils import check_database, has_config
+from ess.orm.constants import ContentType, ContentStatus
+from ess.core.archive import archive_contents, purge_archives
+from ess.core.cache import CONTENT_RANGE_CACHE, IntervalTree
+from ess.core.counters import get_content_counters, reconcile_content_counters, update_content_counters
 from ess.core.edges import register_edge, delete_edge
-from ess.core.catalog import (add_collection, get_collection, update_collection, delete_collection,
-                              add_content, update_content, get_content, delete_content,
-                              get_content_best_match, add_collection_replicas, get_collection_replicas,
-                              update_collection_replicas, delete_collection_replicas)
+from ess.core.catalog import (add_collection, claim_contents, get_collection, update_collection, delete_collection,
+                              add_content, add_contents, update_content, get_content, delete_content,
+                              get_content_best_match, get_available_content_best_match, get_contents_best_match,
+                              get_contents_by_edge, iter_contents_by_edge, update_contents_by_id, get_contents_statistics,
+                              reclaim_expired_contents, renew_leases, add_collection_replicas, is_collection_complete,
+                              get_collection_replicas, update_collection_replicas, update_collection_replicas_requests,
+                              delete_collection_replicas)
+from ess.orm.models import Collection, CollectionContent, CollectionContentArchive
+from ess.orm.session import get_unit_session, unit_of_work
 
 
 class TestCatalogCore(unittest.TestCase):
@@ -318,3 +328,666 @@ class TestCatalogCore(unittest.TestCase):
 
         delete_collection(scope=properties_collection['scope'], name=properties_collection['name'], coll_id=collection_id)
         delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_add_contents_in_bulk(self):
+        """ Catalog (CORE): Test adding contents in bulk, skipping the existing contents """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        properties_collection = {
+            'scope': 'test_scope',
+            'name': 'test_name_%s' % str(uuid()),
+            'collection_type': 'DATASET',
+            'coll_size': 100,
+            'global_status': 'NEW',
+            'total_files': 100,
+        }
+        collection_id = add_collection(**properties_collection)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = []
+        for i in range(0, 100, 10):
+            files.append({'scope': 'test_scope',
+                          'name': file_name,
+                          'min_id': i,
+                          'max_id': i + 9,
+                          'content_type': 'PARTIAL',
+                          'status': 'TOSPLIT',
+                          'priority': 10,
+                          'pfn': 'pfn_%s' % i})
+
+        ret = add_contents(properties_collection['scope'], properties_collection['name'], edge_name, files[:5], chunk_size=2)
+        assert_equal(ret, {'inserted': 5, 'skipped': 0})
+
+        ret = add_contents(properties_collection['scope'], properties_collection['name'], edge_name, files, chunk_size=3)
+        assert_equal(ret, {'inserted': 5, 'skipped': 5})
+        # only the inserted contents are counted
+        counters = get_content_counters(edge_id=edge_id, coll_id=collection_id)
+        assert_equal([(str(c.status), c.counter) for c in counters], [('TOSPLIT', 10)])
+        assert_equal(reconcile_content_counters(edge_id=edge_id, coll_id=collection_id), 0)
+
+        # the contents duplicated in the files, and the whole files without min_id and max_id, are inserted once
+        whole_file = {'scope': 'test_scope', 'name': file_name, 'min_id': None, 'max_id': None,
+                      'content_type': 'FILE', 'status': 'NEW', 'pfn_size': 100}
+        ret = add_contents(properties_collection['scope'], properties_collection['name'], edge_name,
+                           [whole_file, files[0], dict(whole_file)], chunk_size=2)
+        assert_equal(ret, {'inserted': 1, 'skipped': 2})
+        ret = add_contents(properties_collection['scope'], properties_collection['name'], edge_name, [whole_file])
+        assert_equal(ret, {'inserted': 0, 'skipped': 1})
+        counters = get_content_counters(edge_id=edge_id, coll_id=collection_id)
+        assert_equal(sorted([(str(c.content_type), str(c.status), c.counter, c.bytes) for c in counters]),
+                     [('FILE', 'NEW', 1, 100), ('PARTIAL', 'TOSPLIT', 10, 0)])
+        assert_equal(reconcile_content_counters(edge_id=edge_id, coll_id=collection_id), 0)
+        for content in get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id):
+            if str(content.content_type) == 'FILE':
+                delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id)
+        assert_equal(len(contents), 10)
+        assert_equal(sorted([c.min_id for c in contents]), range(0, 100, 10))
+        assert_equal(set([str(c.status) for c in contents]), set(['TOSPLIT']))
+        assert_equal(contents[0].num_failure, 0)
+        assert_equal(contents[0].created_at is not None, True)
+
+        for content in contents:
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=properties_collection['scope'], name=properties_collection['name'], coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_update_contents_by_id(self):
+        """ Catalog (CORE): Test updating contents by id in bulk """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'TOSPLIT', 'priority': 10} for i in range(0, 100, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id)
+        ids = sorted([c.content_id for c in contents])
+
+        updated = update_contents_by_id(dict([(id, {'status': 'SPLITTING'}) for id in ids]), chunk_size=3)
+        assert_equal(updated, 10)
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id, status='SPLITTING')
+        assert_equal(len(contents), 10)
+
+        update_files = {}
+        for id in ids[:5]:
+            update_files[id] = {'status': 'TOSTAGEDOUT', 'pfn_size': id, 'pfn': 'pfn_%s' % id}
+        update_files[ids[5]] = {'status': 'BAD'}
+        update_files[ids[6]] = {'object_metadata': {'size': 1}}
+        updated = update_contents_by_id(update_files, chunk_size=2)
+        assert_equal(updated, 7)
+
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id, status='TOSTAGEDOUT')
+        assert_equal(sorted([c.content_id for c in contents]), ids[:5])
+        for content in contents:
+            assert_equal(content.pfn_size, content.content_id)
+            assert_equal(content.pfn, 'pfn_%s' % content.content_id)
+        content = get_content(coll_scope, file_name, content_id=ids[5])
+        assert_equal(str(content.status), 'BAD')
+        content = get_content(coll_scope, file_name, content_id=ids[6])
+        assert_equal(str(content.status), 'SPLITTING')
+        assert_equal(content.object_metadata, {'size': 1})
+
+        for id in ids:
+            delete_content(scope=coll_scope, name=file_name, content_id=id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_claim_contents(self):
+        """ Catalog (CORE): Test claiming contents by priority with leases """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'TOSPLIT', 'priority': i} for i in range(0, 100, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+
+        contents = claim_contents(edge_name, 'TOSPLIT', 'SPLITTING', limit=4, owner='owner1', content_type='PARTIAL')
+        assert_equal([c.priority for c in contents], [90, 80, 70, 60])
+        for content in contents:
+            assert_equal(str(content.status), 'SPLITTING')
+            assert_equal(content.lease_owner, 'owner1')
+            assert_equal(content.lease_expired_at is not None, True)
+
+        contents = claim_contents(edge_name, 'TOSPLIT', 'SPLITTING', limit=2, owner='owner1', edge_id=edge_id,
+                                  columns=['pfn', 'min_id'])
+        assert_equal([c.priority for c in contents], [50, 40])
+        assert_equal(contents[0].keys(), ['content_id', 'edge_id', 'coll_id', 'content_type', 'pfn_size', 'priority',
+                                          'pfn', 'min_id'])
+        assert_equal(hasattr(contents[0], '__dict__'), False)
+
+        contents = claim_contents(edge_name, 'TOSPLIT', 'SPLITTING', limit=10, owner='owner1', edge_id=edge_id)
+        assert_equal([c.priority for c in contents], [30, 20, 10, 0])
+
+        contents = claim_contents(edge_name, 'TOSPLIT', 'SPLITTING', limit=10, owner='owner2', edge_id=edge_id)
+        assert_equal(contents, [])
+
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id, status='SPLITTING')
+        assert_equal(len(contents), 10)
+
+        for content in contents:
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_reclaim_expired_contents(self):
+        """ Catalog (CORE): Test reclaiming contents with expired leases """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'TOSTAGEDOUT', 'priority': i} for i in range(0, 100, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+
+        expired = claim_contents(edge_name, 'TOSTAGEDOUT', 'STAGINGOUT', limit=3, owner='owner1', lease_seconds=-10)
+        leased = claim_contents(edge_name, 'TOSTAGEDOUT', 'STAGINGOUT', limit=3, owner='owner2', lease_seconds=3600)
+
+        # a content left in a leased status without a lease, before the leases
+        add_contents(coll_scope, coll_name, edge_name, [{'scope': 'test_scope', 'name': file_name, 'min_id': 100, 'max_id': 109,
+                                                         'content_type': 'PARTIAL', 'status': 'STAGINGOUT'}])
+        unleased = get_content(coll_scope, file_name, min_id=100, max_id=109, edge_name=edge_name)
+        assert_equal(unleased.lease_expired_at, None)
+
+        num_reclaimed = reclaim_expired_contents({'SPLITTING': 'TOSPLIT'}, edge_id=edge_id)
+        assert_equal(num_reclaimed, 0)
+        # the contents are reclaimed in batches
+        statuses = {'SPLITTING': 'TOSPLIT', 'STAGINGOUT': 'TOSTAGEDOUT'}
+        assert_equal(reclaim_expired_contents(statuses, edge_name=edge_name, limit=3), 3)
+        assert_equal(reclaim_expired_contents(statuses, edge_name=edge_name, limit=3), 1)
+        assert_equal(reclaim_expired_contents(statuses, edge_name=edge_name, limit=3), 0)
+
+        for content in expired + [unleased]:
+            content = get_content(coll_scope, file_name, content_id=content.content_id)
+            assert_equal(str(content.status), 'TOSTAGEDOUT')
+            assert_equal(content.num_failure, 1)
+            assert_equal(content.last_failed_at is not None, True)
+            assert_equal(content.lease_owner, None)
+        for content in leased:
+            content = get_content(coll_scope, file_name, content_id=content.content_id)
+            assert_equal(str(content.status), 'STAGINGOUT')
+            assert_equal(content.num_failure, 0)
+
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id)
+        for content in contents:
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_renew_leases(self):
+        """ Catalog (CORE): Test renewing leases and finishing only the contents still leased """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'TOSTAGEDOUT', 'priority': i} for i in range(0, 40, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+
+        expired = claim_contents(edge_name, 'TOSTAGEDOUT', 'STAGINGOUT', limit=2, owner='owner1', lease_seconds=-10)
+        leased = claim_contents(edge_name, 'TOSTAGEDOUT', 'STAGINGOUT', limit=2, owner='owner2', lease_seconds=-10)
+        leased_ids = [content.content_id for content in leased]
+        expired_ids = [content.content_id for content in expired]
+
+        # the heartbeat of owner2 keeps its leases, the leases of owner1 expire and are claimed by owner3
+        assert_equal(sorted(renew_leases('owner2', leased_ids + expired_ids, lease_seconds=3600)), sorted(leased_ids))
+        assert_equal(reclaim_expired_contents({'STAGINGOUT': 'TOSTAGEDOUT'}, edge_id=edge_id), 2)
+        reclaimed = claim_contents(edge_name, 'TOSTAGEDOUT', 'STAGINGOUT', limit=2, owner='owner3')
+        assert_equal(sorted([content.content_id for content in reclaimed]), sorted(expired_ids))
+        assert_equal(renew_leases('owner1', expired_ids), [])
+
+        finished = dict([(id, {'status': 'AVAILABLE', 'pfn_size': 10, 'lease_owner': None, 'lease_expired_at': None})
+                         for id in leased_ids + expired_ids])
+        assert_equal(update_contents_by_id(dict(finished), lease_owner='owner1'), 0)
+        assert_equal(update_contents_by_id(dict(finished), lease_owner='owner2', with_ids=True), sorted(leased_ids))
+
+        for id in expired_ids:
+            content = get_content(coll_scope, file_name, content_id=id)
+            assert_equal(str(content.status), 'STAGINGOUT')
+            assert_equal(content.lease_owner, 'owner3')
+        for id in leased_ids:
+            content = get_content(coll_scope, file_name, content_id=id)
+            assert_equal(str(content.status), 'AVAILABLE')
+            assert_equal(content.lease_owner, None)
+
+        counters = dict([(str(counter.status), counter.counter) for counter in
+                         get_content_counters(edge_id=edge_id, coll_id=collection_id)])
+        assert_equal(counters.get('AVAILABLE'), 2)
+        assert_equal(counters.get('STAGINGOUT'), 2)
+
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id)
+        for content in contents:
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_iter_contents_by_edge(self):
+        """ Catalog (CORE): Test iterating contents by pages """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'TOSPLIT' if i < 50 else 'AVAILABLE'} for i in range(0, 100, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+
+        contents = list(iter_contents_by_edge(edge_name, collection_scope=coll_scope, collection_name=coll_name, page_size=3))
+        assert_equal(len(contents), 10)
+        assert_equal([c.content_id for c in contents], sorted(c.content_id for c in contents))
+        assert_equal(sorted(c.min_id for c in contents), range(0, 100, 10))
+        assert_equal(str(contents[0].status), 'TOSPLIT')
+
+        contents = list(iter_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id, status='AVAILABLE',
+                                              columns=['min_id', 'max_id'], page_size=5))
+        assert_equal(len(contents), 5)
+        assert_equal(contents[0].keys(), ['content_id', 'min_id', 'max_id'])
+        assert_equal(sorted(c.min_id for c in contents), range(50, 100, 10))
+
+        with assert_raises(exceptions.CoreException):
+            list(iter_contents_by_edge(edge_name, edge_id=edge_id, columns=['unknown']))
+
+        records = get_contents_by_edge(edge_name, edge_id=edge_id, status='AVAILABLE', columns=['status', 'pfn'], limit=3)
+        assert_equal(len(records), 3)
+        assert_equal(records[0].keys(), ['content_id', 'status', 'pfn'])
+        assert_equal(records[0].status, ContentStatus.AVAILABLE)
+        assert_equal(records[0][0], records[0].content_id)
+        content = get_content('test_scope', file_name, min_id=60, max_id=69, edge_id=edge_id, columns=['min_id'])
+        assert_equal(content.min_id, 60)
+        content = get_content_best_match('test_scope', file_name, min_id=61, max_id=62, edge_id=edge_id, columns=['max_id'])
+        assert_equal(content.max_id, 69)
+        assert_equal(get_collection(coll_scope, coll_name, columns=['name']).coll_id, collection_id)
+        with assert_raises(exceptions.NoObject):
+            get_content('test_scope', file_name, min_id=61, max_id=69, edge_id=edge_id, columns=['min_id'])
+        with assert_raises(exceptions.CoreException):
+            get_contents_by_edge(edge_name, edge_id=edge_id, columns=['unknown'])
+
+        # the baked queries of the same shape are reused with other values
+        assert_equal(len(get_contents_by_edge(edge_name, edge_id=edge_id, limit=2)), 2)
+        assert_equal(len(get_contents_by_edge(edge_name, edge_id=edge_id, limit=3)), 3)
+        assert_equal(len(get_contents_by_edge(edge_name, edge_id=edge_id, status='TOSPLIT')), 5)
+        assert_equal(len(get_contents_by_edge(edge_name, edge_id=edge_id, status='AVAILABLE', limit=4)), 4)
+        assert_equal(get_content(file_name, file_name, content_id=contents[1].content_id).min_id, contents[1].min_id)
+        assert_equal(get_content('test_scope', file_name, min_id=60, max_id=69, edge_id=edge_id).min_id, 60)
+
+        for content in get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id):
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_enum_normalize_and_serialize(self):
+        """ Catalog (CORE): Test the enum normalization and the serialization of contents """
+        assert_equal(ContentStatus.normalize('AVAILABLE'), ContentStatus.AVAILABLE)
+        assert_equal(ContentStatus.normalize(u' available '), ContentStatus.AVAILABLE)
+        assert_equal(ContentStatus.normalize(ContentStatus.AVAILABLE), ContentStatus.AVAILABLE)
+        assert_equal(ContentStatus.normalize(None), None)
+        assert_equal(ContentStatus.from_name('AVAILABLE'), ContentStatus.AVAILABLE)
+        with assert_raises(ValueError):
+            ContentStatus.normalize('unknown')
+
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'AVAILABLE'} for i in range(0, 30, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id)
+        content = contents[0].to_dict()
+        assert_equal(content['status'], 'AVAILABLE')
+        assert_equal(content['content_type'], 'PARTIAL')
+        assert_true(isinstance(content['created_at'], str))
+        assert_equal(json.loads(json.dumps(content))['name'], file_name)
+
+        rows = list(iter_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id, columns=['status', 'min_id']))
+        items = list(CollectionContent.rows_to_dicts(rows))
+        assert_equal(len(items), 3)
+        assert_equal(sorted(items[0].keys()), ['content_id', 'min_id', 'status'])
+        assert_equal(set(item['status'] for item in items), set(['AVAILABLE']))
+
+        for content in contents:
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_content_best_match(self):
+        """ Catalog (CORE): Test getting the narrowest content containing a range """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': 0, 'max_id': 99,
+                  'content_type': 'FILE', 'status': 'AVAILABLE'}]
+        files += [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                   'content_type': 'PARTIAL', 'status': 'AVAILABLE' if i < 50 else 'NEW'} for i in range(0, 100, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+
+        for content in (get_content_best_match(coll_scope, file_name, 22, 25, edge_id=edge_id, status='AVAILABLE'),
+                        get_available_content_best_match(coll_scope, file_name, 22, 25, edge_id=edge_id)):
+            assert_equal((content.min_id, content.max_id), (20, 29))
+        for content in (get_content_best_match(coll_scope, file_name, 62, 65, edge_id=edge_id, status='AVAILABLE'),
+                        get_available_content_best_match(coll_scope, file_name, 62, 65, edge_id=edge_id)):
+            assert_equal((content.min_id, content.max_id), (0, 99))
+        content = get_available_content_best_match(coll_scope, file_name, 22, 35, edge_id=edge_id)
+        assert_equal((content.min_id, content.max_id), (0, 99))
+        with assert_raises(exceptions.NoObject):
+            get_available_content_best_match(coll_scope, file_name, 62, 165, edge_id=edge_id)
+
+        content = get_content_best_match(coll_scope, file_name, 62, 65, edge_id=edge_id)
+        assert_equal((content.min_id, content.max_id), (60, 69))
+
+        ranges = [(coll_scope, file_name, 62, 65), (coll_scope, 'not_exist_file', 0, 1),
+                  {'scope': coll_scope, 'name': file_name, 'min_id': 12, 'max_id': 13},
+                  (coll_scope, file_name, 22, 35), (coll_scope, file_name, 62, 165)]
+        contents = get_contents_best_match(ranges, edge_name=edge_name)
+        assert_equal([(c.min_id, c.max_id) if c else None for c in contents], [(60, 69), None, (10, 19), (0, 99), None])
+        contents = get_contents_best_match(ranges, edge_id=edge_id, status='AVAILABLE')
+        assert_equal([(c.min_id, c.max_id) if c else None for c in contents], [(0, 99), None, (10, 19), (0, 99), None])
+
+        # the whole file, as a model or as a record
+        assert_equal(get_content_best_match(coll_scope, file_name, edge_id=edge_id).content_type, ContentType.FILE)
+        content = get_content_best_match(coll_scope, file_name, edge_id=edge_id, columns=['min_id', 'max_id'])
+        assert_equal((content.min_id, content.max_id), (0, 99))
+        add_contents(coll_scope, coll_name, edge_name, [{'scope': 'test_scope', 'name': file_name, 'min_id': 0, 'max_id': 199,
+                                                         'content_type': 'FILE', 'status': 'NEW'}])
+        with assert_raises(MultipleResultsFound):
+            get_content_best_match(coll_scope, file_name, edge_id=edge_id)
+        with assert_raises(MultipleResultsFound):
+            get_content_best_match(coll_scope, file_name, edge_id=edge_id, columns=['min_id', 'max_id'])
+
+        for content in get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id):
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_available_content_range_cache(self):
+        """ Catalog (CORE): Test the cached available contents are loaded again when contents become available """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'AVAILABLE' if i < 50 else 'NEW'} for i in range(0, 100, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+        contents = dict([(c.min_id, c) for c in get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id)])
+
+        ttl = CONTENT_RANGE_CACHE.ttl
+        CONTENT_RANGE_CACHE.ttl = 60
+        try:
+            key = (coll_scope, file_name, edge_id)
+            content = get_available_content_best_match(coll_scope, file_name, 22, 25, edge_id=edge_id)
+            assert_equal((content.min_id, content.max_id), (20, 29))
+            with assert_raises(exceptions.NoObject):
+                get_available_content_best_match(coll_scope, file_name, 62, 65, edge_id=edge_id)
+            stale_tree = CONTENT_RANGE_CACHE.get(key)
+            assert_equal(stale_tree is not None, True)
+
+            # the contents moved to AVAILABLE in this process are not cached anymore
+            update_contents_by_id({contents[60].content_id: {'status': 'AVAILABLE'}})
+            assert_equal(CONTENT_RANGE_CACHE.get(key), None)
+            content = get_available_content_best_match(coll_scope, file_name, 62, 65, edge_id=edge_id)
+            assert_equal((content.min_id, content.max_id), (60, 69))
+
+            # a miss in the contents cached before they were moved to AVAILABLE by another process loads them again
+            update_contents_by_id({contents[70].content_id: {'status': 'AVAILABLE'}})
+            CONTENT_RANGE_CACHE.set(key, stale_tree)
+            content = get_available_content_best_match(coll_scope, file_name, 72, 75, edge_id=edge_id)
+            assert_equal((content.min_id, content.max_id), (70, 79))
+            with assert_raises(exceptions.NoObject):
+                get_available_content_best_match(coll_scope, file_name, 82, 85, edge_id=edge_id)
+        finally:
+            CONTENT_RANGE_CACHE.ttl = ttl
+            CONTENT_RANGE_CACHE.clear()
+
+        for content in get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id):
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    def test_interval_tree(self):
+        """ Catalog (CORE): Test the interval tree best match """
+        intervals = [(0, 999, 'file')] + [(i, i + 9, i) for i in range(0, 1000, 10)] + [(100, 199, 'block')]
+        tree = IntervalTree(intervals)
+        assert_equal(tree.best_match(0, 5), 0)
+        assert_equal(tree.best_match(995, 999), 990)
+        assert_equal(tree.best_match(105, 125), 'block')
+        assert_equal(tree.best_match(195, 205), 'file')
+        assert_equal(tree.best_match(995, 1005), None)
+        assert_equal(IntervalTree([]).best_match(0, 1), None)
+        assert_equal(IntervalTree([(0, 9, 'a'), (0, 9, 'b')]).best_match(0, 9), 'a')
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_content_counters(self):
+        """ Catalog (CORE): Test the content counters maintained by the write paths """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        def statistics():
+            return dict([((str(s.content_type), str(s.status)), (s.counter, s.bytes))
+                         for s in get_contents_statistics(edge_name, coll_id=collection_id)])
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'TOSTAGEDOUT', 'pfn_size': 10} for i in range(0, 100, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+        add_contents(coll_scope, coll_name, edge_name, files[-2:] + [{'scope': 'test_scope', 'name': file_name, 'min_id': 0, 'max_id': 99,
+                                                                      'content_type': 'FILE', 'status': 'AVAILABLE', 'pfn_size': 100}])
+        assert_equal(statistics(), {('PARTIAL', 'TOSTAGEDOUT'): (10, 100), ('FILE', 'AVAILABLE'): (1, 100)})
+
+        contents = claim_contents(edge_name, 'TOSTAGEDOUT', 'STAGINGOUT', limit=4, owner='owner1', lease_seconds=-10)
+        update_contents_by_id({contents[0].content_id: {'status': 'AVAILABLE', 'pfn_size': 20},
+                               contents[1].content_id: {'status': 'AVAILABLE', 'pfn_size': 20},
+                               contents[2].content_id: {'priority': 10}})
+        reclaim_expired_contents({'STAGINGOUT': 'TOSTAGEDOUT'}, edge_id=edge_id)
+        update_content(coll_scope, file_name, 0, 99, edge_id=edge_id, parameters={'status': 'REMOVED'})
+        delete_content(scope=coll_scope, name=file_name, content_id=contents[0].content_id)
+        assert_equal(statistics(), {('PARTIAL', 'TOSTAGEDOUT'): (8, 80), ('PARTIAL', 'AVAILABLE'): (1, 20),
+                                    ('FILE', 'REMOVED'): (1, 100)})
+        assert_equal(reconcile_content_counters(edge_id=edge_id, coll_id=collection_id), 0)
+
+        update_content_counters({(edge_id, collection_id, ContentType.PARTIAL, ContentStatus.AVAILABLE): [5, 0],
+                                 (edge_id, collection_id, ContentType.PARTIAL, ContentStatus.NEW): [1, 1]})
+        assert_equal(reconcile_content_counters(edge_id=edge_id), 2)
+        assert_equal(statistics(), {('PARTIAL', 'TOSTAGEDOUT'): (8, 80), ('PARTIAL', 'AVAILABLE'): (1, 20),
+                                    ('FILE', 'REMOVED'): (1, 100)})
+
+        for content in get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id):
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        assert_equal(statistics(), {})
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_archive_contents(self):
+        """ Catalog (CORE): Test moving the finished contents to the archive table """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9, 'content_type': 'PARTIAL',
+                  'status': 'REMOVED' if i < 30 else 'AVAILABLE', 'pfn_size': 10} for i in range(0, 50, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+
+        # the contents were updated recently
+        assert_equal(archive_contents(edge_id=edge_id), 0)
+        assert_equal(archive_contents(edge_id=edge_id, older_than=-10, limit=2), 2)
+        assert_equal(archive_contents(edge_id=edge_id, older_than=-10), 1)
+        assert_equal(archive_contents(edge_id=edge_id, older_than=-10), 0)
+
+        contents = get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id)
+        assert_equal(sorted(c.min_id for c in contents), [30, 40])
+        statistics = dict([(str(s.status), (s.counter, s.bytes)) for s in get_contents_statistics(edge_name, coll_id=collection_id)])
+        assert_equal(statistics, {'AVAILABLE': (2, 20)})
+        assert_equal(reconcile_content_counters(edge_id=edge_id, coll_id=collection_id), 0)
+
+        with unit_of_work():
+            archived = get_unit_session().query(CollectionContentArchive).filter_by(edge_id=edge_id).all()
+        assert_equal(sorted(c.min_id for c in archived), [0, 10, 20])
+        assert_equal(set(str(c.status) for c in archived), set(['REMOVED']))
+        assert_true(purge_archives(older_than=-10) >= 3)
+
+        for content in contents:
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_collection_completeness(self):
+        """ Catalog (CORE): Test the transferring and replicated files of collection replicas """
+        edge_name = 'test_rse_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name, edge_type='EDGE', status='ACTIVE')
+
+        coll_scope, coll_name = 'test_scope', 'test_name_%s' % str(uuid())
+        collection_id = add_collection(scope=coll_scope, name=coll_name)
+
+        file_name = 'test_name_%s' % str(uuid())
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': 0, 'max_id': 99,
+                  'content_type': 'FILE', 'status': 'PRECACHED'}]
+        add_contents(coll_scope, coll_name, edge_name, files)
+        assert_equal(is_collection_complete(collection_id, edge_id), False)
+        assert_equal(is_collection_complete(collection_id, edge_id, content_type='FILE'), False)
+
+        update_collection_replicas_requests(collection_id, edge_id)
+        update_collection_replicas_requests(collection_id, edge_id)
+        replicas = get_collection_replicas(coll_scope, coll_name, edge_name)
+        assert_equal((replicas.transferring_files, replicas.replicated_files, replicas.num_active_requests), (0, 0, 2))
+
+        files = [{'scope': 'test_scope', 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                  'content_type': 'PARTIAL', 'status': 'TOSPLIT'} for i in range(0, 100, 10)]
+        add_contents(coll_scope, coll_name, edge_name, files)
+        contents = claim_contents(edge_name, 'TOSPLIT', 'SPLITTING', limit=100)
+        update_contents_by_id(dict([(c.content_id, {'status': 'AVAILABLE'}) for c in contents[:8]]))
+        replicas = get_collection_replicas(coll_scope, coll_name, edge_name)
+        assert_equal((replicas.transferring_files, replicas.replicated_files), (2, 8))
+        assert_equal(is_collection_complete(collection_id, edge_id, content_type='PARTIAL'), False)
+
+        # a bad file is not available, the collection is not complete
+        update_contents_by_id({contents[8].content_id: {'status': 'AVAILABLE'}, contents[9].content_id: {'status': 'BAD'}})
+        assert_equal(is_collection_complete(collection_id, edge_id, content_type='PARTIAL'), False)
+
+        update_contents_by_id({contents[9].content_id: {'status': 'AVAILABLE'}})
+        assert_equal(is_collection_complete(collection_id, edge_id, content_type='PARTIAL'), True)
+        # the whole file is only precached
+        assert_equal(is_collection_complete(collection_id, edge_id, content_type='FILE'), False)
+        assert_equal(is_collection_complete(collection_id, edge_id), False)
+
+        update_collection_replicas(coll_scope, coll_name, edge_name, parameters={'replicated_files': 0})
+        assert_equal(reconcile_content_counters(coll_id=collection_id), 1)
+        replicas = get_collection_replicas(coll_scope, coll_name, edge_name)
+        assert_equal((replicas.transferring_files, replicas.replicated_files), (0, 10))
+
+        update_collection_replicas_requests(collection_id, edge_id, num_requests=-1)
+        replicas = get_collection_replicas(coll_scope, coll_name, edge_name)
+        assert_equal((replicas.transferring_files, replicas.replicated_files, replicas.num_active_requests), (0, 10, 1))
+
+        delete_collection_replicas(coll_scope, coll_name, edge_name)
+        assert_equal(is_collection_complete(collection_id, edge_id, content_type='PARTIAL'), True)
+        for content in get_contents_by_edge(edge_name, edge_id=edge_id, coll_id=collection_id):
+            delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+        assert_equal(is_collection_complete(collection_id, edge_id, content_type='PARTIAL'), False)
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_unit_of_work(self):
+        """ Catalog (CORE): Test the decorated calls sharing the session of a unit of work """
+        coll_scope, coll_name = 'test_scope', 'test_coll_%s' % str(uuid())
+        assert_equal(get_unit_session(), None)
+
+        with unit_of_work() as unit:
+            session = get_unit_session()
+            with unit_of_work() as nested_unit:
+                assert_equal(nested_unit is unit, True)
+                assert_equal(get_unit_session() is session, True)
+            collection_id = add_collection(scope=coll_scope, name=coll_name)
+            coll = get_collection(coll_scope, coll_name)
+            assert_equal(coll.coll_id, collection_id)
+            assert_equal(coll in session, False)
+            assert_equal(unit.connection.closed, False)
+        assert_equal(get_unit_session(), None)
+        assert_equal(unit.connection, None)
+
+        # the transactional calls commit at their end, an error of the unit does not roll them back
+        with assert_raises(ValueError):
+            with unit_of_work():
+                update_collection(coll_scope, coll_name, parameters={'total_files': 5})
+                raise ValueError('abort the unit')
+        assert_equal(get_unit_session(), None)
+        assert_equal(get_collection(coll_scope, coll_name).total_files, 5)
+
+        # a read raising NoObject does not roll back the pending work of the unit
+        with unit_of_work():
+            table = Collection.__table__
+            get_unit_session().execute(table.update().where(table.c.coll_id == collection_id).values(total_files=7))
+            with assert_raises(exceptions.NoObject):
+                get_collection(coll_scope, 'not_exist_%s' % str(uuid()))
+        assert_equal(get_collection(coll_scope, coll_name).total_files, 7)
+
+        delete_collection(scope=coll_scope, name=coll_name, coll_id=collection_id)
@@ -16,12 +16,18 @@ Test Edge.
 import unittest2 as unittest
 from uuid import uuid4 as uuid
 from nose.tools import assert_equal, assert_raises, assert_true
+from sqlalchemy.exc import TimeoutError
 
 from ess.client.client import Client
 from ess.common import exceptions
 from ess.common.utils import check_rest_host, get_rest_host, check_database, check_user_proxy, has_config
+from ess.core.cache import EDGE_ID_CACHE, TTLCache
 from ess.core.edges import register_edge, get_edge, get_edge_id, update_edge, delete_edge, get_edges
 from ess.core.utils import render_json
+from ess.common.config import config_get
+from ess.orm import session as orm_session
+from ess.orm.session import ReplicaSet, get_pool_stats
+from ess.orm.telemetry import PoolTelemetry
 
 
 class TestEdge(unittest.TestCase):
@@ -91,6 +97,99 @@ class TestEdge(unittest.TestCase):
         with assert_raises(exceptions.NoObject):
             get_edge(edge_name)
 
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_edge_id_cache_core(self):
+        """ Edge (CORE): Test the cache of edge ids """
+        edge_name = 'test_edge_%s' % str(uuid())
+        edge_name = edge_name[:29]
+        edge_id = register_edge(edge_name)
+
+        stats = EDGE_ID_CACHE.stats()
+        assert_equal(get_edge_id(edge_name), edge_id)
+        assert_equal(get_edge_id(edge_name), edge_id)
+        assert_equal(EDGE_ID_CACHE.stats()['misses'], stats['misses'] + 1)
+        assert_equal(EDGE_ID_CACHE.stats()['hits'], stats['hits'] + 1)
+
+        delete_edge(edge_name)
+        with assert_raises(exceptions.NoObject):
+            get_edge_id(edge_name)
+
+    def test_ttl_cache(self):
+        """ Edge (CORE): Test the TTL cache expiration and eviction """
+        cache = TTLCache(ttl=600, max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert_equal(cache.get('a'), 1)
+        cache.set('c', 3)
+        assert_equal(cache.get('b'), None)
+        assert_equal(cache.get('a'), 1)
+        assert_equal(cache.get('c'), 3)
+        cache.invalidate_value(3)
+        assert_equal(cache.get('c', 'default'), 'default')
+        assert_equal(cache.stats()['evictions'], 1)
+
+        cache = TTLCache(ttl=-1)
+        cache.set('a', 1)
+        assert_equal(cache.get('a'), None)
+
+    def test_pool_telemetry(self):
+        """ Edge (CORE): Test the checkout latency histogram of the pool telemetry """
+        telemetry = PoolTelemetry(buckets=(1, 10))
+        telemetry.record_latency(0.0005)
+        telemetry.record_latency(0.005)
+        telemetry.record_latency(0.05)
+        telemetry.record_timeout()
+        telemetry.on_checkout(None, None, None)
+        telemetry.on_checkout(None, None, None)
+        telemetry.on_checkin(None, None)
+        stats = telemetry.stats()
+        assert_equal(stats['checkout_latency']['histogram'], {'<=1ms': 1, '<=10ms': 1, '>10ms': 1})
+        assert_equal(stats['checkout_latency']['max_ms'], 50)
+        assert_equal((stats['timed_checkouts'], stats['checkouts'], stats['timeouts']), (3, 2, 1))
+        assert_equal((stats['checked_out'], stats['max_checked_out']), (1, 2))
+
+        def timeout():
+            raise TimeoutError('QueuePool limit reached')
+        with assert_raises(TimeoutError):
+            telemetry.timed_checkout(timeout)
+        assert_equal(telemetry.timed_checkout(lambda: 'connection'), 'connection')
+        stats = telemetry.stats()
+        assert_equal((stats['timed_checkouts'], stats['timeouts']), (4, 2))
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_pool_stats_core(self):
+        """ Edge (CORE): Test the statistics of the connection pool """
+        checkouts, timed_checkouts = get_pool_stats()['checkouts'], get_pool_stats()['timed_checkouts']
+        get_edges()
+        stats = get_pool_stats()
+        assert_equal(stats['checkouts'], checkouts + 1)
+        assert_equal(stats['timed_checkouts'], timed_checkouts + 1)
+        assert_equal(stats['checked_out'], 0)
+        assert_true('status' in stats)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_read_replicas_core(self):
+        """ Edge (CORE): Test the reads routed to the replicas with the fallback to the primary database """
+        edge_name = ('test_edge_%s' % str(uuid()))[:29]
+        register_edge(edge_name)
+
+        primary_replicas = orm_session.REPLICAS
+        # a replica which cannot be opened and a replica of the same database
+        orm_session.REPLICAS = ReplicaSet(['sqlite:////nonexistent/ess.db', config_get('database', 'default')], retry_interval=600)
+        try:
+            assert_equal(get_edge(edge_name).edge_name, edge_name)
+            assert_equal(get_edge(edge_name).edge_name, edge_name)
+            assert_equal(get_edge(edge_name, read_your_writes=True).edge_name, edge_name)
+            stats = get_pool_stats()['replicas']
+            assert_equal([(s['reads'], s['failures'], s['healthy']) for s in stats], [(1, 1, False), (1, 0, True)])
+            assert_equal(stats[0]['replica'], 'sqlite:////nonexistent/ess.db')
+        finally:
+            orm_session.REPLICAS = primary_replicas
+        delete_edge(edge_name)
+
     @unittest.skipIf(not has_config(), "No config file")
     @unittest.skipIf(not check_user_proxy(), "No user proxy to access REST")
     @unittest.skipIf(not check_rest_host(), "REST host is not defined")
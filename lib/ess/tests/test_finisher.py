@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Test Finisher.
+"""
+
+import unittest2 as unittest
+from uuid import uuid4 as uuid
+from nose.tools import assert_equal
+
+from ess.common import exceptions
+from ess.common.utils import check_database, has_config
+from ess.core.catalog import (add_collection, add_contents, delete_collection, delete_collection_replicas, delete_content,
+                              get_contents_by_edge)
+from ess.core.edges import delete_edge, get_edge_id, register_edge
+from ess.core.requests import add_request, delete_request, get_request
+from ess.daemons.finisher.daemon import Finisher
+
+
+class HeadClient(object):
+    """
+    Head service client failing to add the contents of some collections.
+    """
+
+    def __init__(self, failing_names):
+        self.failing_names = failing_names
+        self.synced_names = []
+
+    def add_contents(self, collection_scope, collection_name, edge_name, contents):
+        if collection_name in self.failing_names:
+            raise exceptions.RestException('Failed to add the contents of %s' % collection_name)
+        self.synced_names.append(collection_name)
+
+
+class TestFinisher(unittest.TestCase):
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_finish_local_requests(self):
+        """ Finisher (DAEMON): Test that a failed synchronization does not undo the requests finished before """
+        head_client = HeadClient([])
+        finisher = Finisher(head_client=head_client, send_messaging=False)
+        try:
+            edge_id, registered = get_edge_id(finisher.resource_name), False
+        except exceptions.NoObject:
+            edge_id, registered = register_edge(finisher.resource_name), True
+
+        names, coll_ids, request_ids = [], [], []
+        for i in range(2):
+            name = 'test_name_%s' % str(uuid())
+            coll_id = add_collection(scope='test_scope', name=name)
+            add_contents('test_scope', name, finisher.resource_name,
+                         [{'scope': 'test_scope', 'name': 'test_file_%s' % str(uuid()), 'min_id': 0, 'max_id': 99,
+                           'content_type': 'FILE', 'status': 'AVAILABLE'}])
+            request_ids.append(add_request(scope='test_scope', name=name, granularity_type='FILE', edge_id=edge_id,
+                                           status='SPLITTING', processing_meta={'coll_id': coll_id}))
+            names.append(name)
+            coll_ids.append(coll_id)
+
+        head_client.failing_names.append(names[1])
+        finisher.finish_local_requests()
+        assert_equal(head_client.synced_names, [names[0]])
+        assert_equal([str(get_request(request_id=request_id).status) for request_id in request_ids],
+                     ['AVAILABLE', 'SPLITTING'])
+
+        # the request is finished once its contents are synchronized
+        head_client.failing_names = []
+        finisher.finish_local_requests()
+        assert_equal(head_client.synced_names, names)
+        assert_equal(str(get_request(request_id=request_ids[1]).status), 'AVAILABLE')
+
+        for request_id in request_ids:
+            delete_request(request_id)
+        for name, coll_id in zip(names, coll_ids):
+            delete_collection_replicas('test_scope', name, finisher.resource_name, coll_id=coll_id, edge_id=edge_id)
+            for content in get_contents_by_edge(finisher.resource_name, edge_id=edge_id, coll_id=coll_id):
+                delete_content(scope=content.scope, name=content.name, content_id=content.content_id)
+            delete_collection(scope='test_scope', name=name, coll_id=coll_id)
+        if registered:
+            delete_edge(finisher.resource_name)
@@ -13,7 +13,10 @@
 Test Request.
 """
 
+import datetime
 import json
+import threading
+from StringIO import StringIO
 
 import unittest2 as unittest
 from uuid import uuid4 as uuid
@@ -21,9 +24,17 @@ from nose.tools import assert_equal, assert_raises
 
 from ess.client.client import Client
 from ess.common import exceptions
-from ess.common.utils import check_rest_host, get_rest_host, check_database, check_user_proxy, has_config
-from ess.core.requests import add_request, get_request, update_request, delete_request
-from ess.orm.types import GUID
+from ess.common.utils import check_rest_host, get_rest_host, check_database, check_user_proxy, has_config, iter_json_array
+from ess.core.archive import archive_requests, purge_archives
+from ess.core.edges import register_edge, delete_edge
+from ess.core.requests import (add_request, add_requests, get_request, get_requests, get_subscriptions, transition_requests,
+                               update_request, delete_request)
+from ess.core.transitions import (MAX_STAGE_PERIOD, flush_transitions, get_stage_durations, get_transitions, purge_transitions,
+                                  record_transitions, set_transition_daemon)
+from ess.orm import models, types
+from ess.orm.constants import RequestStatus
+from ess.orm.session import get_session
+from ess.orm.types import GUID, set_json_codec
 
 
 class TestRequest(unittest.TestCase):
@@ -83,6 +94,397 @@ class TestRequest(unittest.TestCase):
         with assert_raises(exceptions.NoObject):
             get_request(request_id=request_id)
 
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_request_metadata_core(self):
+        """ Request (CORE): Test the json codec and the deferred metadata of Requests """
+        default_codec = types.JSON_CODEC
+        try:
+            assert_equal(set_json_codec('json').name, 'json')
+            with assert_raises(exceptions.ESSException):
+                set_json_codec('not_a_json_library')
+        finally:
+            types.JSON_CODEC = default_codec
+
+        edge_name = ('test_edge_%s' % str(uuid()))[:29]
+        edge_id = register_edge(edge_name)
+        request_meta = {'taskid': 975, 'files': ['file_%s' % i for i in range(200)]}
+        request_id = add_request(scope='test_scope', name='test_name_%s' % str(uuid()), data_type='DATASET',
+                                 granularity_type='FILE', granularity_level=1, edge_id=edge_id, status='NEW',
+                                 request_meta=request_meta, processing_meta={'coll_id': 1})
+
+        request = get_requests(edge_id=edge_id)[0]
+        assert_equal(request.request_meta, request_meta)
+        assert_equal(request.processing_meta, {'coll_id': 1})
+
+        request = get_requests(edge_id=edge_id, with_metadata=False)[0]
+        assert_equal(request.request_id, request_id)
+        assert_equal(str(request.status), 'NEW')
+        assert_equal('request_meta' in request.to_dict(), False)
+        json.dumps(request.to_dict())
+
+        request = get_requests(edge_id=edge_id, status='NEW', columns=['status', 'priority'])[0]
+        assert_equal(request.keys(), ['request_id', 'status', 'priority'])
+        assert_equal(request.request_id, request_id)
+        assert_equal(get_request(request_id=request_id, columns=['processing_meta']).processing_meta, {'coll_id': 1})
+
+        # only the finished requests are archived
+        assert_equal(archive_requests(edge_id=edge_id, older_than=-10), 0)
+        update_request(request_id, {'status': 'AVAILABLE'})
+        assert_equal(archive_requests(edge_id=edge_id), 0)
+        assert_equal(archive_requests(edge_id=edge_id, older_than=-10), 1)
+        with assert_raises(exceptions.NoObject):
+            get_request(request_id=request_id)
+        purge_archives(older_than=-10)
+
+        delete_request(request_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_get_requests_by_priority_core(self):
+        """ Request (CORE): Test getting requests by priority in pages """
+        edge_name = ('test_edge_%s' % str(uuid()))[:29]
+        edge_id = register_edge(edge_name)
+        request_ids = []
+        for priority in [1, 5, 5, 3, 9, 1, 5]:
+            request_ids.append(add_request(scope='test_scope', name='test_name_%s' % str(uuid()), data_type='DATASET',
+                                           granularity_type='FILE', granularity_level=1, priority=priority,
+                                           edge_id=edge_id, status='NEW'))
+        expected = [request_ids[i] for i in [4, 1, 2, 6, 3, 0, 5]]
+
+        requests = get_requests(edge_id=edge_id, status='NEW', order_by_priority=True)
+        assert_equal([request.request_id for request in requests], expected)
+
+        for columns in (None, ['priority']):
+            pages = []
+            after = None
+            while True:
+                page = get_requests(edge_id=edge_id, status='NEW', limit=3, after=after, columns=columns)
+                pages.append([request.request_id for request in page])
+                if len(page) < 3:
+                    break
+                after = (page[-1].priority, page[-1].request_id)
+            assert_equal(pages, [expected[:3], expected[3:6], expected[6:]])
+
+        # the requests without a priority have priority 0, and are fetched after the others
+        request_ids.append(add_request(scope='test_scope', name='test_name_%s' % str(uuid()), data_type='DATASET',
+                                       granularity_type='FILE', granularity_level=1, priority=None,
+                                       edge_id=edge_id, status='NEW'))
+        request_ids.append(add_request(scope='test_scope', name='test_name_%s' % str(uuid()), data_type='DATASET',
+                                       granularity_type='FILE', granularity_level=1, priority=2,
+                                       edge_id=edge_id, status='NEW'))
+        update_request(request_ids[-1], {'priority': None})
+        assert_equal([get_request(request_id=request_id).priority for request_id in request_ids[-2:]], [0, 0])
+        page = get_requests(edge_id=edge_id, status='NEW', limit=3, after=(1, expected[-1]))
+        assert_equal([request.request_id for request in page], request_ids[-2:])
+        page = get_requests(edge_id=edge_id, status='NEW', limit=3, after=(None, request_ids[-2]))
+        assert_equal([request.request_id for request in page], request_ids[-1:])
+
+        for request_id in request_ids:
+            delete_request(request_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_transition_requests_core(self):
+        """ Request (CORE): Test the guarded transitions of Requests """
+        edge_name = ('test_edge_%s' % str(uuid()))[:29]
+        edge_id = register_edge(edge_name)
+        request_ids = []
+        for status in ['NEW', 'NEW', 'ASSIGNED', 'NEW']:
+            request_ids.append(add_request(scope='test_scope', name='test_name_%s' % str(uuid()), data_type='DATASET',
+                                           granularity_type='FILE', granularity_level=1, edge_id=edge_id, status=status))
+
+        ids = [request_ids[3], request_ids[0], request_ids[2], request_ids[0], 999999999]
+        transitioned = transition_requests(ids, 'NEW', 'BROKERING', parameters={'errors': {'message': 'test'}, 'priority': 7})
+        assert_equal(transitioned, [request_ids[3], request_ids[0]])
+        request = get_request(request_id=request_ids[0])
+        assert_equal(str(request.status), 'BROKERING')
+        assert_equal(request.errors, {'message': 'test'})
+        assert_equal(request.priority, 7)
+        assert_equal(str(get_request(request_id=request_ids[2]).status), 'ASSIGNED')
+
+        # the requests are transitioned only once
+        assert_equal(transition_requests(request_ids, 'NEW', 'BROKERING'), [request_ids[1]])
+        assert_equal(transition_requests(request_ids, 'NEW', 'BROKERING'), [])
+        assert_equal(transition_requests([], 'NEW', 'BROKERING'), [])
+        assert_equal(transition_requests(request_ids[:2], 'BROKERING', 'ASSIGNING'), request_ids[:2])
+
+        for request_id in request_ids:
+            delete_request(request_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_request_subscriptions_core(self):
+        """ Request (CORE): Test the coalescing of the requests for the same data """
+        edge_name = ('test_edge_%s' % str(uuid()))[:29]
+        edge_id = register_edge(edge_name)
+        properties = {'scope': 'test_scope', 'name': 'test_name_%s' % str(uuid()), 'data_type': 'DATASET',
+                      'granularity_type': 'PARTIAL', 'granularity_level': 100, 'status': 'NEW'}
+
+        primary_id = add_request(priority=1, coalesce=True, **properties)
+        subscriber_id = add_request(priority=5, coalesce=True, **properties)
+        other_id = add_request(coalesce=True, **dict(properties, granularity_level=10))
+        uncoalesced_id = add_request(**properties)
+        assert_equal(str(get_request(request_id=primary_id).status), 'NEW')
+        assert_equal(str(get_request(request_id=subscriber_id).status), 'SUBSCRIBED')
+        assert_equal(str(get_request(request_id=other_id).status), 'NEW')
+        assert_equal(str(get_request(request_id=uncoalesced_id).status), 'NEW')
+        assert_equal(get_subscriptions(primary_id), [subscriber_id])
+        # the primary request gets the priority of its subscribers
+        assert_equal(get_request(request_id=primary_id).priority, 5)
+
+        # the subscribed requests are completed with the primary request
+        assert_equal(transition_requests([primary_id], 'NEW', 'SPLITTING'), [primary_id])
+        assert_equal(str(get_request(request_id=subscriber_id).status), 'SUBSCRIBED')
+        update_request(primary_id, {'status': 'AVAILABLE', 'edge_id': edge_id, 'processing_meta': {'coll_id': 1}})
+        subscriber = get_request(request_id=subscriber_id)
+        assert_equal(str(subscriber.status), 'AVAILABLE')
+        assert_equal(subscriber.edge_id, edge_id)
+        assert_equal(subscriber.processing_meta, {'coll_id': 1, 'primary_request_id': primary_id})
+        assert_equal(get_subscriptions(primary_id), [])
+
+        # the finished requests are not subscribed to
+        assert_equal(transition_requests([uncoalesced_id], 'NEW', 'AVAILABLE'), [uncoalesced_id])
+        request_ids = [add_request(coalesce=True, **properties) for i in range(3)]
+        assert_equal([str(get_request(request_id=request_id).status) for request_id in request_ids],
+                     ['NEW', 'SUBSCRIBED', 'SUBSCRIBED'])
+
+        # when a primary request is deleted, its oldest subscribed request is processed instead
+        delete_request(request_ids[0])
+        assert_equal(str(get_request(request_id=request_ids[1]).status), 'NEW')
+        assert_equal(get_subscriptions(request_ids[1]), [request_ids[2]])
+        transitioned_ids, subscribers = transition_requests([request_ids[1]], 'NEW', 'ERROR', with_subscribers=True,
+                                                            parameters={'errors': {'message': 'test'}})
+        assert_equal(transitioned_ids, [request_ids[1]])
+        assert_equal([(item['request_id'], item['primary_request_id'], str(item['status']))
+                      for item in subscribers], [(request_ids[2], request_ids[1], 'ERROR')])
+        subscriber = get_request(request_id=request_ids[2])
+        assert_equal(str(subscriber.status), 'ERROR')
+        assert_equal(subscriber.errors, {'message': 'test'})
+
+        # the requests subscribed to a request leaving the pipeline without finishing are completed with it
+        request_ids += [add_request(coalesce=True, **dict(properties, request_meta={'taskid': i})) for i in range(2)]
+        assert_equal(get_subscriptions(request_ids[3]), [request_ids[4]])
+        assert_equal(transition_requests([request_ids[3]], 'NEW', 'BROKERING'), [request_ids[3]])
+        update_request(request_ids[3], {'status': 'WAITING', 'errors': {'message': 'No edges available'}})
+        subscriber = get_request(request_id=request_ids[4])
+        assert_equal(str(subscriber.status), 'WAITING')
+        assert_equal(subscriber.request_meta, {'taskid': 1})
+        assert_equal(get_subscriptions(request_ids[3]), [])
+        # and the new requests for the data are not subscribed to it
+        request_ids.append(add_request(coalesce=True, **properties))
+        assert_equal(str(get_request(request_id=request_ids[5]).status), 'NEW')
+
+        for request_id in [primary_id, subscriber_id, other_id, uncoalesced_id] + request_ids[1:]:
+            delete_request(request_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_archive_request_links_core(self):
+        """ Request (CORE): Test that the data keys and the subscriptions of the archived requests are deleted """
+        edge_name = ('test_edge_%s' % str(uuid()))[:29]
+        edge_id = register_edge(edge_name)
+        properties = {'scope': 'test_scope', 'name': 'test_name_%s' % str(uuid()), 'data_type': 'DATASET',
+                      'granularity_type': 'PARTIAL', 'granularity_level': 100, 'status': 'NEW', 'edge_id': edge_id}
+        primary_id = add_request(coalesce=True, **properties)
+        subscriber_id = add_request(coalesce=True, **properties)
+        assert_equal(get_subscriptions(primary_id), [subscriber_id])
+
+        def get_links():
+            session = get_session()
+            data_keys = session.query(models.RequestDataKey).filter_by(name=properties['name']).all()
+            subscriptions = session.query(models.RequestSubscription)\
+                .filter(models.RequestSubscription.primary_request_id.in_([primary_id, subscriber_id])).all()
+            session.remove()
+            return [key.request_id for key in data_keys], [item.request_id for item in subscriptions]
+
+        update_request(primary_id, {'status': 'AVAILABLE'})
+        # a subscription left behind, by a status set without completing the subscribed requests
+        session = get_session()
+        models.RequestSubscription(request_id=subscriber_id, primary_request_id=primary_id).save(session=session)
+        session.commit()
+        session.remove()
+        assert_equal(get_links(), ([primary_id], [subscriber_id]))
+
+        assert_equal(archive_requests(edge_id=edge_id, older_than=-10), 2)
+        assert_equal(get_links(), ([], []))
+        # the data is submitted again as for the first time
+        request_id = add_request(coalesce=True, **properties)
+        assert_equal(str(get_request(request_id=request_id).status), 'NEW')
+        assert_equal(get_links(), ([request_id], []))
+
+        purge_archives(older_than=-10)
+        delete_request(request_id)
+        delete_edge(edge_name)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_add_requests_core(self):
+        """ Request (CORE): Test the addition of requests in bulk """
+        name = 'test_name_%s' % str(uuid())
+        properties = {'scope': 'test_scope', 'name': name, 'data_type': 'DATASET', 'granularity_type': 'PARTIAL',
+                      'granularity_level': 100, 'priority': 1, 'request_meta': {'taskid': 1}}
+        primary_id = add_request(coalesce=True, **properties)
+
+        requests = [dict(properties, request_meta={'taskid': 2}, priority=7),
+                    dict(properties, request_meta={'taskid': 2}, priority=7),
+                    dict(properties),
+                    dict(properties, name=name + '_other', status='AVAILABLE', request_meta={'taskid': 4}),
+                    dict(properties, name=name + '_other'),
+                    dict(properties, name=name + '_other', request_meta={'taskid': 3}),
+                    dict(properties, data_type='UNKNOWN'),
+                    dict(properties, name=None),
+                    dict(properties, priority='high'),
+                    dict(properties, unknown=1),
+                    'not a request']
+        results = add_requests(requests, coalesce=True, chunk_size=2)
+        assert_equal([result['result'] for result in results],
+                     ['created', 'duplicate', 'duplicate', 'created', 'created', 'created'] + ['invalid'] * 5)
+        assert_equal(results[1]['request_id'], results[0]['request_id'])
+        assert_equal(results[2]['request_id'], primary_id)
+        assert_equal(results[0]['primary_request_id'], primary_id)
+        assert_equal(results[5]['primary_request_id'], results[4]['request_id'])
+        assert_equal(get_subscriptions(primary_id), [results[0]['request_id']])
+        assert_equal(get_request(request_id=primary_id).priority, 7)
+        assert_equal([str(get_request(request_id=results[i]['request_id']).status) for i in (0, 3, 4, 5)],
+                     ['SUBSCRIBED', 'AVAILABLE', 'NEW', 'SUBSCRIBED'])
+        assert_equal(get_request(request_id=results[4]['request_id']).request_meta, {'taskid': 1})
+
+        # without coalescing, only the repeated requests of the list are duplicates
+        results += add_requests([dict(properties), dict(properties)])
+        assert_equal([result['result'] for result in results[-2:]], ['created', 'duplicate'])
+        assert_equal(str(get_request(request_id=results[-1]['request_id']).status), 'NEW')
+
+        for request_id in set([result['request_id'] for result in results if result['request_id']] + [primary_id]):
+            delete_request(request_id)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_concurrent_request_subscriptions_core(self):
+        """ Request (CORE): Test the coalescing of concurrent first submissions of the same data """
+        properties = {'scope': 'test_scope', 'name': 'test_name_%s' % str(uuid()), 'data_type': 'DATASET',
+                      'granularity_type': 'FILE', 'status': 'NEW'}
+
+        def submit(index, request_ids, errors, start):
+            start.wait()
+            try:
+                if index % 2:
+                    request_ids.append(add_request(coalesce=True, request_meta={'taskid': index}, **properties))
+                else:
+                    results = add_requests([dict(properties, request_meta={'taskid': index})], coalesce=True)
+                    request_ids.append(results[0]['request_id'])
+            except Exception as error:
+                errors.append(error)
+
+        def submit_all(num_threads=6):
+            request_ids, errors, start = [], [], threading.Event()
+            threads = [threading.Thread(target=submit, args=(index, request_ids, errors, start)) for index in range(num_threads)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+            assert_equal(errors, [])
+            return sorted(request_ids)
+
+        # only one of the first submissions is processed, the others subscribe to it
+        request_ids = submit_all()
+        statuses = [str(get_request(request_id=request_id).status) for request_id in request_ids]
+        assert_equal(sorted(statuses), ['NEW'] + ['SUBSCRIBED'] * 5)
+        primary_id = request_ids[statuses.index('NEW')]
+        assert_equal(get_subscriptions(primary_id), [request_id for request_id in request_ids if request_id != primary_id])
+
+        # when the primary request left the pipeline, one of the next submissions becomes the primary request
+        assert_equal(transition_requests([primary_id], 'NEW', 'AVAILABLE'), [primary_id])
+        next_ids = submit_all()
+        statuses = [str(get_request(request_id=request_id).status) for request_id in next_ids]
+        assert_equal(sorted(statuses), ['NEW'] + ['SUBSCRIBED'] * 5)
+        assert_equal(len(get_subscriptions(next_ids[statuses.index('NEW')])), 5)
+
+        for request_id in request_ids + next_ids:
+            delete_request(request_id)
+
+    @unittest.skipIf(not has_config(), "No config file")
+    @unittest.skipIf(not check_database(), "Database is not defined")
+    def test_request_transitions_core(self):
+        """ Request (CORE): Test the timing of the request stages from the request transitions """
+        edge_name = ('test_edge_%s' % str(uuid()))[:29]
+        edge_id = register_edge(edge_name)
+        set_transition_daemon('test_daemon')
+        # the transitions of the requests deleted before, their ids can be reused
+        flush_transitions()
+        purge_transitions(older_than=0)
+
+        request_id = add_request(scope='test_scope', name='test_name_%s' % str(uuid()), edge_id=edge_id)
+        assert_equal(transition_requests([request_id], 'NEW', 'BROKERING'), [request_id])
+        update_request(request_id, {'status': 'ASSIGNED'})
+        update_request(request_id, {'priority': 2})
+        assert_equal(transition_requests([request_id], 'ASSIGNED', 'AVAILABLE'), [request_id])
+        # the transitions are buffered until they are flushed
+        assert_equal(get_transitions(request_id), [])
+        flush_transitions()
+
+        transitions = get_transitions(request_id)
+        assert_equal([(str(t.from_status) if t.from_status else None, str(t.to_status)) for t in transitions],
+                     [(None, 'NEW'), ('NEW', 'BROKERING'), ('BROKERING', 'ASSIGNED'), ('ASSIGNED', 'AVAILABLE')])
+        assert_equal(set([t.daemon for t in transitions]), set(['test_daemon']))
+
+        stages = get_stage_durations(edge_name=edge_name)
+        assert_equal(sorted([stage['stage'] for stage in stages]), ['ASSIGNED', 'BROKERING', 'NEW', 'TOTAL'])
+        for stage in stages:
+            assert_equal((stage['edge_name'], stage['count']), (edge_name, 1))
+            assert_equal(stage['p50'] <= stage['p95'] <= stage['p99'] == stage['max'], True)
+            assert_equal(sum(stage['histogram'].values()), 1)
+
+        # the durations of the stages recorded at known times, over MAX_STAGE_PERIOD at most
+        timed_id = add_request(scope='test_scope', name='test_name_%s' % str(uuid()), edge_id=edge_id)
+        session = get_session()
+        started_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=MAX_STAGE_PERIOD + 3600)
+        for from_status, to_status, seconds in ((None, 'NEW', 0), ('NEW', 'BROKERING', 10), ('BROKERING', 'ERROR', 70)):
+            record_transitions([timed_id], from_status and RequestStatus.from_sym(from_status), RequestStatus.from_sym(to_status),
+                               transitioned_at=started_at + datetime.timedelta(seconds=seconds), session=session)
+        session.commit()
+        session.remove()
+        flush_transitions()
+        until = started_at + datetime.timedelta(seconds=100)
+        stages = get_stage_durations(edge_id=edge_id, since=started_at, until=until)
+        assert_equal([(stage['stage'], stage['count'], stage['max']) for stage in stages],
+                     [('BROKERING', 1, 60.0), ('NEW', 1, 10.0), ('TOTAL', 1, 70.0)])
+        assert_equal(get_stage_durations(edge_id=edge_id, since=started_at - datetime.timedelta(days=365),
+                                         until=until + datetime.timedelta(seconds=MAX_STAGE_PERIOD)), [])
+        delete_request(timed_id)
+
+        # the transitions of a rolled back transaction are not recorded
+        session = get_session()
+        rolled_back_id = add_request(scope='test_scope', name='test_name_%s' % str(uuid()), session=session)
+        session.rollback()
+        session.remove()
+        assert_equal(flush_transitions(), 0)
+        assert_equal(get_transitions(rolled_back_id), [])
+
+        # the transitions of the deleted requests are deleted
+        delete_request(request_id)
+        assert_equal(get_transitions(request_id), [])
+        delete_edge(edge_name)
+        purge_transitions(older_than=0)
+
+    def test_iter_json_array(self):
+        """ Request (REST): Test the streamed decoding of the json arrays of requests """
+        requests = [{'scope': 'test_scope', 'name': 'test_name_%s' % i, 'priority': i * 1.5} for i in range(10)]
+        for read_size in (1, 7, 65536):
+            assert_equal(list(iter_json_array(StringIO(json.dumps(requests)), read_size=read_size)), requests)
+            # the pretty printed arrays
+            assert_equal(list(iter_json_array(StringIO(json.dumps(requests, indent=4)), read_size=read_size)), requests)
+        assert_equal(list(iter_json_array(StringIO('[1, 2] trailing'), size=6, read_size=1)), [1, 2])
+        assert_equal(list(iter_json_array(StringIO('[1 \n\t, 2%s]' % (' ' * 100000)), read_size=1000)), [1, 2])
+        for stream in ('', '{}', '[1, 2', '[1 2]', '[1, ]'):
+            with assert_raises(ValueError):
+                list(iter_json_array(StringIO(stream), read_size=2))
+
     @unittest.skipIf(not has_config(), "No config file")
     @unittest.skipIf(not check_user_proxy(), "No user proxy to access REST")
     @unittest.skipIf(not check_rest_host(), "REST host is not defined")
@@ -81,6 +81,7 @@ data_files = [
     ('etc/ess/rest', glob.glob('etc/ess/rest/*.temp*')),
     ('etc/ess/tools', glob.glob('tools/*.py') + glob.glob('tools/*.sh')),
     ('etc/ess/tools/orm', glob.glob('tools/orm/*')),
+    ('etc/ess/tools/benchmark', glob.glob('tools/benchmark/*')),
     ('etc/ess/tools/venv', glob.glob('tools/venv/*')),
 ]
 scripts = glob.glob('bin/*')
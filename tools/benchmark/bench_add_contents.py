@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Benchmark adding contents: one add_content call per row against the bulk add_contents.
+"""
+
+import argparse
+import time
+
+from uuid import uuid4 as uuid
+
+from ess.common.exceptions import DuplicatedObject
+from ess.core.catalog import add_collection, add_content, add_contents, delete_collection
+from ess.core.edges import register_edge, delete_edge
+from ess.orm import models
+from ess.orm.constants import ContentType, ContentStatus
+from ess.orm.session import transactional_session
+
+
+def generate_files(num_files, granularity):
+    files = []
+    file_name = 'bench_file_%s' % str(uuid())
+    for i in range(0, num_files * granularity, granularity):
+        files.append({'scope': 'bench_scope',
+                      'name': file_name,
+                      'min_id': i,
+                      'max_id': i + granularity - 1,
+                      'content_type': ContentType.PARTIAL,
+                      'status': ContentStatus.TOSPLIT,
+                      'priority': 0,
+                      'pfn': '/tmp/%s' % file_name})
+    return files
+
+
+@transactional_session
+def add_contents_by_row(coll_id, edge_id, files, session=None):
+    for file in files:
+        try:
+            add_content(scope=file['scope'], name=file['name'], min_id=file['min_id'], max_id=file['max_id'],
+                        coll_id=coll_id, content_type=file['content_type'], status=file['status'],
+                        priority=file['priority'], edge_id=edge_id, pfn=file['pfn'], session=session)
+        except DuplicatedObject:
+            pass
+
+
+@transactional_session
+def clean_contents(coll_id, session=None):
+    session.query(models.CollectionContent).filter_by(coll_id=coll_id).delete()
+
+
+def run(num_files, granularity, chunk_size):
+    edge_name = ('bench_edge_%s' % str(uuid()))[:29]
+    edge_id = register_edge(edge_name)
+    coll_scope, coll_name = 'bench_scope', 'bench_coll_%s' % str(uuid())
+    coll_id = add_collection(scope=coll_scope, name=coll_name)
+
+    try:
+        files = generate_files(num_files, granularity)
+
+        start = time.time()
+        add_contents_by_row(coll_id, edge_id, files)
+        row_time = time.time() - start
+        clean_contents(coll_id)
+
+        start = time.time()
+        ret = add_contents(coll_scope, coll_name, edge_name, files, chunk_size=chunk_size)
+        bulk_time = time.time() - start
+
+        start = time.time()
+        ret_dup = add_contents(coll_scope, coll_name, edge_name, files, chunk_size=chunk_size)
+        dup_time = time.time() - start
+        clean_contents(coll_id)
+    finally:
+        delete_collection(coll_scope, coll_name, coll_id=coll_id)
+        delete_edge(edge_name)
+
+    print("rows: %s, chunk_size: %s" % (num_files, chunk_size))
+    print("add_content per row:       %8.3fs, %10.1f rows/s" % (row_time, num_files / row_time))
+    print("add_contents bulk:         %8.3fs, %10.1f rows/s, %s" % (bulk_time, num_files / bulk_time, ret))
+    print("add_contents duplicated:   %8.3fs, %10.1f rows/s, %s" % (dup_time, num_files / dup_time, ret_dup))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark adding contents")
+    parser.add_argument('--num-files', type=int, default=20000, help='Number of contents to add')
+    parser.add_argument('--granularity', type=int, default=10, help='Number of events per content')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Number of contents per bulk statement')
+    args = parser.parse_args()
+
+    run(args.num_files, args.granularity, args.chunk_size)
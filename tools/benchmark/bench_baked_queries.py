@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Benchmark the per call overhead of the hot queries: a query built and compiled at every call,
+as before the baked queries, against the baked queries of ess.core.
+
+All calls of a run share one session in a unit of work, so the connection checkouts are not measured.
+"""
+
+import argparse
+import time
+
+from uuid import uuid4 as uuid
+
+from sqlalchemy import and_
+
+from ess.core.catalog import add_collection, add_contents, delete_collection, get_content_best_match, get_contents_by_edge
+from ess.core.edges import register_edge, delete_edge, get_edge
+from ess.core.requests import get_requests
+from ess.orm import models
+from ess.orm.constants import ContentType, ContentStatus, RequestStatus
+from ess.orm.models import CollectionContent
+from ess.orm.session import get_unit_session, transactional_session, unit_of_work
+
+
+def query_edge(edge_name, edge_id, file_name):
+    get_unit_session().query(models.Edge).filter_by(edge_name=edge_name).one()
+
+
+def baked_edge(edge_name, edge_id, file_name):
+    get_edge(edge_name)
+
+
+def query_requests(edge_name, edge_id, file_name):
+    get_unit_session().query(models.Request).filter_by(status=RequestStatus.NEW, edge_id=edge_id).all()
+
+
+def baked_requests(edge_name, edge_id, file_name):
+    get_requests(status=RequestStatus.NEW, edge_id=edge_id)
+
+
+def query_best_match(edge_name, edge_id, file_name):
+    get_unit_session().query(models.CollectionContent).filter_by(scope='bench_scope', name=file_name)\
+                      .filter_by(status=ContentStatus.AVAILABLE).filter_by(edge_id=edge_id)\
+                      .filter(and_(CollectionContent.min_id <= 5, CollectionContent.max_id >= 5))\
+                      .order_by(CollectionContent.max_id - CollectionContent.min_id, CollectionContent.content_id)\
+                      .first()
+
+
+def baked_best_match(edge_name, edge_id, file_name):
+    get_content_best_match('bench_scope', file_name, min_id=5, max_id=5, edge_id=edge_id, status=ContentStatus.AVAILABLE)
+
+
+def query_contents(edge_name, edge_id, file_name):
+    get_unit_session().query(models.CollectionContent).filter_by(edge_id=edge_id)\
+                      .filter_by(status=ContentStatus.AVAILABLE).limit(10).all()
+
+
+def baked_contents(edge_name, edge_id, file_name):
+    get_contents_by_edge(edge_name, edge_id=edge_id, status=ContentStatus.AVAILABLE, limit=10)
+
+
+SHAPES = [('get_edge', query_edge, baked_edge),
+          ('get_requests', query_requests, baked_requests),
+          ('get_content_best_match', query_best_match, baked_best_match),
+          ('get_contents_by_edge', query_contents, baked_contents)]
+
+
+@transactional_session
+def clean_contents(coll_id, session=None):
+    session.query(models.CollectionContent).filter_by(coll_id=coll_id).delete()
+
+
+def measure(func, num_calls, edge_name, edge_id, file_name):
+    with unit_of_work():
+        # warm up the session, the connection and the caches
+        func(edge_name, edge_id, file_name)
+        start = time.time()
+        for i in range(num_calls):
+            func(edge_name, edge_id, file_name)
+        return (time.time() - start) * 1000000.0 / num_calls
+
+
+def run(num_calls):
+    edge_name = ('bench_edge_%s' % str(uuid()))[:29]
+    edge_id = register_edge(edge_name)
+    coll_scope, coll_name = 'bench_scope', 'bench_coll_%s' % str(uuid())
+    coll_id = add_collection(scope=coll_scope, name=coll_name)
+    file_name = 'bench_file_%s' % str(uuid())
+    add_contents(coll_scope, coll_name, edge_name,
+                 [{'scope': coll_scope, 'name': file_name, 'min_id': i, 'max_id': i + 9,
+                   'content_type': ContentType.PARTIAL, 'status': ContentStatus.AVAILABLE} for i in range(0, 100, 10)])
+
+    print("%24s %16s %16s %10s" % ('query', 'query (us/call)', 'baked (us/call)', 'speedup'))
+    try:
+        for name, query_func, baked_func in SHAPES:
+            query_time = measure(query_func, num_calls, edge_name, edge_id, file_name)
+            baked_time = measure(baked_func, num_calls, edge_name, edge_id, file_name)
+            print("%24s %16.1f %16.1f %9.2fx" % (name, query_time, baked_time, query_time / baked_time))
+    finally:
+        clean_contents(coll_id)
+        delete_collection(coll_scope, coll_name, coll_id=coll_id)
+        delete_edge(edge_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the per call overhead of the hot queries")
+    parser.add_argument('--calls', type=int, default=2000, help='Number of calls per query shape')
+    args = parser.parse_args()
+
+    run(args.calls)
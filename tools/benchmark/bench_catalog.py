@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Benchmark the core catalog and requests functions on a synthetic catalog, generated at a configurable scale
+in the database of the configuration.
+
+Every function is called with the shapes the daemons and the REST service use, and the latencies are
+summarized as min, median, p95, mean and max. The results are written as json with the scale, the database
+and the version, for the regression tracking between versions: with --baseline, the medians are compared
+to the ones of an earlier result file and the command fails if a function is slower than the threshold.
+
+A catalog of 10^6-10^7 contents takes a while to generate: --tag and --keep-data reuse it in later runs.
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from uuid import uuid4 as uuid
+
+from datagen import add_scale_arguments, get_generator
+
+from ess.core.catalog import (add_contents, get_content_best_match, get_contents_by_edge, get_contents_statistics,
+                              update_contents_by_id)
+from ess.core.requests import add_requests, get_requests
+from ess.orm.constants import ContentType, ContentStatus, RequestStatus
+from ess.orm.session import get_engine
+from ess.version import release_version
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(round(fraction * (len(values) - 1))), len(values) - 1)]
+
+
+def summarize(latencies, rows):
+    """
+    Summarize the latencies of the calls of a function, in milliseconds.
+    """
+    latencies = [latency * 1000.0 for latency in latencies]
+    return {'calls': len(latencies),
+            'rows': rows,
+            'min_ms': min(latencies),
+            'median_ms': percentile(latencies, 0.5),
+            'p95_ms': percentile(latencies, 0.95),
+            'mean_ms': sum(latencies) / len(latencies),
+            'max_ms': max(latencies),
+            'rows_per_second': rows * 1000.0 / sum(latencies) if rows else None}
+
+
+def measure(func, repeats, warmup=1):
+    """
+    Call a function returning the number of rows it read or wrote.
+
+    :returns: (latencies in seconds, total number of rows).
+    """
+    for i in range(warmup):
+        func(-1 - i)
+    latencies, rows = [], 0
+    for i in range(repeats):
+        start = time.time()
+        rows += func(i) or 0
+        latencies.append(time.time() - start)
+    return latencies, rows
+
+
+class Workload(object):
+    """
+    The benchmarked calls on a generated catalog. Every call gets its repeat number.
+    """
+
+    def __init__(self, generator, batch_size, seed=0):
+        self.generator = generator
+        self.scope = generator.scope
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.edges = generator.edges
+        self.collections = generator.collections
+        self.run_id = str(uuid())[:8]
+        self.update_ids = None
+
+    def random_collection(self):
+        return self.collections[self.random.randint(0, len(self.collections) - 1)]
+
+    def random_edge(self):
+        return self.edges[self.random.randint(0, len(self.edges) - 1)]
+
+    def add_contents(self, repeat):
+        coll_name, coll_id, edge_name = self.random_collection()
+        name = '%s_bench_%s_%s' % (coll_name, self.run_id, repeat)
+        files = [{'scope': self.scope, 'name': name, 'min_id': i * 10, 'max_id': i * 10 + 9,
+                  'content_type': ContentType.PARTIAL, 'status': ContentStatus.TOSPLIT, 'priority': 0,
+                  'pfn_size': 10240, 'pfn': '/data/%s/%s' % (self.scope, name)} for i in range(self.batch_size)]
+        return add_contents(self.scope, coll_name, edge_name, files)['inserted']
+
+    def get_contents_by_edge(self, repeat):
+        edge_name, edge_id = self.random_edge()
+        return len(get_contents_by_edge(edge_name, edge_id=edge_id, status=ContentStatus.AVAILABLE,
+                                        content_type=ContentType.PARTIAL, limit=self.batch_size))
+
+    def get_contents_by_collection(self, repeat):
+        coll_name, coll_id, edge_name = self.random_collection()
+        return len(get_contents_by_edge(edge_name, coll_id=coll_id, content_type=ContentType.FILE,
+                                        status=ContentStatus.PRECACHED))
+
+    def get_content_best_match(self, repeat):
+        coll_name, coll_id, edge_name = self.random_collection()
+        name = self.generator.get_file_name(coll_name, self.random.randint(0, self.generator.files_per_collection - 1))
+        event = self.random.randint(0, self.generator.events_per_file - 1)
+        content = get_content_best_match(self.scope, name, min_id=event, max_id=event, edge_name=edge_name)
+        return 1 if content else 0
+
+    def get_contents_statistics(self, repeat):
+        edge_name, edge_id = self.random_edge()
+        return len(get_contents_statistics(edge_name, edge_id=edge_id))
+
+    def update_contents_by_id(self, repeat):
+        if self.update_ids is None:
+            edge_name, edge_id = self.edges[0]
+            self.update_ids = [content.content_id for content in
+                               get_contents_by_edge(edge_name, edge_id=edge_id, status=ContentStatus.TOSTAGEDOUT,
+                                                    content_type=ContentType.PARTIAL, limit=self.batch_size,
+                                                    columns=['content_id'])]
+        # alternate the status, the counters and the priority are updated with it
+        status = ContentStatus.STAGINGOUT if repeat % 2 == 0 else ContentStatus.TOSTAGEDOUT
+        return update_contents_by_id(dict([(content_id, {'status': status, 'priority': repeat})
+                                           for content_id in self.update_ids]))
+
+    def restore(self):
+        if self.update_ids:
+            update_contents_by_id(dict([(content_id, {'status': ContentStatus.TOSTAGEDOUT})
+                                        for content_id in self.update_ids]))
+
+    def get_requests(self, repeat):
+        edge_name, edge_id = self.random_edge()
+        return len(get_requests(status=RequestStatus.NEW, edge_id=edge_id))
+
+    def get_requests_without_metadata(self, repeat):
+        edge_name, edge_id = self.random_edge()
+        return len(get_requests(status=RequestStatus.NEW, edge_id=edge_id, with_metadata=False))
+
+    def get_requests_by_priority(self, repeat):
+        edge_name, edge_id = self.random_edge()
+        return len(get_requests(status=RequestStatus.NEW, edge_id=edge_id, limit=self.batch_size // 10))
+
+    def add_requests(self, repeat):
+        coll_name, coll_id, edge_name = self.random_collection()
+        requests = [{'scope': self.scope, 'name': coll_name, 'data_type': 'DATASET', 'granularity_type': 'PARTIAL',
+                     'granularity_level': self.generator.events_per_file, 'priority': self.random.randint(0, 100),
+                     'request_meta': {'run': self.run_id, 'repeat': repeat, 'jobid': i}}
+                    for i in range(self.batch_size // 10)]
+        return len(add_requests(requests, coalesce=True))
+
+    def get_calls(self):
+        return [('add_contents', self.add_contents),
+                ('get_contents_by_edge', self.get_contents_by_edge),
+                ('get_contents_by_edge (collection)', self.get_contents_by_collection),
+                ('get_content_best_match', self.get_content_best_match),
+                ('get_contents_statistics', self.get_contents_statistics),
+                ('update_contents_by_id', self.update_contents_by_id),
+                ('get_requests', self.get_requests),
+                ('get_requests (without metadata)', self.get_requests_without_metadata),
+                ('get_requests (by priority, limit)', self.get_requests_by_priority),
+                ('add_requests (coalesced)', self.add_requests)]
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the medians to the ones of a baseline.
+
+    :returns: list of the names of the functions slower than the threshold.
+    """
+    regressions = []
+    print("%36s %14s %14s %10s" % ('function', 'baseline (ms)', 'median (ms)', 'ratio'))
+    for name, result in sorted(results['results'].items()):
+        if name not in baseline['results']:
+            print("%36s %14s %14.3f" % (name, '-', result['median_ms']))
+            continue
+        base = baseline['results'][name]['median_ms']
+        ratio = result['median_ms'] / base if base else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = ' slower'
+        print("%36s %14.3f %14.3f %9.2fx%s" % (name, base, result['median_ms'], ratio, flag))
+    if baseline.get('scale') != results['scale']:
+        print("The scale of the baseline differs: %s" % baseline.get('scale'))
+    return regressions
+
+
+def run(args):
+    generator = get_generator(args)
+    results = {'version': release_version,
+               'revision': get_git_revision(),
+               'database': get_engine(echo=False).dialect.name,
+               'python': platform.python_version(),
+               'created_at': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+               'repeats': args.repeats,
+               'batch_size': args.batch_size,
+               'scale': generator.get_scale(),
+               'generation': None,
+               'results': {}}
+
+    if not (args.tag and generator.load()):
+        results['generation'] = generator.generate(verbose=args.verbose)
+    results['scale'].pop('tag')
+
+    workload = Workload(generator, args.batch_size, seed=args.seed)
+    try:
+        print("%36s %10s %12s %12s %12s %14s" % ('function', 'rows', 'median (ms)', 'p95 (ms)', 'max (ms)', 'rows/s'))
+        for name, func in workload.get_calls():
+            latencies, rows = measure(func, args.repeats)
+            result = summarize(latencies, rows)
+            results['results'][name] = result
+            print("%36s %10s %12.3f %12.3f %12.3f %14s" % (name, rows, result['median_ms'], result['p95_ms'], result['max_ms'],
+                                                           '%.1f' % result['rows_per_second'] if rows else '-'))
+    finally:
+        workload.restore()
+        if not args.keep_data:
+            generator.clean()
+        else:
+            print("Kept the catalog with tag %s" % generator.tag)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the core functions on a synthetic catalog")
+    add_scale_arguments(parser)
+    parser.add_argument('--repeats', type=int, default=20, help='Number of calls per function')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Number of contents added, updated or listed per call')
+    parser.add_argument('--keep-data', action='store_true', default=False, help='Keep the catalog, to reuse it with --tag')
+    parser.add_argument('--output', help='File to write the json results to')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Tolerated slowdown of the medians against the baseline')
+    parser.add_argument('--verbose', action='store_true', default=False, help='Print the progress of the generation')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    else:
+        print(json.dumps(results, indent=4, sort_keys=True))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Slower than the baseline: %s" % ', '.join(regressions))
+            sys.exit(1)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Benchmark the row load throughput of get_requests, with every importable json codec,
+with and without loading the metadata of the requests.
+"""
+
+import argparse
+import time
+
+from uuid import uuid4 as uuid
+
+from ess.common.exceptions import ESSException
+from ess.core.edges import register_edge, delete_edge
+from ess.core.requests import add_request, get_requests
+from ess.orm import models
+from ess.orm.session import transactional_session
+from ess.orm.types import JSON_CODECS, set_json_codec
+
+
+@transactional_session
+def clean_requests(edge_id, session=None):
+    session.query(models.Request).filter_by(edge_id=edge_id).delete()
+
+
+def measure(edge_id, with_metadata, repeats):
+    start = time.time()
+    for i in range(repeats):
+        num = len(get_requests(edge_id=edge_id, with_metadata=with_metadata))
+    return num * repeats / (time.time() - start)
+
+
+def run(num_requests, meta_size, repeats):
+    edge_name = ('bench_edge_%s' % str(uuid()))[:29]
+    edge_id = register_edge(edge_name)
+    request_meta = {'taskid': 975, 'files': ['file_%s.pool.root' % i for i in range(meta_size)]}
+    for i in range(num_requests):
+        add_request(scope='bench_scope', name='bench_name_%s' % i, data_type='DATASET', granularity_type='FILE',
+                    granularity_level=1, edge_id=edge_id, status='NEW', request_meta=request_meta,
+                    processing_meta={'coll_id': i})
+
+    print("%12s %24s %24s" % ('codec', 'with metadata (rows/s)', 'deferred (rows/s)'))
+    try:
+        for codec_name in JSON_CODECS:
+            try:
+                set_json_codec(codec_name)
+            except ESSException:
+                print("%12s %24s" % (codec_name, 'not installed'))
+                continue
+            with_metadata = measure(edge_id, True, repeats)
+            deferred = measure(edge_id, False, repeats)
+            print("%12s %24.1f %24.1f" % (codec_name, with_metadata, deferred))
+    finally:
+        set_json_codec()
+        clean_requests(edge_id)
+        delete_edge(edge_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the row load throughput of get_requests")
+    parser.add_argument('--requests', type=int, default=1000, help='Number of requests')
+    parser.add_argument('--meta-size', type=int, default=100, help='Number of files in the metadata of a request')
+    parser.add_argument('--repeats', type=int, default=10, help='Number of loads of the requests')
+    args = parser.parse_args()
+
+    run(args.requests, args.meta_size, args.repeats)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Benchmark the memory of reading the contents of a collection: get_contents_by_edge
+against the paged iter_contents_by_edge, for growing collection sizes.
+
+Every reader runs in a forked process, so the peak RSS of each run is measured alone.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+from uuid import uuid4 as uuid
+
+from ess.core.catalog import add_collection, add_contents, delete_collection, get_contents_by_edge, iter_contents_by_edge
+from ess.core.edges import register_edge, delete_edge
+from ess.orm import models
+from ess.orm.constants import ContentType, ContentStatus
+from ess.orm.session import get_engine, transactional_session
+
+
+def generate_files(num_files):
+    files = []
+    file_name = 'bench_file_%s' % str(uuid())
+    for i in range(num_files):
+        files.append({'scope': 'bench_scope',
+                      'name': file_name,
+                      'min_id': i,
+                      'max_id': i,
+                      'content_type': ContentType.PARTIAL,
+                      'status': ContentStatus.AVAILABLE,
+                      'pfn': '/tmp/%s' % file_name})
+    return files
+
+
+@transactional_session
+def clean_contents(coll_id, session=None):
+    session.query(models.CollectionContent).filter_by(coll_id=coll_id).delete()
+
+
+def read_all(edge_id, coll_id, page_size):
+    num = 0
+    for content in get_contents_by_edge(None, edge_id=edge_id, coll_id=coll_id):
+        num += 1
+    return num
+
+
+def read_iter(edge_id, coll_id, page_size):
+    num = 0
+    for content in iter_contents_by_edge(None, edge_id=edge_id, coll_id=coll_id, page_size=page_size):
+        num += 1
+    return num
+
+
+def measure(reader, edge_id, coll_id, page_size, queue):
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    num = reader(edge_id, coll_id, page_size)
+    used = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((num, used, (peak_rss - base_rss) / 1024.0))
+
+
+def run_reader(reader, edge_id, coll_id, page_size):
+    # connections must not be shared with the forked process
+    get_engine().dispose()
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=measure, args=(reader, edge_id, coll_id, page_size, queue))
+    proc.start()
+    ret = queue.get()
+    proc.join()
+    return ret
+
+
+def run(sizes, page_size):
+    edge_name = ('bench_edge_%s' % str(uuid()))[:29]
+    edge_id = register_edge(edge_name)
+    coll_scope, coll_name = 'bench_scope', 'bench_coll_%s' % str(uuid())
+    coll_id = add_collection(scope=coll_scope, name=coll_name)
+
+    print("%10s %24s %24s" % ('rows', 'get_contents_by_edge', 'iter_contents_by_edge'))
+    try:
+        for size in sizes:
+            clean_contents(coll_id)
+            add_contents(coll_scope, coll_name, edge_name, generate_files(size))
+
+            num_all, time_all, rss_all = run_reader(read_all, edge_id, coll_id, page_size)
+            num_iter, time_iter, rss_iter = run_reader(read_iter, edge_id, coll_id, page_size)
+            assert num_all == num_iter == size
+            print("%10s %10.3fs %9.1fMB %10.3fs %9.1fMB" % (size, time_all, rss_all, time_iter, rss_iter))
+    finally:
+        clean_contents(coll_id)
+        delete_collection(coll_scope, coll_name, coll_id=coll_id)
+        delete_edge(edge_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the memory of reading contents")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000, 200000],
+                        help='Numbers of contents in the collection')
+    parser.add_argument('--page-size', type=int, default=1000, help='Number of contents per page')
+    args = parser.parse_args()
+
+    run(args.sizes, args.page_size)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Benchmark the time and the memory of fetching the contents of an edge as ORM models,
+against the records of the columns needed by the Stager.
+
+Every fetch runs in its own process, so that its peak resident memory is measured alone.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+from uuid import uuid4 as uuid
+
+from ess.core.catalog import add_collection, add_contents, delete_collection, get_contents_by_edge
+from ess.core.edges import register_edge, delete_edge
+from ess.daemons.stager.daemon import STAGER_COLUMNS
+from ess.orm import models
+from ess.orm.constants import ContentType, ContentStatus
+from ess.orm.session import transactional_session
+
+
+@transactional_session
+def clean_contents(coll_id, session=None):
+    session.query(models.CollectionContent).filter_by(coll_id=coll_id).delete()
+
+
+def fetch(edge_id, columns, results):
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    contents = get_contents_by_edge(None, edge_id=edge_id, columns=columns)
+    elapsed = time.time() - start
+    results.put((len(contents), elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss))
+
+
+def measure(edge_id, columns):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=fetch, args=(edge_id, columns, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def run(num_rows):
+    edge_name = ('bench_edge_%s' % str(uuid()))[:29]
+    edge_id = register_edge(edge_name)
+    coll_scope, coll_name = 'bench_scope', 'bench_coll_%s' % str(uuid())
+    coll_id = add_collection(scope=coll_scope, name=coll_name)
+    files = [{'scope': coll_scope, 'name': 'bench_file_%s' % (i // 100), 'min_id': i % 100 * 10, 'max_id': i % 100 * 10 + 9,
+              'content_type': ContentType.PARTIAL, 'status': ContentStatus.TOSTAGEDOUT, 'pfn_size': 1024,
+              'pfn': '/tmp/bench_file_%s' % i, 'object_metadata': {'events': 10}} for i in range(num_rows)]
+    add_contents(coll_scope, coll_name, edge_name, files)
+
+    print("%10s %10s %12s %16s" % ('fetch', 'rows', 'time (s)', 'peak rss (MB)'))
+    try:
+        for name, columns in (('models', None), ('records', STAGER_COLUMNS)):
+            rows, elapsed, rss = measure(edge_id, columns)
+            print("%10s %10s %12.2f %16.1f" % (name, rows, elapsed, rss / 1024.0))
+    finally:
+        clean_contents(coll_id)
+        delete_collection(coll_scope, coll_name, coll_id=coll_id)
+        delete_edge(edge_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark fetching the contents as models or as records of columns")
+    parser.add_argument('--rows', type=int, default=100000, help='Number of contents')
+    args = parser.parse_args()
+
+    run(args.rows)
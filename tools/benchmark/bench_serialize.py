@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Benchmark the serialization of content rows: the former to_dict walking __dict__ and converting
+every value, against the per model serializer of the columns, for objects and for rows of columns.
+
+The rows are built in memory, so only the serialization is measured.
+"""
+
+import argparse
+import datetime
+import time
+
+from sqlalchemy.util import KeyedTuple
+
+from ess.orm.constants import ContentType, ContentStatus
+from ess.orm.models import CollectionContent
+
+
+ROW_KEYS = ['content_id', 'scope', 'name', 'min_id', 'max_id', 'content_type', 'status', 'pfn_size', 'pfn', 'updated_at']
+
+
+def make_contents(num_rows):
+    now = datetime.datetime.utcnow()
+    contents = []
+    for i in range(num_rows):
+        content = CollectionContent(content_id=i, coll_id=1, edge_id=1, scope='bench_scope', name='bench_file_%s' % (i // 10),
+                                    min_id=i % 10 * 10, max_id=i % 10 * 10 + 9, content_type=ContentType.PARTIAL,
+                                    status=ContentStatus.AVAILABLE, pfn_size=1024, pfn='/tmp/bench_file_%s' % i,
+                                    accessed_at=now, created_at=now, updated_at=now)
+        contents.append(content)
+    return contents
+
+
+def make_rows(contents):
+    return [KeyedTuple([getattr(content, key) for key in ROW_KEYS], labels=ROW_KEYS) for content in contents]
+
+
+def legacy_to_dict(content):
+    return {key: CollectionContent._expand_item(value) for key, value
+            in content.__dict__.items() if not key.startswith('_')}
+
+
+def legacy_rows_to_dicts(rows):
+    return [{key: CollectionContent._expand_item(value) for key, value in row._asdict().items()} for row in rows]
+
+
+def measure(func, items):
+    start = time.time()
+    func(items)
+    return time.time() - start
+
+
+def run(num_rows):
+    contents = make_contents(num_rows)
+    rows = make_rows(contents)
+
+    shapes = [('objects', lambda items: [legacy_to_dict(item) for item in items],
+               lambda items: [item.to_dict() for item in items], contents),
+              ('rows', legacy_rows_to_dicts, lambda items: list(CollectionContent.rows_to_dicts(items)), rows)]
+
+    print("%10s %16s %16s %10s" % ('shape', 'legacy (rows/s)', 'new (rows/s)', 'speedup'))
+    for name, legacy_func, new_func, items in shapes:
+        legacy_time = measure(legacy_func, items)
+        new_time = measure(new_func, items)
+        print("%10s %16.0f %16.0f %9.2fx" % (name, num_rows / legacy_time, num_rows / new_time, legacy_time / new_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the serialization of content rows")
+    parser.add_argument('--rows', type=int, default=100000, help='Number of content rows')
+    args = parser.parse_args()
+
+    run(args.rows)
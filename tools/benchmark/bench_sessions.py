@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Benchmark the queries per second per thread of small decorated reads: a new session
+and a connection checkout per call against one session per unit of work.
+"""
+
+import argparse
+import threading
+import time
+
+from uuid import uuid4 as uuid
+
+from ess.core.edges import register_edge, delete_edge, get_edge
+from ess.orm.session import unit_of_work
+
+
+def read_per_call(edge_name, num_queries, unit_size):
+    for i in range(num_queries):
+        get_edge(edge_name)
+
+
+def read_in_units(edge_name, num_queries, unit_size):
+    for i in range(0, num_queries, unit_size):
+        with unit_of_work():
+            for j in range(min(unit_size, num_queries - i)):
+                get_edge(edge_name)
+
+
+def run_threads(reader, edge_name, num_threads, num_queries, unit_size):
+    rates = []
+
+    def worker():
+        start = time.time()
+        reader(edge_name, num_queries, unit_size)
+        rates.append(num_queries / (time.time() - start))
+
+    threads = [threading.Thread(target=worker) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(rates) / len(rates)
+
+
+def run(threads, num_queries, unit_size):
+    edge_name = ('bench_edge_%s' % str(uuid()))[:29]
+    register_edge(edge_name)
+
+    print("%10s %20s %20s" % ('threads', 'per call (q/s)', 'unit of work (q/s)'))
+    try:
+        for num_threads in threads:
+            per_call = run_threads(read_per_call, edge_name, num_threads, num_queries, unit_size)
+            in_units = run_threads(read_in_units, edge_name, num_threads, num_queries, unit_size)
+            print("%10s %20.1f %20.1f" % (num_threads, per_call, in_units))
+    finally:
+        delete_edge(edge_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the queries per second per thread of the session lifecycles")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8], help='Numbers of threads')
+    parser.add_argument('--queries', type=int, default=2000, help='Number of queries per thread')
+    parser.add_argument('--unit-size', type=int, default=100, help='Number of queries per unit of work')
+    args = parser.parse_args()
+
+    run(args.threads, args.queries, args.unit_size)
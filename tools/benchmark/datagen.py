@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Generate a synthetic catalog at scale: edges, collections, their FILE contents split in PARTIAL contents,
+and the requests of the collections, with realistic status proportions.
+
+The rows are inserted in bulk in chunks of one transaction each, so that catalogs of 10^6-10^7 contents
+can be generated in the database of the configuration (sqlite, mysql, postgresql or oracle). The content
+counters are reconciled once all the contents are inserted.
+
+All the generated rows are identified by a tag, so that a catalog can be reused by later runs and cleaned.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import time
+
+from uuid import uuid4 as uuid
+
+from sqlalchemy import select
+
+from ess.common.exceptions import NoObject
+from ess.core.catalog import add_collection, delete_collection, get_collection_id
+from ess.core.counters import delete_content_counters, reconcile_content_counters
+from ess.core.edges import delete_edge, get_edge_id, register_edge
+from ess.orm.constants import ContentType, ContentStatus, DataType, GranularityType, RequestStatus
+from ess.orm.models import CollectionContent, Request, RequestDataKey, RequestSubscription
+from ess.orm.session import transactional_session
+
+
+# (status, weight) of the FILE and PARTIAL contents and of the requests
+FILE_STATUSES = [(ContentStatus.PRECACHED, 80), (ContentStatus.AVAILABLE, 15), (ContentStatus.NEW, 5)]
+PARTIAL_STATUSES = [(ContentStatus.AVAILABLE, 60), (ContentStatus.REMOVED, 15), (ContentStatus.TOSPLIT, 5),
+                    (ContentStatus.SPLITTING, 5), (ContentStatus.TOSTAGEDOUT, 5), (ContentStatus.STAGINGOUT, 5),
+                    (ContentStatus.NEW, 5)]
+REQUEST_STATUSES = [(RequestStatus.AVAILABLE, 70), (RequestStatus.ERROR, 10), (RequestStatus.NEW, 5),
+                    (RequestStatus.ASSIGNED, 5), (RequestStatus.PRECACHED, 5), (RequestStatus.SPLITTING, 5)]
+
+DEFAULT_INSERT_CHUNK_SIZE = 10000
+
+
+def weighted_choice(rand, choices):
+    total = sum([choice[-1] for choice in choices])
+    point = rand.uniform(0, total)
+    for choice in choices:
+        point -= choice[-1]
+        if point <= 0:
+            return choice[0]
+    return choices[-1][0]
+
+
+@transactional_session
+def insert_rows(table, rows, session=None):
+    session.execute(table.insert(), rows)
+
+
+@transactional_session
+def delete_rows(table, criteria, session=None):
+    session.execute(table.delete().where(criteria))
+
+
+class CatalogGenerator(object):
+    """
+    A synthetic catalog, identified by a tag.
+
+    The contents are generated per collection: files_per_collection FILE contents of events_per_file events,
+    each one split in partials_per_file PARTIAL contents. The collections are spread over the edges.
+    """
+
+    def __init__(self, num_contents=100000, num_requests=10000, num_edges=4, files_per_collection=100,
+                 partials_per_file=10, events_per_file=1000, tag=None, seed=0, chunk_size=DEFAULT_INSERT_CHUNK_SIZE):
+        self.files_per_collection = files_per_collection
+        self.partials_per_file = partials_per_file
+        self.events_per_file = events_per_file
+        contents_per_collection = files_per_collection * (1 + partials_per_file)
+        self.num_collections = max((num_contents + contents_per_collection - 1) // contents_per_collection, 1)
+        self.num_requests = num_requests
+        self.num_edges = num_edges
+        self.tag = tag or str(uuid()).replace('-', '')[:8]
+        self.scope = 'bench_%s' % self.tag
+        self.random = random.Random(seed)
+        self.chunk_size = chunk_size
+
+        self.edges = [('bench_%s_%s' % (self.tag, i), None) for i in range(num_edges)]
+        self.collections = [('%s_coll_%s' % (self.scope, i), None, self.edges[i % num_edges][0])
+                            for i in range(self.num_collections)]
+
+    def get_scale(self):
+        return {'tag': self.tag,
+                'edges': self.num_edges,
+                'collections': self.num_collections,
+                'files_per_collection': self.files_per_collection,
+                'partials_per_file': self.partials_per_file,
+                'events_per_file': self.events_per_file,
+                'contents': self.num_collections * self.files_per_collection * (1 + self.partials_per_file),
+                'requests': self.num_requests}
+
+    def get_file_name(self, coll_name, file_index):
+        return '%s_file_%s' % (coll_name, file_index)
+
+    def load(self):
+        """
+        Load the ids of the edges and the collections of a catalog generated before with the same tag and scale.
+
+        :returns: True if all the edges and collections exist.
+        """
+        def get_id(func, *args):
+            try:
+                return func(*args)
+            except NoObject:
+                return None
+
+        self.edges = [(edge_name, get_id(get_edge_id, edge_name)) for edge_name, edge_id in self.edges]
+        self.collections = [(coll_name, get_id(get_collection_id, self.scope, coll_name), edge_name)
+                            for coll_name, coll_id, edge_name in self.collections]
+        return all([edge_id for edge_name, edge_id in self.edges] + [coll_id for coll_name, coll_id, edge_name in self.collections])
+
+    def generate_contents(self, coll_name, coll_id, edge_id):
+        """
+        Generate the contents of a collection.
+        """
+        now = datetime.datetime.utcnow()
+        granularity = max(self.events_per_file // self.partials_per_file, 1) if self.partials_per_file else self.events_per_file
+        for i in range(self.files_per_collection):
+            name = self.get_file_name(coll_name, i)
+            priority = self.random.randint(0, 100)
+            pfn = '/data/%s/%s' % (self.scope, name)
+            yield {'scope': self.scope, 'name': name, 'min_id': 0, 'max_id': self.events_per_file - 1, 'coll_id': coll_id,
+                   'content_type': ContentType.FILE, 'status': weighted_choice(self.random, FILE_STATUSES),
+                   'priority': priority, 'edge_id': edge_id, 'num_success': 0, 'num_failure': 0,
+                   'pfn_size': self.events_per_file * 1024, 'pfn': pfn, 'created_at': now, 'updated_at': now}
+            for j in range(self.partials_per_file):
+                min_id = j * granularity
+                max_id = self.events_per_file - 1 if j == self.partials_per_file - 1 else min_id + granularity - 1
+                yield {'scope': self.scope, 'name': name, 'min_id': min_id, 'max_id': max_id, 'coll_id': coll_id,
+                       'content_type': ContentType.PARTIAL, 'status': weighted_choice(self.random, PARTIAL_STATUSES),
+                       'priority': priority, 'edge_id': edge_id, 'num_success': 0, 'num_failure': 0,
+                       'pfn_size': (max_id - min_id + 1) * 1024, 'pfn': '%s.%s-%s' % (pfn, min_id, max_id),
+                       'created_at': now, 'updated_at': now}
+
+    def generate_requests(self):
+        now = datetime.datetime.utcnow()
+        edge_ids = dict(self.edges)
+        for i in range(self.num_requests):
+            coll_name, coll_id, edge_name = self.collections[i % self.num_collections]
+            yield {'scope': self.scope, 'name': coll_name, 'data_type': DataType.DATASET,
+                   'granularity_type': GranularityType.PARTIAL,
+                   'granularity_level': max(self.events_per_file // max(self.partials_per_file, 1), 1),
+                   'priority': self.random.randint(0, 100), 'edge_id': edge_ids[edge_name],
+                   'status': weighted_choice(self.random, REQUEST_STATUSES),
+                   'request_meta': {'taskid': i, 'jobid': self.random.randint(0, 10 ** 9)},
+                   'processing_meta': {'coll_id': coll_id}, 'created_at': now, 'updated_at': now}
+
+    def insert_in_chunks(self, table, rows):
+        inserted = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                insert_rows(table, chunk)
+                inserted += len(chunk)
+                chunk = []
+        if chunk:
+            insert_rows(table, chunk)
+            inserted += len(chunk)
+        return inserted
+
+    def generate(self, verbose=False):
+        """
+        Insert the catalog.
+
+        :returns: dictionary of the numbers of inserted rows and of the seconds spent.
+        """
+        start = time.time()
+        self.edges = [(edge_name, register_edge(edge_name)) for edge_name, edge_id in self.edges]
+        edge_ids = dict(self.edges)
+
+        num_contents = 0
+        collections = []
+        for coll_name, coll_id, edge_name in self.collections:
+            coll_id = add_collection(scope=self.scope, name=coll_name, coll_size=self.files_per_collection)
+            collections.append((coll_name, coll_id, edge_name))
+            num_contents += self.insert_in_chunks(CollectionContent.__table__,
+                                                  self.generate_contents(coll_name, coll_id, edge_ids[edge_name]))
+            if verbose:
+                print("Inserted %s contents of %s collections" % (num_contents, len(collections)))
+        self.collections = collections
+        contents_time = time.time() - start
+
+        start = time.time()
+        for edge_name, edge_id in self.edges:
+            reconcile_content_counters(edge_id=edge_id)
+        counters_time = time.time() - start
+
+        start = time.time()
+        num_requests = self.insert_in_chunks(Request.__table__, self.generate_requests())
+        requests_time = time.time() - start
+
+        return {'contents': num_contents, 'contents_seconds': contents_time,
+                'counters_seconds': counters_time,
+                'requests': num_requests, 'requests_seconds': requests_time}
+
+    def clean(self):
+        """
+        Delete the catalog, one collection per transaction.
+        """
+        contents, requests, subscriptions = CollectionContent.__table__, Request.__table__, RequestSubscription.__table__
+        delete_rows(subscriptions, subscriptions.c.request_id.in_(select([requests.c.request_id])
+                                                                  .where(requests.c.scope == self.scope)))
+        delete_rows(requests, requests.c.scope == self.scope)
+        delete_rows(RequestDataKey.__table__, RequestDataKey.__table__.c.scope == self.scope)
+        for coll_name, coll_id, edge_name in self.collections:
+            if coll_id:
+                delete_rows(contents, contents.c.coll_id == coll_id)
+                delete_collection(self.scope, coll_name, coll_id=coll_id)
+        for edge_name, edge_id in self.edges:
+            if edge_id:
+                delete_content_counters(edge_id=edge_id)
+                delete_edge(edge_name)
+
+
+def add_scale_arguments(parser):
+    parser.add_argument('--contents', type=int, default=100000, help='Number of contents, FILE and PARTIAL')
+    parser.add_argument('--requests', type=int, default=10000, help='Number of requests')
+    parser.add_argument('--edges', type=int, default=4, help='Number of edges')
+    parser.add_argument('--files-per-collection', type=int, default=100, help='Number of FILE contents per collection')
+    parser.add_argument('--partials-per-file', type=int, default=10, help='Number of PARTIAL contents per FILE content')
+    parser.add_argument('--events-per-file', type=int, default=1000, help='Number of events per FILE content')
+    parser.add_argument('--tag', help='Tag of the catalog, to reuse or clean a catalog generated before')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random statuses and priorities')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_INSERT_CHUNK_SIZE, help='Number of rows per insert transaction')
+
+
+def get_generator(args):
+    return CatalogGenerator(num_contents=args.contents, num_requests=args.requests, num_edges=args.edges,
+                            files_per_collection=args.files_per_collection, partials_per_file=args.partials_per_file,
+                            events_per_file=args.events_per_file, tag=args.tag, seed=args.seed, chunk_size=args.chunk_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic catalog")
+    add_scale_arguments(parser)
+    parser.add_argument('--clean', action='store_true', default=False, help='Delete the catalog of the tag')
+    args = parser.parse_args()
+
+    generator = get_generator(args)
+    if args.clean:
+        if not args.tag:
+            parser.error('--clean requires --tag')
+        generator.load()
+        generator.clean()
+    else:
+        summary = generator.get_scale()
+        summary.update(generator.generate(verbose=True))
+        print(json.dumps(summary, indent=4, sort_keys=True))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Move the finished contents and requests to the archive tables once, in batches, for example
+to archive the history of an existing database before starting the Archiver daemon.
+"""
+
+import argparse
+
+from ess.core.archive import (ARCHIVE_CONTENT_STATUSES, ARCHIVE_REQUEST_STATUSES, DEFAULT_ARCHIVE_AGE,
+                              DEFAULT_ARCHIVE_BATCH_SIZE, archive_contents, archive_requests, purge_archives)
+
+
+def run_batches(func, batch_size, **kwargs):
+    total = 0
+    while True:
+        num = func(limit=batch_size, **kwargs)
+        total += num
+        if num < batch_size:
+            return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Move the finished contents and requests to the archive tables")
+    parser.add_argument('--older-than', type=int, default=DEFAULT_ARCHIVE_AGE, help='Seconds since the last update')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_ARCHIVE_BATCH_SIZE, help='Rows moved per transaction')
+    parser.add_argument('--content-statuses', nargs='+', default=[str(s) for s in ARCHIVE_CONTENT_STATUSES],
+                        help='Statuses of the contents to archive')
+    parser.add_argument('--request-statuses', nargs='+', default=[str(s) for s in ARCHIVE_REQUEST_STATUSES],
+                        help='Statuses of the requests to archive')
+    parser.add_argument('--purge-after', type=int, default=0, help='Delete the rows archived for more seconds, 0 to keep them')
+    args = parser.parse_args()
+
+    num_contents = run_batches(archive_contents, args.batch_size, statuses=args.content_statuses, older_than=args.older_than)
+    num_requests = run_batches(archive_requests, args.batch_size, statuses=args.request_statuses, older_than=args.older_than)
+    print("Archived %s contents and %s requests" % (num_contents, num_requests))
+    if args.purge_after:
+        print("Purged %s archived rows" % run_batches(purge_archives, args.batch_size, older_than=args.purge_after))
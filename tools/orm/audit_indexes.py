@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Audit the indexes of the contents and requests tables against the query shapes of the daemons.
+
+A dataset is generated, the hot core functions are run while their statements are captured from
+the engine, and every captured statement is explained with the plan of the database (sqlite, mysql,
+postgresql or oracle). The captured selects are timed.
+
+With --compare, the audit runs with the previous index set, then with the index set of the models,
+to measure the plans and the latencies of both. --migrate prints the statements to migrate the
+indexes of an existing database to the index set of the models.
+"""
+
+import argparse
+import datetime
+import itertools
+import random
+import time
+
+from contextlib import contextmanager
+from uuid import uuid4 as uuid
+
+from sqlalchemy import event
+from sqlalchemy.engine import reflection
+
+from ess.core.archive import archive_contents, archive_requests
+from ess.core.catalog import (add_collection, add_contents, claim_contents, delete_collection, get_content_best_match,
+                              get_contents_by_edge, iter_contents_by_edge, reclaim_expired_contents)
+from ess.core.counters import reconcile_content_counters
+from ess.core.edges import register_edge, delete_edge
+from ess.core.requests import get_requests, get_requests_by_edge
+from ess.daemons.stager.daemon import STAGER_COLUMNS
+from ess.orm.constants import ContentType, ContentStatus, DataType, GranularityType, RequestStatus
+from ess.orm.models import CollectionContent, Request
+from ess.orm.session import get_engine, transactional_session, unit_of_work
+
+
+AUDITED_TABLES = [CollectionContent.__table__, Request.__table__]
+
+# the index set before the audit
+LEGACY_INDEXES = {'ess_coll_content': [('ESS_CONTENT_SCOPE_NAME_IDX', ['scope', 'name', 'edge_id', 'status']),
+                                       ('ESS_CONTENT_SCOPE_NAME_MM_IDX', ['scope', 'name', 'content_type', 'min_id', 'max_id', 'edge_id', 'status']),
+                                       ('ESS_CONTENT_BEST_MATCH_IDX', ['scope', 'name', 'status', 'min_id', 'max_id']),
+                                       ('ESS_CONTENT_COLLECTION_ID_IDX', ['coll_id', 'status']),
+                                       ('ESS_CONTENT_EDGE_ID_IDX', ['edge_id', 'status']),
+                                       ('ESS_CONTENT_STATUS_PRIO_IDX', ['status', 'priority']),
+                                       ('ESS_CONTENT_LEASE_IDX', ['status', 'lease_expired_at'])],
+                  'ess_requests': [('ESS_REQUESTS_SCOPE_NAME_IDX', ['scope', 'name', 'data_type', 'request_id']),
+                                   ('ESS_REQUESTS_STATUS_PRIO_IDX', ['status', 'priority', 'request_id'])]}
+
+CONTENT_STATUSES = [(ContentStatus.AVAILABLE, ContentType.PARTIAL, 60), (ContentStatus.REMOVED, ContentType.PARTIAL, 15),
+                    (ContentStatus.TOSPLIT, ContentType.PARTIAL, 5), (ContentStatus.SPLITTING, ContentType.PARTIAL, 5),
+                    (ContentStatus.TOSTAGEDOUT, ContentType.PARTIAL, 5), (ContentStatus.STAGINGOUT, ContentType.PARTIAL, 5),
+                    (ContentStatus.PRECACHED, ContentType.FILE, 5)]
+REQUEST_STATUSES = [(RequestStatus.AVAILABLE, 70), (RequestStatus.ERROR, 10), (RequestStatus.NEW, 5),
+                    (RequestStatus.ASSIGNED, 5), (RequestStatus.PRECACHED, 5), (RequestStatus.SPLITTING, 5)]
+
+
+def get_model_indexes(table):
+    return [(index.name, [column.name for column in index.columns]) for index in table.indexes]
+
+
+def get_index_set(name):
+    if name == 'legacy':
+        return LEGACY_INDEXES
+    return dict([(table.name, get_model_indexes(table)) for table in AUDITED_TABLES])
+
+
+def create_index_statement(table_name, index_name, columns):
+    return "CREATE INDEX %s ON %s (%s)" % (index_name, table_name, ', '.join(columns))
+
+
+def drop_index_statement(dialect, table_name, index_name):
+    if dialect == 'mysql':
+        return "DROP INDEX %s ON %s" % (index_name, table_name)
+    return "DROP INDEX %s" % index_name
+
+
+def get_migration(engine, index_set):
+    """
+    Get the statements to replace the indexes of the audited tables by an index set.
+    The indexes of the unique and primary key constraints are kept.
+    """
+    inspector = reflection.Inspector.from_engine(engine)
+    statements = []
+    for table in AUDITED_TABLES:
+        unique_names = set([constraint['name'].lower() for constraint in inspector.get_unique_constraints(table.name)
+                            if constraint.get('name')])
+        existing = dict([(index['name'].lower(), index['column_names']) for index in inspector.get_indexes(table.name)
+                         if not index.get('unique') and index['name'].lower() not in unique_names])
+        wanted = dict([(name.lower(), (name, columns)) for name, columns in index_set[table.name]])
+        for name, columns in sorted(existing.items()):
+            if name not in wanted or wanted[name][1] != columns:
+                statements.append(drop_index_statement(engine.dialect.name, table.name, name))
+        for name, (index_name, columns) in sorted(wanted.items()):
+            if name not in existing or existing[name] != columns:
+                statements.append(create_index_statement(table.name, index_name, columns))
+    return statements
+
+
+def apply_index_set(engine, name):
+    connection = engine.connect()
+    try:
+        for statement in get_migration(engine, get_index_set(name)):
+            connection.execute(statement)
+        if engine.dialect.name in ('sqlite', 'postgresql'):
+            connection.execute("ANALYZE")
+    finally:
+        connection.close()
+
+
+def weighted_choice(choices):
+    total = sum([choice[-1] for choice in choices])
+    point = random.uniform(0, total)
+    for choice in choices:
+        point -= choice[-1]
+        if point <= 0:
+            return choice
+    return choices[-1]
+
+
+class Dataset(object):
+    """
+    Contents and requests spread over edges and collections, with realistic status proportions.
+    """
+
+    def __init__(self, num_contents, num_requests, num_edges, files_per_collection=100, ranges_per_file=100):
+        self.edges = []
+        self.collections = []
+        self.request_ids = []
+        self.scope = 'audit_scope'
+
+        for i in range(num_edges):
+            edge_name = ('audit_edge_%s' % str(uuid()))[:29]
+            self.edges.append((edge_name, register_edge(edge_name)))
+
+        contents_per_collection = files_per_collection * ranges_per_file
+        for i in range(max(num_contents // contents_per_collection, 1)):
+            edge_name, edge_id = self.edges[i % num_edges]
+            coll_name = 'audit_coll_%s' % str(uuid())
+            coll_id = add_collection(scope=self.scope, name=coll_name)
+            self.collections.append((coll_name, coll_id, edge_name, edge_id))
+
+            files = []
+            for j in range(contents_per_collection):
+                status, content_type, weight = weighted_choice(CONTENT_STATUSES)
+                min_id = j % ranges_per_file * 100
+                files.append({'scope': self.scope, 'name': '%s_file_%s' % (coll_name, j // ranges_per_file),
+                              'min_id': min_id, 'max_id': min_id + 99, 'content_type': content_type, 'status': status,
+                              'priority': random.randint(0, 100), 'pfn_size': 1024,
+                              'lease_expired_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=60)})
+            add_contents(self.scope, coll_name, edge_name, files)
+
+        self.request_ids = self.add_requests(num_requests)
+
+    @transactional_session
+    def add_requests(self, num_requests, session=None):
+        table = Request.__table__
+        rows = []
+        for i in range(num_requests):
+            status, weight = weighted_choice(REQUEST_STATUSES)
+            rows.append({'scope': self.scope, 'name': 'audit_request_%s' % str(uuid()), 'data_type': DataType.DATASET,
+                         'granularity_type': GranularityType.PARTIAL, 'granularity_level': 100,
+                         'priority': random.randint(0, 100), 'edge_id': self.edges[i % len(self.edges)][1],
+                         'status': status, 'created_at': datetime.datetime.utcnow(),
+                         'updated_at': datetime.datetime.utcnow()})
+        if rows:
+            session.execute(table.insert(), rows)
+        return [row[0] for row in session.execute(table.select().with_only_columns([table.c.request_id])
+                                                  .where(table.c.scope == self.scope))]
+
+    @transactional_session
+    def clean(self, session=None):
+        contents, requests = CollectionContent.__table__, Request.__table__
+        session.execute(requests.delete().where(requests.c.scope == self.scope))
+        for coll_name, coll_id, edge_name, edge_id in self.collections:
+            session.execute(contents.delete().where(contents.c.coll_id == coll_id))
+            delete_collection(self.scope, coll_name, coll_id=coll_id, session=session)
+        for edge_name, edge_id in self.edges:
+            delete_edge(edge_name, session=session)
+
+
+def get_workload(dataset):
+    """
+    The calls of the hot core functions, as the daemons and the REST service issue them.
+    """
+    coll_name, coll_id, edge_name, edge_id = dataset.collections[0]
+    file_name = '%s_file_%s' % (coll_name, 0)
+    return [('stager claim', lambda: claim_contents(edge_name, ContentStatus.TOSTAGEDOUT, ContentStatus.STAGINGOUT, limit=100,
+                                                    edge_id=edge_id, columns=STAGER_COLUMNS)),
+            ('splitter claim', lambda: claim_contents(edge_name, ContentStatus.TOSPLIT, ContentStatus.SPLITTING, limit=100,
+                                                      edge_id=edge_id, content_type=ContentType.PARTIAL)),
+            ('splitter files', lambda: list(iter_contents_by_edge(edge_name, edge_id=edge_id, coll_id=coll_id,
+                                                                  content_type=ContentType.FILE, status=ContentStatus.PRECACHED,
+                                                                  columns=['scope', 'name', 'min_id', 'max_id']))),
+            ('reclaim leases', lambda: reclaim_expired_contents({ContentStatus.STAGINGOUT: ContentStatus.TOSTAGEDOUT,
+                                                                 ContentStatus.SPLITTING: ContentStatus.TOSPLIT}, edge_id=edge_id)),
+            ('finisher sync', lambda: list(itertools.islice(iter_contents_by_edge(edge_name, edge_id=edge_id, coll_id=coll_id), 1000))),
+            ('reconcile counters', lambda: reconcile_content_counters(edge_id=edge_id, coll_id=coll_id)),
+            ('contents by edge', lambda: get_contents_by_edge(edge_name, edge_id=edge_id, status=ContentStatus.AVAILABLE, limit=100)),
+            ('best match', lambda: get_content_best_match(dataset.scope, file_name, min_id=150, max_id=160, edge_id=edge_id,
+                                                          status=ContentStatus.AVAILABLE)),
+            ('new requests', lambda: get_requests(status=RequestStatus.NEW)),
+            ('requests of edge', lambda: get_requests(status=RequestStatus.ASSIGNED, edge_id=edge_id)),
+            ('requests by edge', lambda: get_requests_by_edge(edge_name, edge_id=edge_id)),
+            ('archive contents', lambda: archive_contents(edge_id=edge_id)),
+            ('archive requests', lambda: archive_requests(edge_id=edge_id))]
+
+
+@contextmanager
+def capture_statements(engine, statements):
+    """
+    Capture the distinct statements on the audited tables with their first parameters.
+    """
+    names = [table.name for table in AUDITED_TABLES]
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        keyword = statement.strip().split(None, 1)[0].upper()
+        if executemany or keyword not in ('SELECT', 'UPDATE', 'DELETE') or not [n for n in names if n in statement]:
+            return
+        if statement not in [captured[0] for captured in statements]:
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def explain(engine, statement, parameters):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        dialect = engine.dialect.name
+        if dialect == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+        elif dialect == 'mysql':
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            keys = [column[0] for column in cursor.description]
+            plan = ['%s: key=%s rows=%s %s' % (row[keys.index('table')], row[keys.index('key')],
+                                               row[keys.index('rows')], row[keys.index('Extra')] or '')
+                    for row in cursor.fetchall()]
+        elif dialect == 'postgresql':
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            plan = [row[0] for row in cursor.fetchall()]
+        elif dialect == 'oracle':
+            cursor.execute('EXPLAIN PLAN FOR ' + statement, parameters)
+            cursor.execute("SELECT plan_table_output FROM TABLE(DBMS_XPLAN.DISPLAY(NULL, NULL, 'BASIC'))")
+            plan = [row[0] for row in cursor.fetchall()]
+        else:
+            plan = ['EXPLAIN is not supported on %s' % dialect]
+        cursor.close()
+        return plan
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def time_statement(engine, statement, parameters, repeat):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        latencies = []
+        for i in range(repeat):
+            start = time.time()
+            cursor.execute(statement, parameters)
+            cursor.fetchall()
+            latencies.append((time.time() - start) * 1000.0)
+        cursor.close()
+        return sorted(latencies)[len(latencies) // 2]
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def audit(engine, dataset, repeat):
+    """
+    Run the workload, and explain and time its statements.
+
+    :returns: list of (shape, statement, plan, median latency in ms or None).
+    """
+    results = []
+    for shape, call in get_workload(dataset):
+        statements = []
+        with capture_statements(engine, statements):
+            with unit_of_work():
+                call()
+        for statement, parameters in statements:
+            plan = explain(engine, statement, parameters)
+            latency = None
+            if statement.strip().upper().startswith('SELECT'):
+                latency = time_statement(engine, statement, parameters, repeat)
+            results.append((shape, statement, plan, latency))
+    return results
+
+
+def print_results(name, results):
+    print("=== index set: %s" % name)
+    for shape, statement, plan, latency in results:
+        print("--- %s: %s" % (shape, ' '.join(statement.split())[:160]))
+        for line in plan:
+            print("    %s" % line)
+        if latency is not None:
+            print("    median latency: %.3f ms" % latency)
+
+
+def print_comparison(legacy, current):
+    print("=== %-20s %14s %14s" % ('shape', 'legacy (ms)', 'current (ms)'))
+    current_latencies = dict([((shape, statement), latency) for shape, statement, plan, latency in current])
+    for shape, statement, plan, latency in legacy:
+        if latency is not None and current_latencies.get((shape, statement)) is not None:
+            print("    %-20s %14.3f %14.3f" % (shape, latency, current_latencies[(shape, statement)]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Audit the indexes of the contents and requests tables")
+    parser.add_argument('--contents', type=int, default=100000, help='Number of generated contents')
+    parser.add_argument('--requests', type=int, default=10000, help='Number of generated requests')
+    parser.add_argument('--edges', type=int, default=4, help='Number of generated edges')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of executions to time a select')
+    parser.add_argument('--compare', action='store_true', default=False,
+                        help='Audit with the previous index set, then with the index set of the models')
+    parser.add_argument('--migrate', action='store_true', default=False,
+                        help='Only print the statements to migrate the indexes to the index set of the models')
+    parser.add_argument('--keep-data', action='store_true', default=False, help='Keep the generated dataset')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.migrate:
+        for statement in get_migration(engine, get_index_set('current')):
+            print(statement + ';')
+    else:
+        random.seed(0)
+        dataset = Dataset(args.contents, args.requests, args.edges)
+        try:
+            if args.compare:
+                apply_index_set(engine, 'legacy')
+                legacy = audit(engine, dataset, args.repeat)
+                print_results('legacy', legacy)
+            apply_index_set(engine, 'current')
+            current = audit(engine, dataset, args.repeat)
+            print_results('current', current)
+            if args.compare:
+                print_comparison(legacy, current)
+        finally:
+            if not args.keep_data:
+                dataset.clean()
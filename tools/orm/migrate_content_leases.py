@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Migrate an existing database to the leases of the contents: add the lease_owner and lease_expired_at
+columns and the missing indexes of the contents, and give the contents left in a leased status by the
+daemons before the leases a lease, in batches, so that they are reclaimed once it has expired instead
+of at the first reclaim of the upgraded daemons.
+"""
+
+import argparse
+import datetime
+
+from sqlalchemy import inspect, select
+from sqlalchemy.schema import CreateIndex
+
+from ess.orm import models
+from ess.orm.constants import ContentStatus
+from ess.orm.session import get_engine
+from ess.orm.utils import DEFAULT_CHUNK_SIZE
+
+
+LEASE_COLUMNS = ('lease_owner', 'lease_expired_at')
+LEASED_STATUSES = (ContentStatus.SPLITTING, ContentStatus.STAGINGOUT)
+
+
+def get_column_statements(engine, table):
+    """
+    Get the statements adding the lease columns missing in the database.
+    """
+    if not engine.dialect.has_table(engine, table.name):
+        return []
+    existing = [column['name'].lower() for column in inspect(engine).get_columns(table.name)]
+    statements = []
+    for name in LEASE_COLUMNS:
+        if name not in existing:
+            column = table.c[name]
+            column_type = column.type.compile(dialect=engine.dialect)
+            if engine.dialect.name == 'oracle':
+                statements.append("ALTER TABLE %s ADD (%s %s)" % (table.fullname, name, column_type))
+            else:
+                statements.append("ALTER TABLE %s ADD COLUMN %s %s" % (table.fullname, name, column_type))
+    return statements
+
+
+def get_index_statements(engine, table):
+    """
+    Get the statements creating the indexes of the model missing in the database.
+    """
+    existing = [index['name'].lower() for index in inspect(engine).get_indexes(table.name) if index['name']]
+    return [str(CreateIndex(index).compile(dialect=engine.dialect)).strip()
+            for index in sorted(table.indexes, key=lambda index: index.name) if index.name.lower() not in existing]
+
+
+def backfill_leases(connection, table, lease_seconds=3600, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Give the contents in a leased status without a lease a lease expiring after lease_seconds, in batches.
+
+    :returns: number of updated contents.
+    """
+    lease_expired_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_seconds)
+    query = select([table.c.content_id]).where(table.c.status.in_(LEASED_STATUSES))\
+                                        .where(table.c.lease_expired_at.is_(None))\
+                                        .order_by(table.c.content_id).limit(chunk_size)
+    updated, last_content_id = 0, None
+    while True:
+        page = query if last_content_id is None else query.where(table.c.content_id > last_content_id)
+        content_ids = [row[0] for row in connection.execute(page)]
+        if not content_ids:
+            return updated
+        if not dry_run:
+            with connection.begin():
+                connection.execute(table.update().where(table.c.content_id.in_(content_ids))
+                                                 .where(table.c.lease_expired_at.is_(None))
+                                                 .values(lease_expired_at=lease_expired_at))
+        updated += len(content_ids)
+        last_content_id = content_ids[-1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate a database to the leases of the contents")
+    parser.add_argument('--lease-seconds', type=int, default=3600, help='Lifetime of the leases given to the leased contents')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Number of contents updated at once')
+    parser.add_argument('--dry-run', action='store_true', default=False, help='Only print the statements')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    connection = engine.connect()
+    try:
+        table = models.CollectionContent.__table__
+        statements = get_column_statements(engine, table)
+        statements += get_column_statements(engine, models.CollectionContentArchive.__table__)
+        for statement in statements:
+            print(statement)
+            if not args.dry_run:
+                connection.execute(statement)
+        for statement in get_index_statements(engine, table):
+            print(statement)
+            if not args.dry_run:
+                connection.execute(statement)
+        if args.dry_run and get_column_statements(engine, table):
+            print("The lease columns are missing, the contents to give a lease cannot be counted")
+        else:
+            print("Gave a lease to %s contents" % backfill_leases(connection, table, args.lease_seconds,
+                                                                  args.chunk_size, args.dry_run))
+    finally:
+        connection.close()
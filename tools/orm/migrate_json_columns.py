@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Migrate the JSON columns of a mysql database created as VARCHAR(1024) to the native JSON type,
+or to MEDIUMTEXT if the server has no native JSON type.
+"""
+
+import argparse
+
+from ess.orm import models
+from ess.orm.session import get_engine
+from ess.orm.types import JSON, mysql_has_native_json
+
+
+def get_json_columns():
+    for table in models.BASE.metadata.sorted_tables:
+        for column in table.columns:
+            if isinstance(column.type, JSON):
+                yield table, column
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate the JSON columns of a mysql database")
+    parser.add_argument('--dry-run', action='store_true', default=False, help='Only print the statements')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    connection = engine.connect()
+    try:
+        if engine.dialect.name != 'mysql':
+            print("Only mysql databases need to be migrated, the database is %s" % engine.dialect.name)
+        else:
+            column_type = 'JSON' if mysql_has_native_json(engine.dialect) else 'MEDIUMTEXT'
+            for table, column in get_json_columns():
+                statement = "ALTER TABLE %s MODIFY %s %s" % (table.fullname, column.name, column_type)
+                print(statement)
+                if not args.dry_run:
+                    connection.execute(statement)
+    finally:
+        connection.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Migrate an existing database to the required request priorities: set the priority of the requests
+without one to 0, in batches, and add the not null constraint of the priorities. The requests are
+fetched in the order of their priority, and the requests without one would never be fetched after
+another request.
+"""
+
+import argparse
+
+from sqlalchemy import select
+
+from ess.orm import models
+from ess.orm.session import get_engine
+from ess.orm.utils import DEFAULT_CHUNK_SIZE
+
+
+def get_constraint_statements(dialect, table):
+    if dialect in ('postgresql', 'oracle', 'mysql'):
+        return ["ALTER TABLE %s ADD CONSTRAINT ESS_REQ_PRIORITY_NN CHECK (priority IS NOT NULL)" % table.fullname]
+    return []
+
+
+def backfill_priorities(connection, table, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Set the priority of the requests without one to 0, in batches.
+
+    :returns: number of updated requests.
+    """
+    query = select([table.c.request_id]).where(table.c.priority.is_(None)).order_by(table.c.request_id).limit(chunk_size)
+    updated, last_request_id = 0, None
+    while True:
+        page = query if last_request_id is None else query.where(table.c.request_id > last_request_id)
+        request_ids = [row[0] for row in connection.execute(page)]
+        if not request_ids:
+            return updated
+        if not dry_run:
+            with connection.begin():
+                connection.execute(table.update().where(table.c.request_id.in_(request_ids)).values(priority=0))
+        updated += len(request_ids)
+        last_request_id = request_ids[-1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate a database to the required request priorities")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Number of requests updated at once')
+    parser.add_argument('--dry-run', action='store_true', default=False, help='Only count the requests and print the statements')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    connection = engine.connect()
+    try:
+        table = models.Request.__table__
+        print("Set the priority of %s requests to 0" % backfill_priorities(connection, table, args.chunk_size, args.dry_run))
+        if engine.dialect.name == 'sqlite':
+            print("The constraints of a sqlite database cannot be altered, the database has to be recreated")
+        for statement in get_constraint_statements(engine.dialect.name, table):
+            print(statement)
+            if not args.dry_run:
+                connection.execute(statement)
+    finally:
+        connection.close()
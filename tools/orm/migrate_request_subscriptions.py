@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Migrate an existing database to the request subscriptions: create the subscriptions and the data keys
+tables, add the SUBSCRIBED status to the status types of the requests and of the archived requests and
+set the oldest request in flight of every data as the primary request of its data key.
+"""
+
+import argparse
+import datetime
+
+from sqlalchemy import DateTime, func, literal, select
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from ess.core.requests import COALESCED_STATUSES, DATA_KEY_COLUMNS
+from ess.orm import models
+from ess.orm.constants import RequestStatus
+from ess.orm.session import get_engine
+
+
+STATUS_COLUMNS = [(models.Request.__table__, 'ESS_REQUESTS_STATUS'), (models.RequestArchive.__table__, 'ESS_REQ_ARCH_STATUS')]
+
+
+def get_status_statements(dialect, preparer):
+    values = ', '.join(["'%s'" % value for value in RequestStatus.values()])
+    statements = []
+    for table, type_name in STATUS_COLUMNS:
+        if dialect == 'postgresql':
+            statements.append("ALTER TYPE %s ADD VALUE IF NOT EXISTS '%s'" % (preparer.quote(type_name), RequestStatus.SUBSCRIBED.value))
+        elif dialect == 'mysql':
+            statements.append("ALTER TABLE %s MODIFY status ENUM(%s)" % (table.fullname, values))
+        elif dialect == 'oracle':
+            statements.append("ALTER TABLE %s DROP CONSTRAINT %s" % (table.fullname, type_name))
+            statements.append("ALTER TABLE %s ADD CONSTRAINT %s CHECK (status IN (%s))" % (table.fullname, type_name, values))
+    return statements
+
+
+def get_table_statements(engine, connection):
+    statements = []
+    for table in (models.RequestSubscription.__table__, models.RequestDataKey.__table__):
+        if not engine.dialect.has_table(connection, table.name):
+            statements.append(str(CreateTable(table).compile(engine)).strip())
+            statements += [str(CreateIndex(index).compile(engine)) for index in table.indexes]
+    return statements
+
+
+def get_data_keys_statement():
+    """
+    Insert the data keys of the requests in flight, with their oldest request as primary request.
+    """
+    requests, data_keys = models.Request.__table__, models.RequestDataKey.__table__
+    now = datetime.datetime.utcnow()
+    # the requests without granularity level have the level -1 in the data keys
+    columns = [requests.c.scope, requests.c.name, requests.c.data_type, requests.c.granularity_type,
+               func.coalesce(requests.c.granularity_level, -1)]
+    query = select(columns + [func.min(requests.c.request_id), literal(now, DateTime()), literal(now, DateTime())])\
+        .where(requests.c.status.in_(COALESCED_STATUSES)).group_by(*columns)
+    return data_keys.insert().from_select(DATA_KEY_COLUMNS + ['request_id', 'created_at', 'updated_at'], query)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate a database to the request subscriptions")
+    parser.add_argument('--dry-run', action='store_true', default=False, help='Only print the statements')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    connection = engine.connect()
+    try:
+        if engine.dialect.name == 'sqlite':
+            print("The status constraints of a sqlite database cannot be altered, the database has to be recreated")
+        else:
+            new_data_keys = not engine.dialect.has_table(connection, models.RequestDataKey.__table__.name)
+            statements = get_status_statements(engine.dialect.name, engine.dialect.identifier_preparer)
+            statements += get_table_statements(engine, connection)
+            for statement in statements:
+                print(statement)
+                if not args.dry_run:
+                    connection.execute(statement)
+            if new_data_keys:
+                statement = get_data_keys_statement()
+                print(str(statement.compile(engine)))
+                if not args.dry_run:
+                    connection.execute(statement)
+    finally:
+        connection.close()
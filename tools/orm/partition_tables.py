@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Partition the archive tables by month of archived_at on mysql, postgresql (11 or later) and oracle,
+so that the old archives can be dropped by partition. On oracle (12.2 or later), the hot tables
+can also be partitioned by list of status, separating the terminal rows from the active ones.
+
+MySQL and PostgreSQL require the partition key in the primary key, so their hot tables, with the
+content_id and request_id primary keys, are not partitioned by status.
+
+The statements are printed, and only executed with --execute.
+"""
+
+import argparse
+import datetime
+
+from ess.core.archive import ARCHIVE_CONTENT_STATUSES, ARCHIVE_REQUEST_STATUSES
+from ess.orm.models import CollectionContent, CollectionContentArchive, Request, RequestArchive
+from ess.orm.session import get_engine
+
+
+ARCHIVE_TABLES = [CollectionContentArchive.__table__, RequestArchive.__table__]
+HOT_TABLES = [(CollectionContent.__table__, ARCHIVE_CONTENT_STATUSES), (Request.__table__, ARCHIVE_REQUEST_STATUSES)]
+
+
+def get_months(start, num_months):
+    """
+    Get the first days of num_months + 1 successive months from the month of start.
+    """
+    year, month = start.year, start.month
+    months = []
+    for i in range(num_months + 1):
+        months.append(datetime.date(year + (month - 1 + i) // 12, (month - 1 + i) % 12 + 1, 1))
+    return months
+
+
+def mysql_archive_partitions(table, months):
+    partitions = ["PARTITION p%s VALUES LESS THAN (TO_DAYS('%s'))" % (months[i - 1].strftime('%Y%m'), months[i].isoformat())
+                  for i in range(1, len(months))]
+    partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return ["ALTER TABLE %s PARTITION BY RANGE (TO_DAYS(archived_at)) (%s)" % (table.fullname, ', '.join(partitions))]
+
+
+def postgresql_archive_partitions(table, months):
+    # an existing table cannot be partitioned, it is replaced by a partitioned copy
+    statements = ["ALTER TABLE %s RENAME TO %s_unpartitioned" % (table.fullname, table.name),
+                  "CREATE TABLE %s (LIKE %s_unpartitioned INCLUDING ALL) PARTITION BY RANGE (archived_at)" % (table.fullname, table.fullname)]
+    for i in range(1, len(months)):
+        statements.append("CREATE TABLE %s_p%s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s')" %
+                          (table.fullname, months[i - 1].strftime('%Y%m'), table.fullname, months[i - 1].isoformat(), months[i].isoformat()))
+    statements.append("CREATE TABLE %s_pdefault PARTITION OF %s DEFAULT" % (table.fullname, table.fullname))
+    statements.append("INSERT INTO %s SELECT * FROM %s_unpartitioned" % (table.fullname, table.fullname))
+    statements.append("DROP TABLE %s_unpartitioned" % table.fullname)
+    return statements
+
+
+def oracle_archive_partitions(table, months):
+    # interval partitioning creates the partitions of the next months automatically
+    return ["ALTER TABLE %s MODIFY PARTITION BY RANGE (archived_at) INTERVAL (NUMTOYMINTERVAL(1, 'MONTH')) "
+            "(PARTITION p_before_%s VALUES LESS THAN (TO_DATE('%s', 'YYYY-MM-DD'))) ONLINE" %
+            (table.fullname, months[0].strftime('%Y%m'), months[0].isoformat())]
+
+
+def oracle_status_partitions(table, statuses):
+    values = ', '.join(["'%s'" % status.value for status in statuses])
+    return ["ALTER TABLE %s ENABLE ROW MOVEMENT" % table.fullname,
+            "ALTER TABLE %s MODIFY PARTITION BY LIST (status) (PARTITION p_terminal VALUES (%s), "
+            "PARTITION p_active VALUES (DEFAULT)) ONLINE UPDATE INDEXES" % (table.fullname, values)]
+
+
+ARCHIVE_PARTITIONS = {'mysql': mysql_archive_partitions,
+                      'postgresql': postgresql_archive_partitions,
+                      'oracle': oracle_archive_partitions}
+
+
+def get_statements(dialect, start, num_months, hot_tables=False):
+    if dialect not in ARCHIVE_PARTITIONS:
+        raise Exception("Partitioning is not supported on %s" % dialect)
+
+    statements = []
+    months = get_months(start, num_months)
+    for table in ARCHIVE_TABLES:
+        statements += ARCHIVE_PARTITIONS[dialect](table, months)
+    if hot_tables:
+        if dialect != 'oracle':
+            raise Exception("The hot tables can only be partitioned by status on oracle")
+        for table, statuses in HOT_TABLES:
+            statements += oracle_status_partitions(table, statuses)
+    return statements
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Partition the archive tables by month, and the hot tables by status on oracle")
+    parser.add_argument('--start', default=datetime.date.today().strftime('%Y-%m'), help='First month of the partitions, YYYY-MM')
+    parser.add_argument('--months', type=int, default=12, help='Number of monthly partitions to create')
+    parser.add_argument('--hot-tables', action='store_true', default=False, help='Also partition the hot tables by status (oracle)')
+    parser.add_argument('--dialect', default=None, help='Database dialect, the dialect of the configured database by default')
+    parser.add_argument('--execute', action='store_true', default=False, help='Execute the statements')
+    args = parser.parse_args()
+
+    start = datetime.datetime.strptime(args.start, '%Y-%m').date()
+    engine = get_engine() if args.execute or not args.dialect else None
+    dialect = args.dialect or engine.dialect.name
+
+    statements = get_statements(dialect, start, args.months, hot_tables=args.hot_tables)
+    for statement in statements:
+        print(statement + ';')
+
+    if args.execute:
+        connection = engine.connect()
+        try:
+            for statement in statements:
+                connection.execute(statement)
+        finally:
+            connection.close()
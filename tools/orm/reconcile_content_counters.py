@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0OA
+#
+# Authors:
+# - Wen Guan, <wen.guan@cern.ch>, 2019
+
+
+"""
+Recompute the content counters from the contents, for example to fill them for existing contents.
+"""
+
+import argparse
+
+from ess.core.counters import reconcile_content_counters
+from ess.core.edges import get_edge_id
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recompute the content counters")
+    parser.add_argument('--edge-name', default=None, help='Only reconcile the counters of an edge')
+    parser.add_argument('--coll-id', type=int, default=None, help='Only reconcile the counters of a collection')
+    args = parser.parse_args()
+
+    edge_id = get_edge_id(args.edge_name) if args.edge_name else None
+    corrected = reconcile_content_counters(edge_id=edge_id, coll_id=args.coll_id)
+    print("Corrected %s content counters" % corrected)